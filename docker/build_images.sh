@@ -3,6 +3,27 @@
 # Exit immediately if a command exits with a non-zero status
 set -e
 
+# Usage: ./build_images.sh [--bot <BOT_DIR> [<BASE_IMAGE>]]
+# With --bot, only the image of the bot is built on top of the game image (starcraft:game by default),
+# with the bot files laid out in bwapi-data and the wine prefix initialised.
+# The observer uses it automatically, like images built by `observer --build_bot_image`.
+if [ "${1:-}" == "--bot" ]; then
+    BOT_PATH="$(cd "$2" && pwd)"
+    BASE_IMAGE="${3:-starcraft:game}"
+    BOT_NAME="$(basename "$BOT_PATH")"
+    BOT_SLUG="$(echo "$BOT_NAME" | tr '[:upper:]' '[:lower:]' | sed 's/[^a-z0-9_.-]/_/g')"
+    case "${BASE_IMAGE##*/}" in
+        *:*) BOT_IMAGE="${BASE_IMAGE}-bot-${BOT_SLUG}" ;;
+        *) BOT_IMAGE="${BASE_IMAGE}:latest-bot-${BOT_SLUG}" ;;
+    esac
+
+    docker build -f "$(pwd)/../observer/local_docker/bot.dockerfile" \
+        --build-arg BASE_IMAGE="$BASE_IMAGE" --build-arg BOT_NAME="$BOT_NAME" \
+        -t "$BOT_IMAGE" "$BOT_PATH"
+    echo "Image $BOT_IMAGE built successfully!"
+    exit 0
+fi
+
 # Build images
 docker build -f dockerfiles/wine.dockerfile -t starcraft:wine .
 docker build -f dockerfiles/bwapi.dockerfile -t starcraft:bwapi .
@@ -5,6 +5,14 @@ function LOG() {
     echo `date +%Y-%m-%dT%H:%M:%S` "$@"
 }
 
+# Lean profile for unattended extraction: no VNC server, a cheaper X server
+# and StarCraft settings which render and play less, see start_gui, update_registry and prepare_bwapi
+IS_LEAN="${LEAN_PROFILE:-0}"
+if [ "$IS_LEAN" == "1" ]; then
+    # wine debug output is formatted even when nobody reads it
+    export WINEDEBUG="-all"
+fi
+
 # From https://stackoverflow.com/a/24413646
 #
 # Usage: run_with_timeout N cmd args...
@@ -26,6 +34,57 @@ function run_with_timeout () {
     )
 }
 
+# Usage: wait_until TIMEOUT cmd args...
+# Polls until cmd succeeds, returns non-zero if it does not within TIMEOUT seconds.
+function wait_until() {
+    local deadline=$(( $(date +%s%N) + ${1} * 1000000000 )); shift
+    until "$@"; do
+        if [ "$(date +%s%N)" -ge "$deadline" ]; then
+            return 1
+        fi
+        sleep 0.05
+    done
+}
+
+# Readiness signals, the observer waits for them instead of sleeping.
+# Each marker file holds the time the stage was reached.
+function signal_ready() {
+    date +%s.%N > "${LOG_DIR}/.ready_$1"
+}
+
+function is_x_running() {
+    [ -S /tmp/.X11-unix/X0 ]
+}
+
+function is_vnc_listening() {
+    (echo > /dev/tcp/127.0.0.1/5900) 2> /dev/null
+}
+
+function is_game_running() {
+    pgrep -x "StarCraft.exe" > /dev/null
+}
+
+function is_game_window_shown() {
+    xdotool search --onlyvisible --name "Brood War" > /dev/null 2>&1
+}
+
+# The file is there and has not grown for a moment
+function is_file_written() {
+    [ -f "$1" ] || return 1
+    local size=$(stat -c %s "$1")
+    sleep 0.2
+    [ "$size" == "$(stat -c %s "$1")" ]
+}
+
+# The module writes frames once the bot is connected and the game runs
+function signal_bot_connected() {
+    {
+        if wait_until 600 test -f "${SESSION_OUTPUT_DIR:-$LOG_DIR}/frames.csv"; then
+            signal_ready bot
+        fi
+    } &
+}
+
 function fully_qualified_race_name() {
     SHORT="$1"
     if [ "$SHORT" == "T" ]; then
@@ -51,17 +110,39 @@ function prepare_bwapi() {
     sed -i "s:^ai = NULL:ai = $PLAYER_DLL:g" "${BWAPI_INI}"
     sed -i "s:^race = :race = $RACE:g" "${BWAPI_INI}"
     sed -i "s:^game_type = :game_type = $GAME_TYPE:g" "${BWAPI_INI}"
-    sed -i "s:^save_replay = :save_replay = maps/replays/$REPLAY_FILE:g" "${BWAPI_INI}"
     sed -i "s:^wait_for_min_players = :wait_for_min_players = $NUM_PLAYERS:g" "${BWAPI_INI}"
     sed -i "s:^speed_override = :speed_override = $SPEED_OVERRIDE:g" "${BWAPI_INI}"
     sed -i "s:^seed_override = :seed_override = $SEED_OVERRIDE:g" "${BWAPI_INI}"
 
-    # todo: solve bug with "Unable to distribute map"
-    # hotfix for headful mode, but we need to select map unfortunately
-    # it works for headless mode
-    if [ "$IS_HEADFUL" == "1" ]; then
+    if [ "$IS_LEAN" == "1" ]; then
+        sed -i "s:^sound = .*:sound = OFF:g" "${BWAPI_INI}"
+        sed -i "s:^holiday = .*:holiday = OFF:g" "${BWAPI_INI}"
+        # no console windows for the module
+        sed -i "s:^console_attach_auto = .*:console_attach_auto = FALSE:g" "${BWAPI_INI}"
+        sed -i "s:^console_alloc_auto = .*:console_alloc_auto = FALSE:g" "${BWAPI_INI}"
+    fi
+
+    if [ -n "${INPUT_REPLAY:-}" ]; then
+        # Replays are started from the single player menu, which does not suffer
+        # from the map distribution bug, so they can be loaded automatically.
+        # Watching a replay does not produce another replay.
+        REPLAY=$(echo "$INPUT_REPLAY" | sed "s:$SC_DIR/::g")
+        sed -i "s:^auto_menu = .*:auto_menu = SINGLE_PLAYER:g" "${BWAPI_INI}"
+        sed -i "s:^map = :map = $REPLAY:g" "${BWAPI_INI}"
+
+        # A session plays all replays matched by INPUT_REPLAY in the same process
+        if [ -n "${SESSION_GAMES:-}" ]; then
+            sed -i "s:^mapiteration = .*:mapiteration = SEQUENCE:g" "${BWAPI_INI}"
+            sed -i "s:^auto_restart = .*:auto_restart = ON:g" "${BWAPI_INI}"
+        fi
+    elif [ "$IS_HEADFUL" == "1" ]; then
+        # todo: solve bug with "Unable to distribute map"
+        # hotfix for headful mode, but we need to select map unfortunately
+        # it works for headless mode
+        sed -i "s:^save_replay = :save_replay = maps/replays/$REPLAY_FILE:g" "${BWAPI_INI}"
         sed -i "s:^game = :game = JOIN_FIRST:g" "${BWAPI_INI}"
     else
+        sed -i "s:^save_replay = :save_replay = maps/replays/$REPLAY_FILE:g" "${BWAPI_INI}"
         if [ $NTH_PLAYER == "0" ]; then # if is_server
             sed -i "s:map = :map = $MAP:g" "${BWAPI_INI}"
         fi
@@ -73,6 +154,30 @@ function prepare_bwapi() {
     cat "$BWAPI_INI"
 }
 
+# Copy bot files to BWAPI data dir
+function prepare_bot_files() {
+    # images built by observer --build_bot_image have the bot laid out already
+    if [ -f "$BWAPI_DATA_DIR/.bot_prepared" ]; then
+        LOG "Bot files are prepared in the image"
+        return 0
+    fi
+
+    cp -r "$BOT_DIR/AI/." "$BOT_DATA_AI_DIR"
+    cp -r "$BOT_DIR/supplementalAI/." "$BOT_DATA_AI_DIR" || true
+    cp -r "$BOT_DIR/read/." "$BOT_DATA_READ_DIR"
+    cp -r "$BOT_DIR/supplementalRead/." "$BOT_DATA_READ_DIR" || true
+    cp "$BOT_DIR/BWAPI.dll" "$BWAPI_DATA_DIR"
+    cp -r "$BWAPI_DIR/bot/." "$BWAPI_DATA_DIR"
+}
+
+function prepare_bot_bwapi() {
+    if [ "$BOT_TYPE" == "dll" ]; then
+        prepare_bwapi "bwapi-data/AI/$BOT_FILE"
+    else
+        prepare_bwapi "NULL"
+    fi
+}
+
 function start_gui() {
     if [ -z "${LOG_GUI+set}" ]; then
         LOG_XVFB="/dev/null"
@@ -84,13 +189,23 @@ function start_gui() {
 
 
     # Launch the GUI!
+    if [ "$IS_LEAN" == "1" ]; then
+        # Nobody watches: half the framebuffer, no TCP listener, no server resets
+        LOG "Starting lean X, savings logs to " "$LOG_XVFB"
+        Xvfb :0 -auth ~/.Xauthority -screen 0 640x480x16 -nolisten tcp -noreset >> "$LOG_XVFB" 2>&1 &
+        wait_until 10 is_x_running || LOG "X server is not running yet" >> "$LOG_GAME"
+        signal_ready gui
+        return 0
+    fi
+
     LOG "Starting X, savings logs to " "$LOG_XVFB"
     Xvfb :0 -auth ~/.Xauthority -screen 0 640x480x24 >> "$LOG_XVFB" 2>&1 &
-    sleep 1
+    wait_until 10 is_x_running || LOG "X server is not running yet" >> "$LOG_GAME"
 
     LOG "Starting VNC server" "$LOG_XVNC"
     x11vnc -forever -nopw -display :0 >> "$LOG_XVNC" 2>&1 &
-    sleep 1
+    wait_until 10 is_vnc_listening || LOG "VNC server is not listening yet" >> "$LOG_GAME"
+    signal_ready gui
 }
 
 # Bot might use an server/client infrastructure, so connect it after the game has started
@@ -161,7 +276,12 @@ function start_game() {
 
     [ -f "$MAP_DIR/replays/LastReplay.rep" ] && rm "$MAP_DIR/replays/LastReplay.rep"
 
-    update_registry
+    # Containers in a warm pool have the registry updated once at boot,
+    # bot images have the default settings imported at build time
+    if [ "${REGISTRY_UPDATED:-0}" != "1" ] && ! is_registry_prepared; then
+        update_registry
+    fi
+    signal_ready registry
 
     # Launch the game!
     LOG "Starting game" >> "$LOG_GAME"
@@ -170,6 +290,12 @@ function start_game() {
     launch_game "$@" >> "$LOG_GAME" 2>&1  &
 
     . hook_after_game_start.sh
+
+    if wait_until 30 is_game_running; then
+        signal_ready game
+    else
+        LOG "StarCraft has not started yet" >> "$LOG_GAME"
+    fi
 }
 
 function prepare_character() {
@@ -198,64 +324,154 @@ function check_bot_requirements() {
 }
 
 function detect_game_finished() {
+    LOG "Checking game status ..." >> "$LOG_GAME"
     while true
     do
-        LOG "Checking game status ..." >> "$LOG_GAME"
-
-        if ! pgrep -x "StarCraft.exe" > /dev/null
+        if ! is_game_running
         then
             LOG "Game exited!" >> "$LOG_GAME"
-            sleep 3
+            signal_ready finished
             return 0
         fi
 
-        # Sometimes replay files are saved with .rep, or with .REP
-        # note that ^^ works only in bash :)
-        if [ -f "$SC_DIR/maps/replays/$REPLAY_FILE" ] || [ -f "$SC_DIR/maps/replays/${REPLAY_FILE^^}" ] || [ -f "$MAP_DIR/replays/LastReplay.rep" ] ;
+        # When watching a replay, the game ends once the module has written its results.
+        # The module writes the other outputs before, give it until the game exits.
+        if [ -n "${INPUT_REPLAY:-}" ] && [ -f "$LOG_DIR/scores.json" ];
         then
-            LOG "Replays found." >> "$LOG_GAME"
-            sleep 3
+            LOG "Replay finished." >> "$LOG_GAME"
+            wait_until 3 bash -c '! pgrep -x StarCraft.exe > /dev/null' || true
+            signal_ready finished
             return 0
         fi
 
-        sleep 3
+        # Sometimes replay files are saved with .rep, or with .REP
+        # note that ^^ works only in bash :)
+        for SAVED_REPLAY in "$SC_DIR/maps/replays/$REPLAY_FILE" "$SC_DIR/maps/replays/${REPLAY_FILE^^}" "$MAP_DIR/replays/LastReplay.rep"; do
+            if [ -f "$SAVED_REPLAY" ];
+            then
+                LOG "Replays found." >> "$LOG_GAME"
+                wait_until 3 is_file_written "$SAVED_REPLAY" || true
+                signal_ready replay
+                signal_ready finished
+                return 0
+            fi
+        done
+
+        sleep 0.5
     done;
 }
 
-function update_registry() {
+# Wait for the game to finish, within PLAY_TIMEOUT seconds if it is set.
+# Exits with EXIT_CODE_REALTIME_OUTED on timeout.
+function wait_game_finished() {
+    if [ -z "${PLAY_TIMEOUT+set}" ]; then
+        detect_game_finished
+        LOG "Game finished." >> "$LOG_GAME"
+    else
+        set +e  # run_with_timeout can return non-zero return code
+        run_with_timeout "${PLAY_TIMEOUT}" detect_game_finished
+        IS_TIMED_OUT=$?
+        set -e
+
+        if [ ${IS_TIMED_OUT} -eq 143 ]; then
+            LOG "Game realtime outed!" >> "$LOG_GAME"
+
+            # Log ps aux for more info
+            LOG "Running processes:"
+            ps aux >>  "$LOG_GAME"
+
+            exit "$EXIT_CODE_REALTIME_OUTED"
+        else
+            LOG "Game finished within realtimeout limit." >> "$LOG_GAME"
+        fi
+    fi
+}
+
+# Value of a REG_EXPAND_SZ in a .reg file: hex(2) of the UTF-16LE string with its terminator
+function reg_expand_sz() {
+    printf '%s\0' "$1" | iconv -f UTF-8 -t UTF-16LE | od -An -tx1 -v | tr -s ' \n' ',' | sed 's/^,//; s/,$//'
+}
+
+# The StarCraft settings, imported by a single regedit process instead of a wine process per REG ADD
+function write_registry_file() {
+    REG_FILE="$1"
+
+    if [ "$IS_LEAN" == "1" ]; then
+        # no palette cycling, animated portraits, speech or noise
+        COLOR_CYCLE=00000000
+        UNIT_PORTRAITS=00000000
+        UNIT_SPEECH=00000000
+        UNIT_NOISE=00000000
+        BLDG_NOISE=00000000
+    else
+        COLOR_CYCLE=00000001
+        UNIT_PORTRAITS=00000002
+        UNIT_SPEECH=00000001
+        UNIT_NOISE=00000002
+        BLDG_NOISE=00000004
+    fi
+
     # disable splash screen
-    REG_KEY="HKEY_LOCAL_MACHINE\SOFTWARE\Blizzard Entertainment\Starcraft"
-#    wine REG ADD "${REG_KEY}" /v Gamma /t REG_DWORD /d 0000008c
-    wine REG ADD "${REG_KEY}" /v ColorCycle /t REG_DWORD /d 00000001
-    wine REG ADD "${REG_KEY}" /v UnitPortraits /t REG_DWORD /d 00000002
-    wine REG ADD "${REG_KEY}" /v speed /t REG_DWORD /d 00000006
-    wine REG ADD "${REG_KEY}" /v mscroll /t REG_DWORD /d 00000001
-    wine REG ADD "${REG_KEY}" /v kscroll /t REG_DWORD /d 00000001
-    wine REG ADD "${REG_KEY}" /v m_mscroll /t REG_DWORD /d 00000003
-    wine REG ADD "${REG_KEY}" /v m_kscroll /t REG_DWORD /d 00000003
-#    wine REG ADD "${REG_KEY}" /v music /t REG_DWORD /d 0000002d
-#    wine REG ADD "${REG_KEY}" /v sfx /t REG_DWORD /d 0000001e
-    wine REG ADD "${REG_KEY}" /v tipnum /t REG_DWORD /d 00000001
-    wine REG ADD "${REG_KEY}" /v intro /t REG_DWORD /d 00000200
-    wine REG ADD "${REG_KEY}" /v introX /t REG_DWORD /d 00000000
-    wine REG ADD "${REG_KEY}" /v unitspeech /t REG_DWORD /d 00000001
-    wine REG ADD "${REG_KEY}" /v unitnoise /t REG_DWORD /d 00000002
-    wine REG ADD "${REG_KEY}" /v bldgnoise /t REG_DWORD /d 00000004
-    wine REG ADD "${REG_KEY}" /v tip /t REG_DWORD /d 00000100
-    wine REG ADD "${REG_KEY}" /v trigtext /t REG_DWORD /d 00000400
-    wine REG ADD "${REG_KEY}" /v StarEdit /t REG_EXPAND_SZ /d "Z:\app\sc\StarEdit.exe"
-    wine REG ADD "${REG_KEY}" /v "Recent Maps"  /t REG_EXPAND_SZ /d ""
-    wine REG ADD "${REG_KEY}" /v Retail /t REG_EXPAND_SZ /d "y"
-    wine REG ADD "${REG_KEY}" /v Brood  /t REG_EXPAND_SZ /d "y"
-    wine REG ADD "${REG_KEY}" /v StarCD /t REG_EXPAND_SZ /d ""
-    wine REG ADD "${REG_KEY}" /v InstallPath /t REG_EXPAND_SZ /d "Z:\app\sc\\"
-    wine REG ADD "${REG_KEY}" /v Program /t REG_EXPAND_SZ /d "Z:\app\sc\StarCraft.exe"
-
-    REG_KEY="HKEY_LOCAL_MACHINE\SOFTWARE\Wow6432Node\Blizzard Entertainment\Starcraft\DelOpt0"
-    wine REG ADD "${REG_KEY}" /v File0 /t REG_EXPAND_SZ /d "spc"
-    wine REG ADD "${REG_KEY}" /v File1 /t REG_EXPAND_SZ /d "mpc"
-    wine REG ADD "${REG_KEY}" /v Path0 /t REG_EXPAND_SZ /d "Z:\app\sc\characters"
-    wine REG ADD "${REG_KEY}" /v Path1 /t REG_EXPAND_SZ /d "Z:\app\sc\characters"
+    cat > "$REG_FILE" <<REG
+Windows Registry Editor Version 5.00
+
+[HKEY_LOCAL_MACHINE\\SOFTWARE\\Blizzard Entertainment\\Starcraft]
+"ColorCycle"=dword:${COLOR_CYCLE}
+"UnitPortraits"=dword:${UNIT_PORTRAITS}
+"speed"=dword:00000006
+"mscroll"=dword:00000001
+"kscroll"=dword:00000001
+"m_mscroll"=dword:00000003
+"m_kscroll"=dword:00000003
+"tipnum"=dword:00000001
+"intro"=dword:00000200
+"introX"=dword:00000000
+"unitspeech"=dword:${UNIT_SPEECH}
+"unitnoise"=dword:${UNIT_NOISE}
+"bldgnoise"=dword:${BLDG_NOISE}
+"tip"=dword:00000100
+"trigtext"=dword:00000400
+"StarEdit"=hex(2):$(reg_expand_sz 'Z:\app\sc\StarEdit.exe')
+"Recent Maps"=hex(2):$(reg_expand_sz '')
+"Retail"=hex(2):$(reg_expand_sz 'y')
+"Brood"=hex(2):$(reg_expand_sz 'y')
+"StarCD"=hex(2):$(reg_expand_sz '')
+"InstallPath"=hex(2):$(reg_expand_sz 'Z:\app\sc\')
+"Program"=hex(2):$(reg_expand_sz 'Z:\app\sc\StarCraft.exe')
+
+[HKEY_LOCAL_MACHINE\\SOFTWARE\\Wow6432Node\\Blizzard Entertainment\\Starcraft\\DelOpt0]
+"File0"=hex(2):$(reg_expand_sz 'spc')
+"File1"=hex(2):$(reg_expand_sz 'mpc')
+"Path0"=hex(2):$(reg_expand_sz 'Z:\app\sc\characters')
+"Path1"=hex(2):$(reg_expand_sz 'Z:\app\sc\characters')
+REG
+
+    if [ "$IS_LEAN" == "1" ]; then
+        # DirectDraw through GDI, without the OpenGL emulation which Xvfb renders in software
+        cat >> "$REG_FILE" <<REG
+
+[HKEY_LOCAL_MACHINE\\SOFTWARE\\Blizzard Entertainment\\Starcraft]
+"music"=dword:00000000
+"sfx"=dword:00000000
+
+[HKEY_CURRENT_USER\\Software\\Wine\\Direct3D]
+"renderer"="gdi"
+"DirectDrawRenderer"="gdi"
+REG
+    fi
+}
+
+function is_registry_prepared() {
+    [ "$IS_LEAN" != "1" ] && [ -f "$WINEPREFIX/.registry_prepared" ]
+}
+
+function update_registry() {
+    REG_FILE="/tmp/starcraft.reg"
+    write_registry_file "$REG_FILE"
+
+    LOG "Importing registry settings from $REG_FILE"
+    # regedit resolves Windows paths, / is mapped to drive Z:
+    wine regedit /S "Z:${REG_FILE//\//\\}"
 }
 
 function auto_launch() {
@@ -266,6 +482,9 @@ function auto_launch() {
     # todo: more testing
     SLEEP_TIME=0.1
 
+    # The process is running, but the menu takes a while to show up
+    wait_until 30 is_game_window_shown || LOG "StarCraft window is not shown yet" >> "$LOG_GAME"
+
     # Go to the map root directory
     xdotool key G
     sleep $SLEEP_TIME
@@ -17,7 +17,6 @@ prepare_bwapi "NULL"
 prepare_character
 start_gui
 start_game "$@"
-sleep 3
 
 if [ "$HEADFUL_AUTO_LAUNCH" == "1" ]; then
     auto_launch
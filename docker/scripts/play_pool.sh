@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+set -eux
+
+# Boot a warm pool container: prepare the bot, X server and wine registry once
+# and then wait. Replays are played one by one by play_pool_job.sh,
+# which is started by the observer through `docker exec`.
+
+IS_HEADFUL="1"
+# there is no game yet, messages of the boot go to the container log
+LOG_GAME="/dev/stdout"
+BOT_TYPE="${BOT_FILE##*.}"
+
+. play_common.sh
+
+check_bot_requirements
+
+prepare_bot_files
+prepare_character
+start_gui
+if ! is_registry_prepared; then
+    update_registry
+fi
+
+touch "$POOL_READY_FILE"
+LOG "Pool container is ready."
+
+# Stay alive until the observer stops the container
+trap "exit 0" SIGTERM
+while true; do
+    sleep 1 &
+    wait $!
+done
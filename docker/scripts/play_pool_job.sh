@@ -0,0 +1,162 @@
+#!/usr/bin/env bash
+set -eux
+
+# Play a single replay inside of a warm pool container, see play_pool.sh
+# Job specific settings (GAME_NAME, INPUT_REPLAY, LOG_DIR, CRASHES_DIR, TM_*)
+# are passed in the environment of `docker exec`.
+#
+# With SESSION_GAMES set, INPUT_REPLAY matches several replays which are
+# played one after another in the same StarCraft process. The module writes
+# the outputs of each of them through SESSION_OUTPUT_DIR, a link to the logs of the game.
+
+IS_HEADFUL="1"
+REGISTRY_UPDATED="1"
+LOG_GAME="${LOG_DIR}/game.log"
+LOG_BOT="${LOG_DIR}/bot.log"
+BOT_TYPE="${BOT_FILE##*.}"
+REPLAY_FILE="${GAME_NAME}_${NTH_PLAYER}.rep"
+BOT_EXECUTABLE="$BWAPI_DATA_DIR/AI/$BOT_FILE"
+
+. play_common.sh
+
+# The container is not ready for another job until this one is cleaned up
+rm -f "$POOL_READY_FILE"
+
+function cleanup_job() {
+    set +e
+    pkill -x StarCraft.exe
+    kill $(jobs -p) 2> /dev/null
+    pkill -x inotifywait
+
+    cp -r "$ERRORS_DIR/." "$CRASHES_DIR"
+    rm -rf "$ERRORS_DIR"/* "$SC_DIR/replay"
+
+    # If the game cannot be stopped, the container stays not ready
+    # and the observer will recycle it.
+    if timeout 10 bash -c 'while pgrep -x StarCraft.exe > /dev/null; do sleep 0.1; done'; then
+        touch "$POOL_READY_FILE"
+    fi
+}
+trap cleanup_job EXIT
+
+# BWAPI plays the replays of a session in the order in which it finds them,
+# so the game of each replay is taken from the replay StarCraft actually opens.
+# The module reads its output paths once, they go through the SESSION_OUTPUT_DIR link,
+# which is pointed to the logs of that game before the game starts.
+function follow_session_replays() {
+    local REPLAY_DIR
+    REPLAY_DIR=$(dirname "$INPUT_REPLAY")
+    inotifywait -m -e open --format "%f" "$REPLAY_DIR" 2> "$LOG_DIR/inotify.log" | while read -r OPENED; do
+        # replays are named <index>_<game name>.rep
+        GAME="${OPENED#*_}"
+        GAME="${GAME%.*}"
+        GAME_LOG_DIR="$GAMES_DIR/$GAME/logs_0"
+        if [ -d "$GAME_LOG_DIR" ] && [ "$(readlink "$SESSION_OUTPUT_DIR")" != "$GAME_LOG_DIR" ]; then
+            ln -sfn "$GAME_LOG_DIR" "$SESSION_OUTPUT_DIR"
+            LOG "Replay ${OPENED} of game ${GAME} is played." >> "$LOG_GAME"
+        fi
+    done &
+    if ! wait_until 10 grep -q "Watches established" "$LOG_DIR/inotify.log"; then
+        LOG "Replays of the session cannot be followed." >> "$LOG_GAME"
+        exit 1
+    fi
+}
+
+function current_session_game() {
+    basename "$(dirname "$(readlink "$SESSION_OUTPUT_DIR")")"
+}
+
+function count_finished_games() {
+    local FINISHED=0
+    for SESSION_GAME in $SESSION_GAMES; do
+        if [ -f "$GAMES_DIR/$SESSION_GAME/logs_0/scores.json" ]; then
+            FINISHED=$((FINISHED + 1))
+        fi
+    done
+    echo "$FINISHED"
+}
+
+# Wait until $1 games of the session have written their results.
+function detect_session_game_finished() {
+    while true
+    do
+        if ! pgrep -x "StarCraft.exe" > /dev/null
+        then
+            LOG "Game exited!" >> "$LOG_GAME"
+            return 1
+        fi
+
+        # The module writes its results at the end of each game.
+        if [ "$(count_finished_games)" -ge "$1" ]; then
+            return 0
+        fi
+
+        sleep 0.2
+    done;
+}
+
+# The module writes scores.json first at the end of a game,
+# it should close the other outputs before the next game starts.
+function wait_outputs_closed() {
+    local OUTPUT_DIR
+    OUTPUT_DIR=$(readlink -f "$1")
+    timeout 10 bash -c "while find /proc/[0-9]*/fd -lname '${OUTPUT_DIR}/*' 2> /dev/null | grep -q .; do sleep 0.1; done"
+}
+
+function wait_session_finished() {
+    local NUM_GAMES CLOSED_GAMES=" "
+    NUM_GAMES=$(echo $SESSION_GAMES | wc -w)
+    for NTH_GAME in $(seq 1 "$NUM_GAMES"); do
+        set +e
+        if [ -z "${PLAY_TIMEOUT+set}" ]; then
+            detect_session_game_finished "$NTH_GAME"
+        else
+            run_with_timeout "${PLAY_TIMEOUT}" detect_session_game_finished "$NTH_GAME"
+        fi
+        GAME_STATUS=$?
+        set -e
+
+        SESSION_GAME=$(current_session_game)
+        if [ ${GAME_STATUS} -eq 143 ]; then
+            LOG "Game ${SESSION_GAME} realtime outed!" >> "$LOG_GAME"
+            exit "$EXIT_CODE_REALTIME_OUTED"
+        elif [ ${GAME_STATUS} -ne 0 ]; then
+            LOG "Session stopped at game ${SESSION_GAME}." >> "$LOG_GAME"
+            exit 1
+        fi
+
+        for SESSION_GAME in $SESSION_GAMES; do
+            if [ -f "$GAMES_DIR/$SESSION_GAME/logs_0/scores.json" ] && [[ "$CLOSED_GAMES" != *" $SESSION_GAME "* ]]; then
+                # outputs which stay open would mix with those of the next game
+                if ! wait_outputs_closed "$GAMES_DIR/$SESSION_GAME/logs_0"; then
+                    LOG "Outputs of game ${SESSION_GAME} are still open." >> "$LOG_GAME"
+                    exit 1
+                fi
+                CLOSED_GAMES="${CLOSED_GAMES}${SESSION_GAME} "
+                LOG "Game ${SESSION_GAME} finished." >> "$LOG_GAME"
+            fi
+        done
+    done
+}
+
+# Start each job from the pristine bwapi.ini
+cp "$BWAPI_DIR/bot/bwapi.ini" "$BWAPI_DATA_DIR"
+prepare_bot_bwapi
+
+start_bot
+
+if [ -n "${SESSION_GAMES:-}" ]; then
+    follow_session_replays
+fi
+start_game --headful
+
+connect_bot
+signal_bot_connected
+
+if [ -n "${SESSION_GAMES:-}" ]; then
+    wait_session_finished
+else
+    wait_game_finished
+fi
+
+exit 0
@@ -0,0 +1,588 @@
+import copy
+import hashlib
+import logging
+import os
+import os.path
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import docker.errors
+import requests.exceptions
+
+from observer.columnar import convert_game
+from observer.concurrency import (
+    OUTCOME_ERROR, OUTCOME_OK, OUTCOME_OOM, OUTCOME_TIMEOUT, ConcurrencyController
+)
+from observer.docker_hosts import DockerHost, HostPool, parse_docker_hosts
+from observer.docker_utils import dockermachine_ip, prepare_docker_host, remove_game_containers
+from observer.error import (
+    DockerException, HostDroppedException, ObserverException, OutOfMemoryException, RealtimeOutedException
+)
+from observer.failures import CAUSE_UNKNOWN, Failure, classify_failure
+from observer.game import GameArgs, game_launch_params, game_players, run_game, write_game_info
+from observer.manifest import STATUS_DONE, STATUS_QUARANTINED, Manifest
+from observer.player import BotPlayer
+from observer.pool import ContainerPool
+from observer.replay import find_replay_files
+from observer.replay_catalogue import ReplayCatalogue
+from observer.result import GameResult
+from observer.results_store import OUTCOME_CRASH, open_results_store, player_outcomes
+from observer.timing import (
+    PHASE_CREATE, PHASE_CONTAINERS_EXITED, PhaseTimer, record_timings, timing_summary, write_timing_summary
+)
+from observer.utils import md5_file
+
+logger = logging.getLogger(__name__)
+
+# each job gets its own block of VNC ports, there are at most 8 players for a game
+VNC_PORTS_PER_JOB = 8
+# a game is played on this many docker hosts at most, if they drop out while it runs
+MAX_HOST_ATTEMPTS = 3
+# a failed job is played again after RETRY_BACKOFF seconds, twice as long after each attempt
+RETRY_BACKOFF = 10.0
+MAX_RETRY_BACKOFF = 300.0
+# a session is reported to the concurrency controller with the worst outcome of its games
+_OUTCOME_SEVERITY = [OUTCOME_OK, OUTCOME_ERROR, OUTCOME_TIMEOUT, OUTCOME_OOM]
+
+
+def replay_game_name(replay_file: str) -> str:
+    """
+    Stable and unique game name for a replay file.
+
+    It is used both as the output directory under --game_dir
+    and as the prefix of container names, so it must be a valid docker name.
+    """
+    stem = os.path.splitext(os.path.basename(replay_file))[0]
+    stem = re.sub(r"[^a-zA-Z0-9_.-]", "_", stem).strip("_.-")[:40] or "replay"
+    digest = hashlib.md5(replay_file.encode("utf-8")).hexdigest()[:8]
+    return f"{stem}_{digest}"
+
+
+class BatchJobResult:
+    def __init__(
+            self,
+            replay_file: str,
+            game_name: str,
+            game_result: Optional[GameResult],
+            error: Optional[Exception],
+            job_time: float
+    ) -> None:
+        self.replay_file = replay_file
+        self.game_name = game_name
+        self.game_result = game_result
+        self.error = error
+        self.job_time = job_time
+        # why the job has failed, see observer.failures
+        self.cause = None  # type: Optional[Failure]
+        self.attempts = 1
+
+    @property
+    def is_failed(self) -> bool:
+        if self.error is not None or self.cause is not None:
+            return True
+        if self.game_result is None:
+            return False
+        return self.game_result.is_crashed or \
+               self.game_result.is_realtime_outed or \
+               self.game_result.is_gametime_outed
+
+    @property
+    def failure(self) -> Optional[str]:
+        if self.error is not None:
+            return str(self.error) or self.error.__class__.__name__
+        if self.cause is not None:
+            return str(self.cause)
+        if self.is_failed:
+            return "game has crashed or timed out"
+        return None
+
+
+class BatchRunner:
+    """
+    Runs one game per replay file, keeping up to `jobs` games running at once.
+
+    Every job gets its own game name (and so its own output directory
+    under --game_dir and its own containers) and its own VNC port block.
+
+    With `args.convert`, outputs of every successful game are converted to Parquet.
+
+    With a `manifest`, replays which have already been extracted are skipped
+    and the status of every job is recorded, so an interrupted batch can be resumed.
+
+    With `pool_recycle` set, replays are played in a warm ContainerPool
+    instead of starting new containers for each of them. In addition, with
+    `session_size` > 1 the pool plays that many replays in one StarCraft process.
+
+    With `hosts`, games are dispatched across several docker hosts,
+    games of hosts which drop out are played again on the others.
+    The host pool must be started by the caller.
+
+    With a `controller`, at most `jobs` games run at once, as many
+    as the controller allows for the load of the host.
+
+    Jobs which fail for a transient cause (see observer.failures) are played again
+    up to `args.retries` times, after a growing backoff. With a `manifest`, replays
+    which fail for a deterministic cause, or have been played `args.quarantine_after` times
+    in all the batches without success, are quarantined and not played again.
+    """
+
+    def __init__(
+            self,
+            args: GameArgs,
+            replay_files: List[str],
+            jobs: int,
+            pool_recycle: Optional[int] = None,
+            session_size: int = 1,
+            manifest: Optional[Manifest] = None,
+            hosts: Optional[HostPool] = None,
+            controller: Optional[ConcurrencyController] = None
+    ) -> None:
+        if jobs < 1:
+            raise ObserverException(f"number of jobs must be positive, got {jobs}")
+        if session_size < 1:
+            raise ObserverException(f"session size must be positive, got {session_size}")
+        if session_size > 1 and pool_recycle is None:
+            raise ObserverException("sessions of several replays need a container pool")
+        if hosts is not None and pool_recycle is not None:
+            raise ObserverException("the container pool runs on the local docker, "
+                                    "it cannot be used with several docker hosts")
+        if hosts is not None and controller is not None:
+            raise ObserverException("the number of games is adapted to the load of the local host, "
+                                    "it cannot be used with several docker hosts")
+
+        self.args = args
+        self.replay_files = replay_files
+        self.jobs = jobs
+        self.pool_recycle = pool_recycle
+        self.session_size = session_size
+        self.manifest = manifest
+        self.hosts = hosts
+        self.controller = controller
+        self.pool = None
+
+        self._running = {}  # type: Dict[str, Optional[DockerHost]]
+        self._slots = queue.Queue()
+        for slot in range(jobs):
+            self._slots.put(slot)
+
+    def _job_args(self, replay_file: str, game_name: str, slot: int) -> GameArgs:
+        job_args = copy.copy(self.args)
+        job_args.game_name = game_name
+        job_args.replay = replay_file
+        job_args.show_all = False
+        job_args.vnc_base_port = self.args.vnc_base_port + slot * VNC_PORTS_PER_JOB
+        return job_args
+
+    def _run_session(self, replay_files: List[str]) -> List[BatchJobResult]:
+        games = [(replay_game_name(replay_file), replay_file) for replay_file in replay_files]
+        time_start = time.time()
+        if self.controller is not None:
+            self.controller.acquire()
+        outcome = OUTCOME_ERROR
+        try:
+            for game_name, replay_file in games:
+                self._job_started(replay_file, game_name)
+            try:
+                logger.info(f"starting session of {len(games)} replays")
+                finished = self.pool.run_session(games)
+                errors = [None if is_finished else ObserverException("game did not finish in the session")
+                          for is_finished in finished]
+            except (ObserverException, docker.errors.APIError) as e:
+                logger.error(f"session failed: {e}")
+                errors = [e] * len(games)
+
+            job_time = (time.time() - time_start) / len(games)
+            results = [BatchJobResult(replay_file, game_name, None, error, job_time)
+                       for (game_name, replay_file), error in zip(games, errors)]
+            for result in results:
+                result.cause = self._classify(result)
+            outcome = max((self._outcome(result) for result in results), key=_OUTCOME_SEVERITY.index)
+        finally:
+            if self.controller is not None:
+                self.controller.release(outcome, len(games))
+        for result in results:
+            self._job_finished(result)
+            # sessions are not played again, but replays which always fail are kept out of the next ones
+            self._quarantine(result)
+        return results
+
+    def run_job(self, replay_file: str, game_name: Optional[str] = None) -> BatchJobResult:
+        """
+        Play a single replay, waits for a free job slot.
+        It is played again while it fails for a transient cause.
+        The runner must be started, see `start`.
+        """
+        game_name = game_name or replay_game_name(replay_file)
+        for attempt in range(self.args.retries + 1):
+            if attempt > 0:
+                # the slot is free meanwhile, jitter spreads jobs which have failed together
+                backoff = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                logger.warning(f"job {game_name} failed ({result.cause}), playing it again in {backoff:.0f} s")
+                time.sleep(backoff)
+            result = self._play_job(replay_file, game_name)
+            result.attempts = attempt + 1
+            if result.cause is None or not result.cause.is_transient:
+                break
+
+        self._quarantine(result)
+        return result
+
+    def _classify(self, result: BatchJobResult) -> Optional[Failure]:
+        """
+        Cause of a failed job. Games without a result (all but 1v1 games)
+        have failed if they have not written their scores, their logs may tell why.
+        """
+        if result.is_failed:
+            return classify_failure(self.args.game_dir, result.game_name, result.error) or \
+                   Failure(CAUSE_UNKNOWN, result.failure)
+        if result.game_result is None and not self._has_scores(result.game_name):
+            return classify_failure(self.args.game_dir, result.game_name) or \
+                   Failure(CAUSE_UNKNOWN, "game wrote no scores.json")
+        return None
+
+    def _quarantine(self, result: BatchJobResult) -> None:
+        if self.manifest is None or result.cause is None:
+            return
+        attempts = self.manifest.attempts(result.replay_file)
+        if result.cause.is_transient and attempts < self.args.quarantine_after:
+            return
+        logger.warning(f"replay {result.replay_file} is quarantined after {attempts} attempts: {result.cause}")
+        self.manifest.job_quarantined(result.replay_file, result.game_name, str(result.cause))
+
+    def _play_job(self, replay_file: str, game_name: str) -> BatchJobResult:
+        if self.controller is not None:
+            self.controller.acquire()
+        outcome = OUTCOME_ERROR
+        try:
+            slot = self._slots.get()
+            job_args = self._job_args(replay_file, game_name, slot)
+            time_start = time.time()
+            game_result, error = None, None
+            self._job_started(replay_file, job_args.game_name)
+            try:
+                logger.info(f"starting job {job_args.game_name} for {replay_file}")
+                if self.pool is not None:
+                    self.pool.run_replay(job_args.game_name, replay_file)
+                elif self.hosts is not None:
+                    game_result = self._run_on_hosts(job_args)
+                else:
+                    game_result = run_game(job_args, launch_viewers=False)
+            except (ObserverException, docker.errors.APIError) as e:
+                logger.error(f"job {job_args.game_name} failed: {e}")
+                error = e
+            finally:
+                self._slots.put(slot)
+
+            result = BatchJobResult(replay_file, job_args.game_name, game_result,
+                                    error, time.time() - time_start)
+            result.cause = self._classify(result)
+            outcome = self._outcome(result)
+        finally:
+            # the slot of the controller is given back also when the job raises unexpectedly
+            if self.controller is not None:
+                self.controller.release(outcome)
+        self._job_finished(result)
+        return result
+
+    def _outcome(self, result: BatchJobResult) -> str:
+        """
+        Outcome of the game for the concurrency controller.
+        """
+        if isinstance(result.error, OutOfMemoryException):
+            return OUTCOME_OOM
+        if isinstance(result.error, RealtimeOutedException):
+            return OUTCOME_TIMEOUT
+        if result.error is not None:
+            return OUTCOME_ERROR
+        if result.game_result is not None:
+            return OUTCOME_TIMEOUT if result.game_result.is_realtime_outed else OUTCOME_OK
+        # run_game returns no result for single player games, those which have realtime outed
+        # (or crashed, which oversubscribed Wine games do too) have not written their scores
+        return OUTCOME_OK if self._has_scores(result.game_name) else OUTCOME_TIMEOUT
+
+    def _has_scores(self, game_name: str) -> bool:
+        return os.path.exists(f"{self.args.game_dir}/{game_name}/logs_0/scores.json")
+
+    def _run_on_hosts(self, job_args: GameArgs) -> Optional[GameResult]:
+        """
+        Play the game on the least loaded docker host.
+
+        :raises HostDroppedException if the game has lost its host too many times
+        """
+        game_name = job_args.game_name
+        for attempt in range(MAX_HOST_ATTEMPTS):
+            docker_host = self.hosts.acquire()
+            self._running[game_name] = docker_host
+            try:
+                if attempt > 0:
+                    # the host may have come back with the containers of an earlier attempt
+                    remove_game_containers(game_name + "_", docker_host)
+                    self._remove_outputs(game_name)
+                logger.debug(f"playing job {game_name} on docker host {docker_host}")
+                return run_game(job_args, lambda: self.hosts.ensure_alive(docker_host),
+                                launch_viewers=False, docker_host=docker_host)
+            except HostDroppedException as e:
+                logger.warning(f"job {game_name} is played again, {e}")
+            except (docker.errors.APIError, requests.exceptions.ConnectionError) as e:
+                if self.hosts.check(docker_host):
+                    # the host is fine, it is the game which failed
+                    if isinstance(e, docker.errors.APIError):
+                        raise
+                    raise DockerException(f"docker host {docker_host}: {e}") from e
+                logger.warning(f"job {game_name} is played again, docker host {docker_host} dropped out")
+            finally:
+                self.hosts.release(docker_host)
+        raise HostDroppedException(f"job {game_name} has lost its docker host {MAX_HOST_ATTEMPTS} times")
+
+    def _remove_outputs(self, game_name: str) -> None:
+        output_dir = f"{self.args.game_dir}/{game_name}"
+        if os.path.exists(output_dir):
+            logger.debug(f"removing existing game results of {game_name}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def _job_started(self, replay_file: str, game_name: str) -> None:
+        self._running[game_name] = None
+        if self.manifest is not None:
+            self.manifest.job_started(replay_file, game_name)
+
+        # remove outputs of a previous attempt, so they cannot be mistaken for new ones
+        self._remove_outputs(game_name)
+
+    def _job_finished(self, result: BatchJobResult) -> None:
+        self._running.pop(result.game_name, None)
+        if self.args.convert and not result.is_failed:
+            try:
+                convert_game(self.args.game_dir, result.game_name, self.args.remove_csv)
+            except ObserverException as e:
+                logger.error(f"job {result.game_name} failed: {e}")
+                result.error = e
+        if self.pool is not None:
+            # games in the pool are not played by run_game, which stores results of the others
+            self._store_pool_result(result)
+        if self.manifest is not None:
+            self.manifest.job_finished(result.replay_file, result.game_name, result.failure)
+
+    def _store_pool_result(self, result: BatchJobResult) -> None:
+        players = [self.pool.player]
+        is_realtime_outed = isinstance(result.error, RealtimeOutedException)
+        if result.error is not None and not is_realtime_outed:
+            outcomes = [OUTCOME_CRASH]
+        else:
+            outcomes = player_outcomes(players, None, is_realtime_outed,
+                                       self.args.game_dir, result.game_name)
+
+        # the job started with the game, the pool container was booted before
+        timer = PhaseTimer()
+        timer.mark(PHASE_CREATE, time.time() - result.job_time)
+        timer.read_markers([f"{self.args.game_dir}/{result.game_name}/logs_0"])
+        timer.mark(PHASE_CONTAINERS_EXITED)
+        timings = timer.timings()
+        record_timings(result.game_name, timings, self.args.metrics)
+
+        info = game_launch_params(self.args, result.game_name)
+        info.update(dict(
+            replay_file=result.replay_file,
+            bots=self.args.bots,
+            is_realtime_outed=is_realtime_outed,
+            game_time=result.job_time,
+            timings=timings,
+            error=result.failure,
+        ))
+        write_game_info(self.args.game_dir, result.game_name, info)
+        try:
+            open_results_store(self.args.results_db).add(self.args.game_dir, result.game_name, info, [
+                dict(bot=player.name, race=player.race.value, outcome=outcome)
+                for player, outcome in zip(players, outcomes)
+            ])
+        except sqlite3.OperationalError as e:
+            # as in run_game, the game stays buffered for the next write
+            logger.error(f"cannot store results of game {result.game_name}: {e}")
+
+    def _pending_replay_files(self) -> List[str]:
+        if self.manifest is None:
+            return self.replay_files
+
+        pending, seen_hashes, num_quarantined = [], set(), 0
+        for replay_file in self.replay_files:
+            content_hash = self.manifest.replay_hash(replay_file)
+            if content_hash in seen_hashes:
+                continue  # the same replay is in the batch under another name
+            seen_hashes.add(content_hash)
+            status = self.manifest.status(replay_file)
+            if status == STATUS_QUARANTINED:
+                num_quarantined += 1
+            elif status != STATUS_DONE:
+                pending.append(replay_file)
+
+        logger.info(f"skipping {len(self.replay_files) - len(pending) - num_quarantined} replays "
+                    f"which have already been extracted")
+        if num_quarantined:
+            logger.warning(f"skipping {num_quarantined} quarantined replays, "
+                           f"see {self.manifest.game_dir}/manifest.sqlite")
+        return pending
+
+    def run(self) -> List[BatchJobResult]:
+        if self.args.vnc_host == "":
+            # resolve just once, not for every job
+            self.args.vnc_host = dockermachine_ip() or "localhost"
+
+        replay_files = self._pending_replay_files()
+        if not replay_files:
+            return []
+
+        self.start()
+
+        logger.info(f"running {len(replay_files)} replays with {self.jobs} parallel jobs")
+        results = []
+        # jobs waiting to be played again do not hold a slot, other jobs are played meanwhile
+        executor = ThreadPoolExecutor(max_workers=self.jobs * 2 if self.args.retries else self.jobs)
+        if self.session_size > 1:
+            futures = [executor.submit(self._run_session,
+                                       replay_files[start:start + self.session_size])
+                       for start in range(0, len(replay_files), self.session_size)]
+        else:
+            futures = [executor.submit(lambda replay_file: [self.run_job(replay_file)], replay_file)
+                       for replay_file in replay_files]
+        try:
+            for future in as_completed(futures):
+                for result in future.result():
+                    results.append(result)
+                    logger.info(f"[{len(results)}/{len(replay_files)}] {result.game_name} "
+                                f"{'failed' if result.is_failed else 'finished'} "
+                                f"in {result.job_time:.2f} seconds")
+        except KeyboardInterrupt:
+            logger.warning("Caught interrupt, cancelling queued jobs and shutting down containers")
+            logger.warning("This can take a moment, please wait.")
+            for future in futures:
+                future.cancel()
+            for game_name in self.running_games:
+                self.remove_containers(game_name)
+            raise
+        finally:
+            executor.shutdown(wait=False)
+            self.close()
+
+        return results
+
+    def start(self) -> None:
+        """
+        Start the container pool, if the runner uses one.
+        """
+        if self.pool_recycle is not None and self.pool is None:
+            self.pool = self._start_pool()
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    @property
+    def running_games(self) -> List[str]:
+        return list(self._running)
+
+    def remove_containers(self, game_name: str) -> None:
+        """
+        Remove containers of a running game, on the host where it runs.
+        """
+        docker_host = self._running.get(game_name)
+        if docker_host is not None and not docker_host.is_alive:
+            return
+        remove_game_containers(game_name + "_", docker_host)
+
+    def _start_pool(self) -> ContainerPool:
+        players = game_players(self.args)
+        if len(players) != 1 or not isinstance(players[0], BotPlayer):
+            raise ObserverException("container pool can be used only with a single bot")
+
+        pool = ContainerPool(
+            players[0], game_launch_params(self.args, "pool"),
+            size=self.jobs, max_jobs=self.pool_recycle
+        )
+        try:
+            pool.start()
+        except BaseException:
+            pool.close()
+            raise
+        return pool
+
+
+def run_batch(
+        args: GameArgs,
+        replays: str,
+        jobs: int,
+        pool_recycle: Optional[int] = None,
+        session_size: int = 1,
+        replay_filters: Optional[Dict[str, Any]] = None,
+        resume: bool = True,
+        docker_hosts: Optional[str] = None,
+        adaptive: bool = False
+) -> List[BatchJobResult]:
+    """
+    :param replay_filters: keyword arguments of ReplayCatalogue.query,
+                           replays are selected by their headers in the catalogue
+    :param resume: skip replays which are recorded as extracted
+                   in the manifest of the game dir
+    :param docker_hosts: docker hosts with their capacity, see parse_docker_hosts.
+                         The number of jobs is their total capacity.
+    :param adaptive: run at most `jobs` games at once, adapted to the load of the host.
+                     The chosen numbers are written to concurrency.json in the game dir.
+
+    Percentiles of the durations of the phases of the games are written to timings.json in the game dir.
+    """
+    replay_files = find_replay_files(replays)
+    if not replay_files:
+        raise ObserverException(f"no replay files found in {replays}")
+
+    if replay_filters is not None:
+        with ReplayCatalogue(args.replay_catalogue) as catalogue:
+            catalogue.index_files(replay_files)
+            replay_files = catalogue.query(replay_files, **replay_filters)
+        logger.info(f"{len(replay_files)} replays match the filters")
+
+    manifest = None
+    if resume:
+        # outputs depend on the exact bot binaries (e.g. the extractor) and their BWAPI
+        bots = [player for player in game_players(args) if isinstance(player, BotPlayer)]
+        manifest = Manifest(args.game_dir,
+                            ",".join(md5_file(bot.bot_filename) for bot in bots),
+                            ",".join(bot.bwapi_version for bot in bots))
+
+    hosts, controller = None, None
+    try:
+        if docker_hosts is not None:
+            hosts = start_host_pool(args, docker_hosts)
+            jobs = hosts.capacity
+        if adaptive:
+            controller = ConcurrencyController(jobs)
+            controller.start()
+        return BatchRunner(args, replay_files, jobs, pool_recycle, session_size,
+                           manifest, hosts, controller).run()
+    finally:
+        if controller is not None:
+            controller.close()
+            summary = controller.summary()
+            logger.info(f"ran at most {summary['max_running']} games at once, "
+                        f"{summary['concurrency']} at the end")
+            controller.write_summary(f"{args.game_dir}/concurrency.json")
+        if hosts is not None:
+            hosts.close()
+        if manifest is not None:
+            manifest.close()
+        if timing_summary():
+            write_timing_summary(f"{args.game_dir}/timings.json")
+
+
+def start_host_pool(args: GameArgs, docker_hosts: str) -> HostPool:
+    """
+    :raises DockerException if none of the hosts can be used
+    """
+    hosts = HostPool(parse_docker_hosts(docker_hosts),
+                     on_join=lambda docker_host: prepare_docker_host(docker_host, args.docker_image))
+    hosts.start()
+    return hosts
@@ -0,0 +1,197 @@
+"""
+Benchmarks of the orchestration overhead, on the fake docker of observer.fake_docker,
+so they run on any Linux box without docker:
+
+    python -m observer.benchmark --bot_dir <BOT_DIRECTORY> [--sizes 1 100 10000] [--jobs 8] [--json results.json]
+
+For each number of queued jobs, replays are extracted by a BatchRunner ("batch")
+and by a JobServer with its persistent queue ("server"). Reported are the jobs per second,
+the latency of each job beyond the simulated game duration, and the docker API calls per game.
+The bot directory must contain the Extractor, as the data directory of the observer does.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from observer.defaults import SC_BOT_DIR
+from observer.player import check_bot_exists
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ("batch", "server")
+DEFAULT_SIZES = (1, 100, 10000)
+
+
+def _quantiles(values: List[float]) -> Dict[str, float]:
+    from observer.timing import QUANTILES, quantile
+    values = sorted(values)
+    return {f"p{round(q * 100)}": round(quantile(values, q) * 1000, 2) for q in QUANTILES}
+
+
+def _bench_args(work_dir: str, bot_dir: str) -> Any:
+    from observer.cli import parser
+    args = parser.parse_args([
+        "--extract",
+        "--bot_dir", bot_dir,
+        "--game_dir", f"{work_dir}/games",
+        "--map_dir", f"{work_dir}/maps",
+        "--results_db", f"{work_dir}/results.sqlite",
+        "--replay_catalogue", f"{work_dir}/catalogue.sqlite",
+        "--vnc_host", "localhost",
+    ])
+    args.bots = ["Extractor"]
+    # failed jobs are reported, not played again
+    args.retries = 0
+    os.makedirs(args.game_dir)
+    os.makedirs(f"{args.map_dir}/replays")
+    return args
+
+
+def _replay_files(work_dir: str, size: int) -> List[str]:
+    replay_dir = f"{work_dir}/replays"
+    os.makedirs(replay_dir)
+    replay_files = []
+    for nth_replay in range(size):
+        replay_file = f"{replay_dir}/replay_{nth_replay:06d}.rep"
+        with open(replay_file, "wb") as f:
+            f.write(nth_replay.to_bytes(4, "little"))
+        replay_files.append(replay_file)
+    return replay_files
+
+
+def _run_batch(args: Any, replay_files: List[str], jobs: int) -> List[float]:
+    from observer.batch import BatchRunner
+    results = BatchRunner(args, replay_files, jobs).run()
+    failed = [result for result in results if result.is_failed]
+    if failed:
+        raise RuntimeError(f"{len(failed)} jobs failed, e.g. {failed[0].game_name}: {failed[0].failure}")
+    return [result.job_time for result in results]
+
+
+def _run_server(args: Any, replay_files: List[str], jobs: int, work_dir: str) -> List[float]:
+    from observer.job_queue import JOB_EXTRACT, STATUS_DONE, STATUS_FAILED, JobQueue
+    from observer.server import JobServer
+
+    job_queue = JobQueue(f"{work_dir}/server.sqlite")
+    for replay_file in replay_files:
+        job_queue.submit(JOB_EXTRACT, dict(replay=replay_file))
+
+    server = JobServer(args, job_queue, jobs)
+    server.start()
+    try:
+        seq = job_queue.seq
+        while True:
+            counts = job_queue.counts()
+            if counts.get(STATUS_DONE, 0) + counts.get(STATUS_FAILED, 0) >= len(replay_files):
+                break
+            seq, _ = job_queue.wait_changes(seq, timeout=1.0)
+    finally:
+        server.stop()
+
+    job_times = []
+    for job in job_queue.jobs(limit=len(replay_files)):
+        if job["status"] == STATUS_FAILED:
+            raise RuntimeError(f"job {job['id']} failed: {job['error']}")
+        job_times.append(job["result"]["job_time"])
+    job_queue.close()
+    return job_times
+
+
+def run_benchmark(
+        scenario: str,
+        size: int,
+        jobs: int,
+        duration: float,
+        bot_dir: str
+) -> Dict[str, Any]:
+    """
+    Run `size` extraction jobs on the fake docker, whose containers play for `duration` seconds.
+    Latencies are in milliseconds.
+    """
+    from observer.docker_utils import set_docker_client
+    from observer.fake_docker import FakeDockerClient
+    from observer.results_store import close_results_store
+
+    work_dir = tempfile.mkdtemp(prefix="observer-benchmark-")
+    client = FakeDockerClient(duration=lambda name: duration)
+    set_docker_client(client)
+    try:
+        args = _bench_args(work_dir, bot_dir)
+        replay_files = _replay_files(work_dir, size)
+
+        time_start = time.time()
+        if scenario == "batch":
+            job_times = _run_batch(args, replay_files, jobs)
+        elif scenario == "server":
+            job_times = _run_server(args, replay_files, jobs, work_dir)
+        else:
+            raise ValueError(f"unknown scenario {scenario}, use one of {', '.join(SCENARIOS)}")
+        elapsed = time.time() - time_start
+    finally:
+        set_docker_client(None)
+        close_results_store(f"{work_dir}/results.sqlite")
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    calls = client.calls.snapshot()
+    return dict(
+        scenario=scenario,
+        jobs_queued=size,
+        parallel_jobs=jobs,
+        simulated_duration=duration,
+        elapsed=round(elapsed, 3),
+        jobs_per_second=round(size / elapsed, 2),
+        overhead_ms=_quantiles([max(0.0, job_time - duration) for job_time in job_times]),
+        api_calls_per_game=round(client.calls.total / size, 2),
+        api_calls=calls,
+    )
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    overhead = result["overhead_ms"]
+    print(f"{result['scenario']:>7} {result['jobs_queued']:>7} jobs  "
+          f"{result['jobs_per_second']:>9.2f} jobs/s  "
+          f"overhead p50 {overhead['p50']:>8.2f} ms  p90 {overhead['p90']:>8.2f} ms  p99 {overhead['p99']:>8.2f} ms  "
+          f"{result['api_calls_per_game']:>6.2f} API calls/game")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the orchestration overhead on a fake docker.")
+    parser.add_argument("--bot_dir", type=str, default=SC_BOT_DIR,
+                        help=f"Directory with the Extractor bot, default: {SC_BOT_DIR}")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Numbers of queued jobs to run")
+    parser.add_argument("--scenarios", type=str, nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--jobs", type=int, default=8, help="Jobs running at once")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="Seconds each fake container plays")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    parser.add_argument("--log_level", type=str, default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s %(message)s")
+    try:
+        check_bot_exists("Extractor", args.bot_dir)
+    except Exception as e:  # the bot binary is looked up with plain exceptions
+        print(f"the Extractor bot in {args.bot_dir} cannot be used: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            result = run_benchmark(scenario, size, args.jobs, args.duration, args.bot_dir)
+            _print_result(result)
+            results.append(result)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
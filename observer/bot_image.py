@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import os.path
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+import docker
+import docker.errors
+
+from observer.error import DockerException
+from observer.player import BotPlayer
+
+logger = logging.getLogger(__name__)
+
+BOT_DOCKERFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_docker", "bot.dockerfile")
+LABEL_BOT = "observer.bot"
+LABEL_FINGERPRINT = "observer.bot_fingerprint"
+
+# (daemon, image name) -> bot image or None, looked up once per process
+_found_images = {}  # type: Dict[Tuple[str, str], Optional[str]]
+_found_images_lock = threading.Lock()
+
+
+def bot_image_name(docker_image: str, bot_name: str) -> str:
+    """
+    The image of a bot derived from the game image, e.g. starcraft:game-bot-extractor.
+    """
+    repository, tag = docker_image, "latest"
+    if ":" in docker_image.rsplit("/", 1)[-1]:
+        repository, tag = docker_image.rsplit(":", 1)
+    slug = re.sub(r"[^a-z0-9_.-]", "_", bot_name.lower())
+    # tags are at most 128 characters
+    return f"{repository}:" + f"{tag}-bot-{slug}"[:128]
+
+
+def bot_fingerprint(bot: BotPlayer, base_image_id: str) -> str:
+    """
+    Hash of (path, size, mtime) of all the bot files and of the game image,
+    images with another fingerprint are out of date.
+    """
+    digest = hashlib.sha1(base_image_id.encode())
+    for root, dirs, files in os.walk(bot.bot_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f"{os.path.relpath(path, bot.bot_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def build_bot_image(client: docker.DockerClient, docker_image: str, bot: BotPlayer) -> str:
+    """
+    Build the image of the bot from the game image.
+
+    :raises DockerException
+    """
+    image_name = bot_image_name(docker_image, bot.name)
+    try:
+        base_image = client.images.get(docker_image)
+        logger.info(f"building image {image_name} for {bot}, this may take a while")
+        client.images.build(
+            path=bot.bot_dir,
+            dockerfile=BOT_DOCKERFILE,
+            tag=image_name,
+            buildargs=dict(BASE_IMAGE=docker_image, BOT_NAME=bot.name,
+                           BOT_FINGERPRINT=bot_fingerprint(bot, base_image.id)),
+            rm=True,
+        )
+    except docker.errors.DockerException as e:
+        raise DockerException(f"cannot build image {image_name}: {e}")
+
+    with _found_images_lock:
+        _found_images.clear()
+    logger.info(f"built image {image_name}")
+    return image_name
+
+
+def find_bot_image(client: docker.DockerClient, docker_image: str, bot: BotPlayer) -> Optional[str]:
+    """
+    The image of the bot, if it was built and the bot has not changed since.
+    Images built without a fingerprint (e.g. by build_images.sh) are always used.
+    """
+    image_name = bot_image_name(docker_image, bot.name)
+    key = (client.api.base_url, image_name)
+    with _found_images_lock:
+        if key in _found_images:
+            return _found_images[key]
+
+    found = None
+    try:
+        image = client.images.get(image_name)
+        fingerprint = image.labels.get(LABEL_FINGERPRINT)
+        if fingerprint and fingerprint != bot_fingerprint(bot, client.images.get(docker_image).id):
+            logger.warning(f"image {image_name} is out of date, {bot} is copied into the containers. "
+                           f"Run observer --build_bot_image to update it.")
+        else:
+            logger.debug(f"using image {image_name} for {bot}")
+            found = image_name
+    except docker.errors.ImageNotFound:
+        pass
+    except docker.errors.APIError as e:
+        logger.debug(f"cannot look up image {image_name}: {e}")
+
+    with _found_images_lock:
+        _found_images[key] = found
+    return found
@@ -0,0 +1,192 @@
+import copy
+import json
+import logging
+import os
+import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from observer.defaults import SC_BOT_REGISTRY
+from observer.error import PlayerException
+from observer.player import BotPlayer
+
+logger = logging.getLogger(__name__)
+
+# bots are validated (bot.json parsed, BWAPI.dll hashed) in this many threads
+SCAN_THREADS = 8
+
+
+def _fingerprint(bot_dir: str, bot_filename: Optional[str] = None) -> List[Optional[list]]:
+    """
+    (size, mtime) of everything a BotPlayer is built from. Adding or removing
+    AI binaries changes the mtime of the AI directory.
+    """
+    paths = [bot_dir, f"{bot_dir}/bot.json", f"{bot_dir}/BWAPI.dll", f"{bot_dir}/AI", f"{bot_dir}/read"]
+    if bot_filename is not None:
+        paths.append(bot_filename)
+
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append([stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            fingerprint.append(None)
+    return fingerprint
+
+
+class BotRegistry:
+    """
+    Validated bots of a bot directory, keyed by the bot directory name.
+
+    The directory is scanned once, bots are validated in parallel
+    and the results (including the invalid ones) are cached in a JSON file,
+    keyed by the size and mtime of the bot files. On later scans and lookups
+    only the bots which have changed are validated again.
+    """
+
+    def __init__(self, bot_dir: str, cache_file: str = SC_BOT_REGISTRY) -> None:
+        self.bot_dir = os.path.abspath(bot_dir)
+        self.cache_file = cache_file
+
+        self._lock = threading.Lock()
+        self._entries = None  # type: Optional[Dict[str, dict]]
+        self._bots = {}  # type: Dict[str, BotPlayer]
+        self._is_dirty = False
+        self._is_scanned = False
+
+    def _read_cache(self) -> Dict[str, dict]:
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f).get(self.bot_dir, {})
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self) -> None:
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[self.bot_dir] = self._entries
+
+        # other processes never read a partially written cache
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logger.debug(f"cannot write bot registry {self.cache_file}: {e}")
+        self._is_dirty = False
+
+    @staticmethod
+    def _validate(bot_path: str) -> dict:
+        try:
+            bot = BotPlayer(bot_path)
+        except Exception as e:
+            # besides PlayerException, BotPlayer raises plain exceptions
+            # for missing or ambiguous binaries and errors of bot.json
+            return dict(fingerprint=_fingerprint(bot_path), error=str(e).strip())
+
+        with open(bot.bot_json_file, "r") as f:
+            json_spec = json.load(f)
+        return dict(
+            fingerprint=_fingerprint(bot_path, bot.bot_filename),
+            json_spec=json_spec,
+            bot_filename=os.path.relpath(bot.bot_filename, bot_path),
+            bwapi_version=bot.bwapi_version,
+        )
+
+    def _is_fresh(self, name: str, entry: dict) -> bool:
+        bot_path = f"{self.bot_dir}/{name}"
+        bot_filename = entry.get("bot_filename")
+        if bot_filename is not None:
+            bot_filename = f"{bot_path}/{bot_filename}"
+        return entry["fingerprint"] == _fingerprint(bot_path, bot_filename)
+
+    def _update(self, names: List[str]) -> None:
+        stale = [name for name in names
+                 if name not in self._entries or not self._is_fresh(name, self._entries[name])]
+        if not stale:
+            return
+
+        logger.debug(f"validating {len(stale)} bots in {self.bot_dir}")
+        with ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+            entries = executor.map(self._validate, [f"{self.bot_dir}/{name}" for name in stale])
+            for name, entry in zip(stale, entries):
+                self._entries[name] = entry
+                self._bots.pop(name, None)
+        self._is_dirty = True
+
+    def _load(self) -> None:
+        if self._entries is None:
+            self._entries = self._read_cache()
+
+    def scan(self) -> Dict[str, dict]:
+        """
+        Validate all new and changed bots of the directory.
+        Returns the cache entries of all the bots, by name.
+        """
+        with self._lock:
+            self._scan()
+            return dict(self._entries)
+
+    def _scan(self) -> None:
+        self._load()
+        names = sorted(name for name in os.listdir(self.bot_dir)
+                       if not name.startswith(".") and os.path.isdir(f"{self.bot_dir}/{name}"))
+        for name in set(self._entries) - set(names):
+            del self._entries[name]
+            self._bots.pop(name, None)
+            self._is_dirty = True
+        self._update(names)
+        self._is_scanned = True
+        if self._is_dirty:
+            self._write_cache()
+
+    def _bot_from_entry(self, name: str, entry: dict) -> BotPlayer:
+        if name not in self._bots:
+            bot_path = f"{self.bot_dir}/{name}"
+            self._bots[name] = BotPlayer.from_cache(bot_path, entry["json_spec"],
+                                                    f"{bot_path}/{entry['bot_filename']}", entry["bwapi_version"])
+        # callers may change the bot, e.g. its race
+        return copy.copy(self._bots[name])
+
+    def find_bot(self, name: str) -> Optional[BotPlayer]:
+        """
+        The bot in the directory of this name, None if there is no such directory.
+        Raises PlayerException if the bot is not valid.
+        """
+        bot_path = f"{self.bot_dir}/{name}"
+        if not os.path.isdir(bot_path):
+            return None
+
+        with self._lock:
+            if not self._is_scanned:
+                # validate all bots at once, most of them are going to be looked up too
+                self._scan()
+            self._update([name])
+            if self._is_dirty:
+                self._write_cache()
+            entry = self._entries[name]
+            if "error" in entry:
+                raise PlayerException(entry["error"])
+            return self._bot_from_entry(name, entry)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def bot_registry(bot_dir: str) -> BotRegistry:
+    """
+    Registry shared by all lookups of this process.
+    """
+    bot_dir = os.path.abspath(bot_dir)
+    with _registries_lock:
+        if bot_dir not in _registries:
+            _registries[bot_dir] = BotRegistry(bot_dir)
+        return _registries[bot_dir]
@@ -8,6 +8,7 @@ import shutil
 import numpy as np
 import requests
 
+from observer.bot_registry import bot_registry
 from observer.player import BotPlayer, BotJsonMeta
 
 
@@ -23,12 +24,6 @@ class LocalBotStorage(BotStorage):
         self.bot_dir = bot_dir
 
     def find_bot(self, name: str) -> Optional[BotPlayer]:
-        f_name = f"{self.bot_dir}/{name}"
-        logger.debug(f"checking bot in {f_name}")
-        if not os.path.exists(f_name):
-            return None
-
-        logger.debug(f"found bot in {f_name}")
-        bot = BotPlayer(f_name)
-
-        return bot
+        logger.debug(f"checking bot in {self.bot_dir}/{name}")
+        # validated bots are cached, only bots which changed are validated again
+        return bot_registry(self.bot_dir).find_bot(name)
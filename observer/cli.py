@@ -3,15 +3,13 @@ import logging
 import os.path
 import sys
 
-import coloredlogs
-import docker
-from observer.defaults import SC_BOT_DIR, SC_GAME_DIR, SC_MAP_DIR, OBSERVER_BASE_DIR, SC_IMAGE, VERSION
-from observer.docker_utils import BASE_VNC_PORT, VNC_HOST
+from observer.defaults import (
+    SC_BOT_DIR, SC_GAME_DIR, SC_MAP_DIR, SC_REPLAY_CATALOGUE, SC_RESULTS_DB, SC_SERVER_DB, OBSERVER_BASE_DIR, SC_IMAGE, VERSION,
+    BASE_VNC_PORT, VNC_HOST
+)
 from observer.error import ObserverException
-from observer.game import run_game
 from observer.game_type import GameType
 from observer.player import bot_regex, PlayerRace
-from observer.utils import random_string
 
 logger = logging.getLogger(__name__)
 
@@ -22,18 +20,132 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--install', action='store_true',
                     help="Download all dependencies and data files.\n"
                          "Needed to run the first time after `pip install`.")
+parser.add_argument('--index', type=str, metavar="REPLAY_DIR", default=None,
+                    help="Index headers of all replays in the directory\n"
+                         "into the replay catalogue and exit.\n"
+                         "With replay filters, print the matching replays.")
+parser.add_argument('--convert_dir', type=str, metavar="GAME_DIR", default=None,
+                    help="Convert frames.csv and unit_events.csv of all games\n"
+                         "in the directory to Parquet and exit.\n"
+                         "Uses --jobs threads.")
 parser.add_argument('--extract', action='store_true')
 parser.add_argument('--record', action='store_true')
 parser.add_argument('--map', type=str, metavar="MAP.scx", default="sscai/(2)Benzene.scx",
                     help="Name of map on which SC should be played,\n"
                          "relative to --map_dir")
+parser.add_argument('--replay', type=str, metavar="REPLAY.rep", default=None,
+                    help="Replay file which is started automatically.\n"
+                         "If not set, the replay must be selected manually\n"
+                         "inside of the container.")
+parser.add_argument('--replays', type=str, metavar="DIR|GLOB", default=None,
+                    help="Run in batch mode, one game per replay file.\n"
+                         "Directory (searched recursively), glob pattern\n"
+                         "or a text file with one replay path per line.")
+parser.add_argument('--jobs', type=int, default=1,
+                    help="In batch mode, number of games running at once.")
+parser.add_argument('--no_resume', action='store_true',
+                    help="In batch mode, extract all replays again, even those\n"
+                         "recorded as done in the manifest of --game_dir.")
+parser.add_argument('--retries', type=int, default=2,
+                    help="In batch and server mode, play a game again this many times\n"
+                         "when it fails for a transient cause (Wine start, map distribution,\n"
+                         "timeouts, ...), after a growing backoff.")
+parser.add_argument('--quarantine_after', type=int, default=6,
+                    help="In batch mode, stop playing replays which have failed this many times,\n"
+                         "over all the batches, or for a deterministic cause (corrupt replay,\n"
+                         "unsupported version). --no_resume plays them again.")
+parser.add_argument('--pool', action='store_true',
+                    help="In batch mode, keep --jobs game containers booted\n"
+                         "and play the replays in them one after another.")
+parser.add_argument('--pool_recycle', type=int, default=50,
+                    help="In pool mode, replace a container after this many replays.")
+parser.add_argument('--docker_hosts', type=str, metavar="HOSTS", default=None,
+                    help="In batch and server mode, dispatch games across docker hosts,\n"
+                         "comma separated URL=CAPACITY (or a file with one per line),\n"
+                         "e.g. local=4,tcp://10.0.0.2:2375=8,ssh://me@box3=8,context:rack1=8.\n"
+                         "--jobs is the total capacity. Outputs are copied back to --game_dir.")
+parser.add_argument('--adaptive', action='store_true',
+                    help="In batch mode, adapt the number of games running at once\n"
+                         "(at most --jobs) to the cpu and memory pressure of the host.\n"
+                         "The chosen numbers are written to concurrency.json in --game_dir.")
+parser.add_argument('--session_size', type=int, default=1,
+                    help="In pool mode, play this many replays one after another\n"
+                         "in the same StarCraft process.")
+
+# Job server
+parser.add_argument('--serve', action='store_true',
+                    help="Run a job server which accepts extract, record and match jobs\n"
+                         "over HTTP at --server, running --jobs games at once.\n"
+                         "Queued jobs are kept in --server_db across restarts.")
+parser.add_argument('--server', type=str, metavar="HOST:PORT|unix:PATH", default="127.0.0.1:8765",
+                    help="Address of the job server, default: 127.0.0.1:8765")
+parser.add_argument('--server_db', type=str, default=SC_SERVER_DB,
+                    help=f"SQLite file with the job queue of the server, default:\n{SC_SERVER_DB}")
+parser.add_argument('--watch_dir', type=str, metavar="DIR", default=None,
+                    help="With --serve, queue every replay written to the directory,\n"
+                         "as an extract or record job according to --extract/--record.")
+parser.add_argument('--submit', type=str, metavar="REPLAY.rep", default=None,
+                    help="Submit an extract or record job of the replay\n"
+                         "to the job server at --server, print it and exit.")
+parser.add_argument('--follow', action='store_true',
+                    help="With --submit, print changes of the job until it ends.")
+
+# Replay catalogue
+parser.add_argument('--replay_catalogue', type=str, default=SC_REPLAY_CATALOGUE,
+                    help=f"SQLite file with the replay catalogue, default:\n{SC_REPLAY_CATALOGUE}")
+parser.add_argument('--matchup', type=str, default=None,
+                    help="Only use replays with this matchup, e.g. PvZ.")
+parser.add_argument('--map_filter', type=str, default=None,
+                    help="Only use replays on maps whose name contains this text.")
+parser.add_argument('--min_duration', type=float, default=None,
+                    help="Only use replays at least this long (seconds at fastest speed).")
+parser.add_argument('--max_duration', type=float, default=None,
+                    help="Only use replays at most this long (seconds at fastest speed).")
+
+# Results store
+parser.add_argument('--results_db', type=str, default=SC_RESULTS_DB,
+                    help=f"SQLite file where results of all games are stored, default:\n{SC_RESULTS_DB}")
+parser.add_argument('--metrics', type=str, metavar="FILE", default=None,
+                    help="Export durations of the phases of each game (start-up, game, teardown):\n"
+                         "a Prometheus textfile with percentiles if FILE ends with .prom,\n"
+                         "otherwise one JSON line per game is appended.")
+parser.add_argument('--sample_resources', type=float, metavar="SECONDS", default=None,
+                    help="Sample cpu, memory, block and network i/o of the game containers\n"
+                         "every SECONDS (at least 1) into logs_*/resources.csv,\n"
+                         "with their peak and mean use in the results store (and result.json).")
+parser.add_argument('--stats', type=str, default=None, choices=["bot", "race", "map"],
+                    help="Print number of games, win and crash rates\n"
+                         "from the results store, grouped by bot, race or map, and exit.\n"
+                         "Filtered by --stats_bot, --stats_race, --map_filter and --since.")
+parser.add_argument('--stats_bot', type=str, default=None,
+                    help="Only count games of this bot.")
+parser.add_argument('--stats_race', type=str, default=None, choices=[race.value for race in PlayerRace],
+                    help="Only count games of players of this race.")
+parser.add_argument('--since', type=str, default=None,
+                    help="Only count games finished since this date (e.g. 2026-01-31).")
+parser.add_argument('--import_results', type=str, metavar="GAME_DIR", default=None,
+                    help="Add games from result.json files in the directory\n"
+                         "to the results store and exit.")
+
+# Columnar outputs
+parser.add_argument('--convert', action='store_true',
+                    help="After each game, convert frames.csv and unit_events.csv\n"
+                         "to Parquet files next to them (requires pyarrow).")
+parser.add_argument('--remove_csv', action='store_true',
+                    help="Remove the CSV files after they are converted to Parquet.")
+
 parser.add_argument('--headless', action='store_true',
                     help="Launch play in headless mode. \n"
                          "No VNC viewer will be launched.")
+parser.add_argument('--lean', action='store_true',
+                    help="Extract replays with the lean profile: no VNC server, no network\n"
+                         "and StarCraft settings which render and play less.\n"
+                         "The game cannot be watched.")
 
 # Game settings
-parser.add_argument("--game_name", type=str, default=random_string(8),
-                    help="Override the auto-generated game name")
+parser.add_argument("--game_name", type=str, default=None,
+                    help="Override the game name,\n"
+                         "default: Extractor or Record")
 parser.add_argument("--game_type", type=str, metavar="GAME_TYPE",
                     default=GameType.FREE_FOR_ALL.value,
                     choices=[game_type.value for game_type in GameType],
@@ -47,6 +159,9 @@ parser.add_argument("--seed_override", type=int,
 parser.add_argument("--timeout", type=int, default=None,
                     help="Kill docker container after timeout seconds.\n"
                          "If not set, run without timeout.")
+parser.add_argument("--stall_timeout", type=float, metavar="SECONDS", default=300,
+                    help="Kill games whose frames have not advanced for SECONDS\n"
+                         "(replays and headless games only), 0 to never kill them, default: 300.")
 parser.add_argument("--timeout_at_frame", type=int, default=None,
                     help="End game after the given frame count.\n"
                          "If not set, run without frame limit.")
@@ -93,6 +208,10 @@ parser.add_argument('--docker_image', type=str, default=SC_IMAGE,
                     help="The name of the image that should \n"
                          "be used to launch the game.\n"
                          "This helps with local development.")
+parser.add_argument('--build_bot_image', action='store_true',
+                    help="Build an image of the bot (Extractor or Recorder) from --docker_image\n"
+                         "with the bot files laid out and the wine prefix initialised, and exit.\n"
+                         "Games use it automatically, until the bot changes.")
 parser.add_argument('--mem_limit', type=str, default=None,
                     help="Limit started containers to the given amount of memory.")
 parser.add_argument('--nano_cpus', type=int, default=None,
@@ -104,8 +223,157 @@ parser.add_argument('-v', "--version", action='store_true', dest='show_version',
 
 
 def _image_version_up_to_date():
-    client = docker.from_env()
-    return any(tag == SC_IMAGE for image in client.images.list('starcraft') for tag in image.tags)
+    from observer.docker_utils import docker_client
+    from observer.env_cache import cached_check
+
+    def is_image_present() -> bool:
+        return any(tag == SC_IMAGE for image in docker_client().images.list('starcraft')
+                   for tag in image.tags)
+
+    # a missing image is checked again on every run, until it is installed
+    return cached_check(f"image:{SC_IMAGE}", is_image_present, should_cache=bool)
+
+
+def _replay_filters(args) -> dict:
+    from observer.replay import FASTEST_FPS
+    filters = dict(matchup=args.matchup, map_name=args.map_filter)
+    if args.min_duration is not None:
+        filters["min_frames"] = int(args.min_duration * FASTEST_FPS)
+    if args.max_duration is not None:
+        filters["max_frames"] = int(args.max_duration * FASTEST_FPS)
+    return filters
+
+
+def _has_replay_filters(args) -> bool:
+    return any(value is not None for value in (
+        args.matchup, args.map_filter, args.min_duration, args.max_duration
+    ))
+
+
+def _index_replays(args) -> None:
+    from observer.replay_catalogue import ReplayCatalogue
+    with ReplayCatalogue(args.replay_catalogue) as catalogue:
+        catalogue.index_dir(args.index)
+        if _has_replay_filters(args):
+            for path in catalogue.query(**_replay_filters(args)):
+                print(path)
+    sys.exit(0)
+
+
+def _print_stats(args) -> None:
+    from dateutil.parser import parse as parse_date
+    from observer.results_store import ResultsStore
+    since = parse_date(args.since).timestamp() if args.since is not None else None
+    with ResultsStore(args.results_db) as store:
+        stats = store.stats(args.stats, bot=args.stats_bot, race=args.stats_race,
+                            map_name=args.map_filter, since=since)
+
+    print(f"{args.stats:<32} {'games':>8} {'wins':>8} {'losses':>8} {'crashes':>8} {'timeouts':>8}"
+          f" {'win rate':>9} {'crash rate':>10}")
+    for row in stats:
+        win_rate = f"{row['win_rate']:.1%}" if row['win_rate'] is not None else "-"
+        print(f"{str(row['key']):<32} {row['games']:>8} {row['wins']:>8} {row['losses']:>8}"
+              f" {row['crashes']:>8} {row['timeouts']:>8} {win_rate:>9} {row['crash_rate']:>10.1%}")
+    sys.exit(0)
+
+
+def _import_results(args) -> None:
+    from observer.results_store import ResultsStore
+    with ResultsStore(args.results_db) as store:
+        store.import_game_dir(args.import_results)
+    sys.exit(0)
+
+
+def _convert_dir(args) -> None:
+    from observer.columnar import convert_game_dir
+    try:
+        num_failed = convert_game_dir(args.convert_dir, args.jobs, args.remove_csv)
+    except ObserverException as e:
+        logger.exception(e)
+        sys.exit(1)
+    sys.exit(1 if num_failed else 0)
+
+
+def _convert_game(args) -> None:
+    from observer.columnar import convert_game
+    from observer.game import default_game_name
+    game_name = default_game_name(args)
+    parquet_files = convert_game(args.game_dir, game_name, args.remove_csv)
+    logger.info(f"Converted {len(parquet_files)} output files of game {game_name} to Parquet.")
+
+
+def _build_bot_images(args) -> None:
+    from observer.bot_image import build_bot_image
+    from observer.docker_utils import docker_client
+    from observer.game import game_players
+    try:
+        for player in game_players(args):
+            build_bot_image(docker_client(), args.docker_image, player)
+    except ObserverException as e:
+        logger.exception(e)
+        sys.exit(1)
+    sys.exit(0)
+
+
+def _remove_orphan_containers() -> None:
+    import docker.errors
+    from observer.docker_utils import remove_orphan_containers
+    try:
+        remove_orphan_containers()
+    except docker.errors.APIError as e:
+        logger.warning(f"could not remove containers left behind by earlier runs: {e}")
+
+
+def _run_batch(args) -> None:
+    from observer.batch import run_batch
+    try:
+        results = run_batch(args, args.replays, args.jobs,
+                            args.pool_recycle if args.pool else None,
+                            args.session_size,
+                            _replay_filters(args) if _has_replay_filters(args) else None,
+                            not args.no_resume, args.docker_hosts, args.adaptive)
+    except ObserverException as e:
+        logger.exception(e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    failed = [result for result in results if result.is_failed]
+    logger.info(f"Batch finished: {len(results) - len(failed)} games succeeded, "
+                f"{len(failed)} failed.")
+    for result in failed:
+        logger.error(f"Game {result.game_name} ({result.replay_file}) has failed.")
+    sys.exit(1 if failed else 0)
+
+
+def _submit_job(args) -> None:
+    import json
+    from observer.job_queue import JOB_EXTRACT, JOB_RECORD, STATUS_DONE
+    from observer.server import ServerClient
+    client = ServerClient(args.server)
+    try:
+        job = client.submit(JOB_RECORD if args.record else JOB_EXTRACT, replay=os.path.abspath(args.submit))
+        print(json.dumps(job))
+        if args.follow:
+            for job in client.follow(job["id"]):
+                print(json.dumps(job), flush=True)
+    except ObserverException as e:
+        logger.error(e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    sys.exit(0 if not args.follow or job["status"] == STATUS_DONE else 1)
+
+
+def _serve(args) -> None:
+    from observer.server import serve
+    try:
+        serve(args, args.server, args.server_db, args.jobs,
+              args.pool_recycle if args.pool else None, args.watch_dir, args.docker_hosts)
+    except ObserverException as e:
+        logger.exception(e)
+        sys.exit(1)
+    sys.exit(0)
 
 
 def main():
@@ -114,14 +382,40 @@ def main():
         print(VERSION)
         sys.exit(0)
 
+    # imported here, so that printing the version does not need to load them
+    import coloredlogs
+    from observer.game import run_game
+
     coloredlogs.install(
         level=args.log_level,
         fmt="%(asctime)s %(levelname)s %(name)s[%(process)d] %(message)s" if args.log_verbose
         else "%(levelname)s %(message)s")
 
+    if args.index is not None:
+        _index_replays(args)
+        # _index_replays exits
+
+    if args.stats is not None:
+        _print_stats(args)
+        # _print_stats exits
+
+    if args.import_results is not None:
+        _import_results(args)
+        # _import_results exits
+
+    if args.convert_dir is not None:
+        _convert_dir(args)
+        # _convert_dir exits
+
+    if args.submit is not None:
+        _submit_job(args)
+        # _submit_job exits
+
     if args.install or not _image_version_up_to_date():
         from .install import install
+        from .env_cache import clear_env_cache
         try:
+            clear_env_cache()
             install()
             if args.install:
                 sys.exit(0)
@@ -136,10 +430,22 @@ def main():
                      f'Did you run "observer --install"?')
         # parser.error exits
 
+    # containers of earlier runs which were killed before they could remove them
+    _remove_orphan_containers()
+
+    if args.serve:
+        # the kind of the jobs is given by the clients
+        _serve(args)
+        # _serve exits
+
     if not args.extract and not args.record:
         parser.error('the following arguments are required: --extract or --record')
         # parser.error exits
 
+    if args.lean and not args.extract:
+        parser.error('--lean requires --extract')
+        # parser.error exits
+
     if args.extract:
         args.bots = ['Extractor']
     
@@ -154,8 +460,23 @@ def main():
     #     if answer.lower() not in ("", "yes", "y"):
     #         sys.exit(1)
 
+    if args.session_size > 1 and not args.pool:
+        parser.error('--session_size requires --pool')
+        # parser.error exits
+
+    if args.build_bot_image:
+        _build_bot_images(args)
+        # _build_bot_images exits
+
+    if args.replays is not None:
+        _run_batch(args)
+        # _run_batch exits
+
     try:
         game_result = run_game(args)
+        if args.convert:
+            _convert_game(args)
+
         if game_result is None:
             logger.info("Game results are available only for 1v1 (bot vs bot) games.")
             sys.exit(0)
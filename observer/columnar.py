@@ -0,0 +1,188 @@
+import csv
+import logging
+import os
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from observer.error import ObserverException
+from observer.logs import find_frames, find_unit_events
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:  # optional dependency, pip install observer[parquet]
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_EXTENSION = ".parquet"
+PARQUET_COMPRESSION = "zstd"
+
+# bytes of CSV parsed at once, bounds the memory used for very long games
+CSV_BLOCK_SIZE = 16 << 20
+
+
+# Types of the columns written by the Extractor, as numpy dtypes.
+# They are fixed, so that every game is converted to the same schema no matter
+# which values happen to appear in it. Text columns are dictionary-encoded,
+# columns which are not listed here are kept as plain strings.
+CATEGORY = "category"
+COLUMN_DTYPES = dict(
+    # frames.csv and unit_events.csv
+    frame="int32",
+    ID="int32",
+    x="int16",
+    y="int16",
+    player="int8",
+
+    # unit states
+    race=CATEGORY,
+    player_color=CATEGORY,
+    name=CATEGORY,
+    top="int16",
+    bottom="int16",
+    left="int16",
+    right="int16",
+    HP="int16",
+    max_HP="int16",
+    shield="int16",
+    max_shield="int16",
+    energy="int16",
+    max_energy="int16",
+
+    # unit events
+    unit=CATEGORY,
+    event=CATEGORY,
+    target_id="int32",
+    target_x="int16",
+    target_y="int16",
+)
+
+
+def _arrow_type(dtype: str) -> 'pyarrow.DataType':
+    if dtype == CATEGORY:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.from_numpy_dtype(dtype)
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        raise ObserverException("Columnar conversion requires pyarrow, "
+                                "install it with `pip install observer[parquet]`")
+
+
+def parquet_file_of(csv_file: str) -> str:
+    return os.path.splitext(csv_file)[0] + PARQUET_EXTENSION
+
+
+def _read_csv_header(csv_file: str) -> List[str]:
+    with open(csv_file, "r", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def convert_csv(csv_file: str, block_size: int = CSV_BLOCK_SIZE) -> Optional[str]:
+    """
+    Stream the CSV file block by block into a Parquet file next to it,
+    each block becomes one row group.
+
+    Rows which cannot be parsed (e.g. the last line of a crashed game)
+    are skipped. Returns the Parquet file, or None if the CSV file is empty.
+    """
+    _require_pyarrow()
+
+    header = _read_csv_header(csv_file)
+    if not header:
+        logger.debug(f"{csv_file} is empty, nothing to convert")
+        return None
+
+    column_types = {column: _arrow_type(COLUMN_DTYPES[column]) if column in COLUMN_DTYPES
+                    else pyarrow.string()
+                    for column in header}
+
+    parquet_file = parquet_file_of(csv_file)
+    tmp_file = parquet_file + ".tmp"
+    reader = pyarrow.csv.open_csv(
+        csv_file,
+        read_options=pyarrow.csv.ReadOptions(block_size=block_size),
+        parse_options=pyarrow.csv.ParseOptions(invalid_row_handler=lambda row: "skip"),
+        convert_options=pyarrow.csv.ConvertOptions(column_types=column_types)
+    )
+    try:
+        with pyarrow.parquet.ParquetWriter(tmp_file, reader.schema,
+                                           compression=PARQUET_COMPRESSION) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    # readers never see a partially written file
+    os.replace(tmp_file, parquet_file)
+    return parquet_file
+
+
+def _is_converted(csv_file: str) -> bool:
+    parquet_file = parquet_file_of(csv_file)
+    return os.path.exists(parquet_file) and \
+           os.path.getmtime(parquet_file) >= os.path.getmtime(csv_file)
+
+
+def convert_game(game_dir: str, game_name: str, remove_csv: bool = False) -> List[str]:
+    """
+    Convert frames.csv and unit_events.csv of the game to Parquet.
+
+    Files which have already been converted are skipped.
+    Returns the Parquet files.
+    """
+    _require_pyarrow()
+
+    parquet_files = []
+    for csv_file in find_frames(game_dir, game_name) + find_unit_events(game_dir, game_name):
+        if _is_converted(csv_file):
+            parquet_file = parquet_file_of(csv_file)
+        else:
+            try:
+                parquet_file = convert_csv(csv_file)
+            except (pyarrow.ArrowException, OSError) as e:
+                raise ObserverException(f"Cannot convert {csv_file}: {e}") from e
+            if parquet_file is None:
+                continue
+            logger.debug(f"converted {csv_file} "
+                         f"({os.path.getsize(csv_file)} -> {os.path.getsize(parquet_file)} bytes)")
+
+        if remove_csv:
+            os.remove(csv_file)
+        parquet_files.append(parquet_file)
+    return parquet_files
+
+
+def convert_game_dir(game_dir: str, jobs: int = 1, remove_csv: bool = False) -> int:
+    """
+    Convert outputs of all the games in the game dir, in `jobs` threads.
+    Returns the number of games which could not be converted.
+    """
+    _require_pyarrow()
+
+    game_names = sorted(
+        name for name in os.listdir(game_dir)
+        if not name.startswith(".") and os.path.isdir(f"{game_dir}/{name}")
+    )
+    logger.info(f"converting outputs of {len(game_names)} games in {game_dir}")
+
+    def convert(game_name: str) -> bool:
+        try:
+            convert_game(game_dir, game_name, remove_csv)
+            return True
+        except ObserverException as e:
+            logger.error(e)
+            return False
+
+    # pyarrow releases the GIL while parsing and compressing
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        num_failed = sum(not is_converted for is_converted in executor.map(convert, game_names))
+
+    logger.info(f"converted {len(game_names) - num_failed} games, {num_failed} failed")
+    return num_failed
@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from observer.docker_utils import GAME_CONTAINER_LABEL, docker_client
+from observer.error import ObserverException
+
+logger = logging.getLogger(__name__)
+
+# how often the host is sampled
+SAMPLE_INTERVAL = 5.0
+# the number of games is changed at most this often
+ADJUST_INTERVAL = 30.0
+# fewer games are run when the host has less memory available, or more cpu busy
+MIN_MEM_AVAILABLE = 0.10
+MAX_CPU_BUSY = 0.95
+# more games are run only while the host has cpu to spare
+TARGET_CPU_BUSY = 0.85
+# more games are not worth it, if the games per hour drop by more than this
+THROUGHPUT_TOLERANCE = 0.05
+# after pressure, the limit does not grow over the lowered ceiling for this many seconds
+CEILING_RELAX_TIME = 600.0
+
+# outcomes of games reported to the controller
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_OOM = "oom"
+PRESSURE_OUTCOMES = (OUTCOME_TIMEOUT, OUTCOME_OOM)
+
+
+def _read_proc_stat() -> Optional[List[int]]:
+    try:
+        with open("/proc/stat", "r") as f:
+            return [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+
+
+def _read_meminfo() -> Optional[Dict[str, int]]:
+    try:
+        with open("/proc/meminfo", "r") as f:
+            return {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f}
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class HostSample:
+    def __init__(
+            self,
+            cpu_busy: float,
+            mem_total: Optional[int],
+            mem_available: Optional[int],
+            sampled_at: float
+    ) -> None:
+        self.cpu_busy = cpu_busy
+        self.mem_total = mem_total
+        self.mem_available = mem_available
+        self.sampled_at = sampled_at
+
+    @property
+    def mem_available_ratio(self) -> Optional[float]:
+        if not self.mem_total or self.mem_available is None:
+            return None
+        return self.mem_available / self.mem_total
+
+
+class HostSampler:
+    """
+    Cpu and memory usage of the host, from /proc on Linux.
+    Elsewhere, the load average is used for the cpu and memory is unknown.
+    """
+
+    def __init__(self) -> None:
+        self._last_stat = _read_proc_stat()
+
+    def sample(self) -> HostSample:
+        stat = _read_proc_stat()
+        if stat is not None and self._last_stat is not None:
+            deltas = [now - last for now, last in zip(stat, self._last_stat)]
+            # idle and iowait
+            idle = deltas[3] + (deltas[4] if len(deltas) > 4 else 0)
+            cpu_busy = 1 - idle / sum(deltas) if sum(deltas) > 0 else 0.0
+        elif hasattr(os, "getloadavg"):
+            cpu_busy = min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+        else:
+            cpu_busy = 0.0
+        self._last_stat = stat
+
+        meminfo = _read_meminfo() or {}
+        return HostSample(cpu_busy, meminfo.get("MemTotal"), meminfo.get("MemAvailable"), time.time())
+
+
+def container_memory_usage() -> List[int]:
+    """
+    Memory used by each of the running game containers, in bytes.
+
+    :raises docker.errors.APIError
+    """
+    usages = []
+    for container in docker_client().containers.list(filters={"label": GAME_CONTAINER_LABEL}):
+        try:
+            stats = container.stats(stream=False, one_shot=True)
+        except TypeError:
+            # docker SDK older than 6.1
+            stats = container.stats(stream=False)
+        usage = stats.get("memory_stats", {}).get("usage")
+        if usage is not None:
+            usages.append(usage)
+    return usages
+
+
+class ConcurrencyController:
+    """
+    Limits the number of games running at once and adapts the limit
+    to the cpu and memory pressure of the host, between `min_jobs` and `max_jobs`.
+
+    Every ADJUST_INTERVAL seconds, the limit is
+      - decreased by a quarter after games were OOM killed or have realtime outed,
+        which is what oversubscribed hosts do to Wine games,
+      - decreased by one while the host is short of memory or cpu,
+      - decreased by one when running that many games has given fewer games per hour
+        than one game less,
+      - increased by one while all the allowed games are running, the host has
+        cpu to spare and memory for one more game (as used by the running containers).
+    After the limit was decreased because of pressure or throughput, it does not grow
+    over that limit for CEILING_RELAX_TIME seconds.
+
+    Jobs call `acquire` before and `release` after each game.
+    Changes of the limit are kept in `history`.
+    """
+
+    def __init__(
+            self,
+            max_jobs: int,
+            min_jobs: int = 1,
+            start_jobs: Optional[int] = None,
+            sampler: Optional[HostSampler] = None,
+            sample_containers: bool = True
+    ) -> None:
+        if not 1 <= min_jobs <= max_jobs:
+            raise ObserverException(f"expected 1 <= min_jobs <= max_jobs, got {min_jobs} and {max_jobs}")
+        if start_jobs is None:
+            start_jobs = max(1, (os.cpu_count() or 2) // 2)
+
+        self.max_jobs = max_jobs
+        self.min_jobs = min_jobs
+        self.limit = min(max_jobs, max(min_jobs, start_jobs))
+        self.sampler = sampler or HostSampler()
+        self.sample_containers = sample_containers
+
+        self.history = []  # type: List[Dict[str, Any]]
+        self._running = 0
+        self._max_running = 0
+        self._changed = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # since the last adjustment
+        self._samples = []  # type: List[HostSample]
+        self._saturated_samples = 0
+        self._pressure_outcomes = 0
+        # games finished and seconds spent at each limit
+        self._games_at = {}  # type: Dict[int, int]
+        self._time_at = {}  # type: Dict[int, float]
+        self._limit_since = time.time()
+        self._ceiling = max_jobs
+        self._ceiling_since = time.time()
+
+        self._record("start")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._control, name="observer-concurrency", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        with self._changed:
+            self._account_time()
+        self._record("stop")
+
+    def acquire(self) -> None:
+        with self._changed:
+            while self._running >= self.limit:
+                self._changed.wait()
+            self._running += 1
+            self._max_running = max(self._max_running, self._running)
+
+    def release(self, outcome: str = OUTCOME_OK, num_games: int = 1) -> None:
+        """
+        :param num_games: games played, e.g. by a session
+        """
+        with self._changed:
+            self._running -= 1
+            self._games_at[self.limit] = self._games_at.get(self.limit, 0) + num_games
+            if outcome in PRESSURE_OUTCOMES:
+                self._pressure_outcomes += 1
+            self._changed.notify_all()
+
+    def games_per_hour(self, limit: int) -> Optional[float]:
+        """
+        Throughput measured while the limit was `limit`,
+        None until at least `limit` games have finished at it.
+        """
+        with self._changed:
+            games = self._games_at.get(limit, 0)
+            seconds = self._time_at.get(limit, 0.0)
+            if limit == self.limit:
+                seconds += time.time() - self._limit_since
+        if games < limit or seconds <= 0:
+            return None
+        return games * 3600 / seconds
+
+    def _account_time(self) -> None:
+        now = time.time()
+        self._time_at[self.limit] = self._time_at.get(self.limit, 0.0) + now - self._limit_since
+        self._limit_since = now
+
+    def _record(self, reason: str, sample: Optional[HostSample] = None) -> None:
+        entry = dict(time=time.time(), concurrency=self.limit, reason=reason)
+        if sample is not None:
+            entry.update(cpu_busy=round(sample.cpu_busy, 3),
+                         mem_available=sample.mem_available_ratio and round(sample.mem_available_ratio, 3))
+        self.history.append(entry)
+
+    def _set_limit(self, limit: int, reason: str, sample: HostSample) -> None:
+        limit = min(self._ceiling, self.max_jobs, max(self.min_jobs, limit))
+        with self._changed:
+            if limit == self.limit:
+                return
+            self._account_time()
+            logger.info(f"running {limit} games at once instead of {self.limit}: {reason}")
+            self.limit = limit
+            self._record(reason, sample)
+            self._changed.notify_all()
+
+    def _control(self) -> None:
+        last_adjust = time.time()
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            sample = self.sampler.sample()
+            with self._changed:
+                self._samples.append(sample)
+                if self._running >= self.limit:
+                    self._saturated_samples += 1
+            if time.time() - last_adjust >= ADJUST_INTERVAL:
+                try:
+                    self._adjust()
+                except Exception as e:
+                    logger.warning(f"cannot adjust the number of games: {e}")
+                last_adjust = time.time()
+
+    def _adjust(self) -> None:
+        with self._changed:
+            samples, self._samples = self._samples, []
+            saturated, self._saturated_samples = self._saturated_samples, 0
+            pressure_outcomes, self._pressure_outcomes = self._pressure_outcomes, 0
+        if not samples:
+            return
+
+        # the recent sample, with the cpu averaged over the period
+        sample = HostSample(sum(s.cpu_busy for s in samples) / len(samples),
+                            samples[-1].mem_total, samples[-1].mem_available, samples[-1].sampled_at)
+        mem_available = sample.mem_available_ratio
+        current = self.games_per_hour(self.limit)
+        previous = self.games_per_hour(self.limit - 1)
+
+        if pressure_outcomes:
+            self._set_limit(min(self.limit - 1, self.limit * 3 // 4),
+                            f"{pressure_outcomes} games were OOM killed or have realtime outed", sample)
+            # do not grow into the same trouble again soon
+            self._lower_ceiling(self.limit)
+        elif mem_available is not None and mem_available < MIN_MEM_AVAILABLE:
+            self._set_limit(self.limit - 1, f"{mem_available:.0%} of memory available", sample)
+        elif sample.cpu_busy > MAX_CPU_BUSY:
+            self._set_limit(self.limit - 1, f"cpu {sample.cpu_busy:.0%} busy", sample)
+        elif current is not None and previous is not None and current < previous * (1 - THROUGHPUT_TOLERANCE):
+            # more games at once have made the throughput worse
+            self._lower_ceiling(self.limit - 1)
+            self._set_limit(self.limit - 1, f"{current:.1f} games per hour, "
+                                            f"{previous:.1f} with one game less", sample)
+        elif saturated >= len(samples) // 2 and sample.cpu_busy < TARGET_CPU_BUSY \
+                and self._has_memory_for_one_more(sample):
+            self._set_limit(self.limit + 1, f"cpu {sample.cpu_busy:.0%} busy", sample)
+
+        if self._ceiling < self.max_jobs and time.time() - self._ceiling_since >= CEILING_RELAX_TIME:
+            # conditions change, e.g. other replays are lighter, the ceiling is tried again
+            self._ceiling += 1
+            self._ceiling_since = time.time()
+
+    def _lower_ceiling(self, ceiling: int) -> None:
+        self._ceiling = max(self.min_jobs, ceiling)
+        self._ceiling_since = time.time()
+
+    def _has_memory_for_one_more(self, sample: HostSample) -> bool:
+        if sample.mem_available is None or not self.sample_containers:
+            return True
+        usages = container_memory_usage()
+        if not usages:
+            return True
+        per_container = sum(usages) / len(usages)
+        return sample.mem_available - per_container > MIN_MEM_AVAILABLE * sample.mem_total
+
+    def summary(self) -> Dict[str, Any]:
+        limits = sorted(set(self._games_at) | set(self._time_at))
+        return dict(
+            concurrency=self.limit,
+            max_running=self._max_running,
+            min_jobs=self.min_jobs,
+            max_jobs=self.max_jobs,
+            games_per_hour={str(limit): self.games_per_hour(limit) for limit in limits},
+            history=self.history,
+        )
+
+    def write_summary(self, summary_file: str) -> None:
+        tmp_file = f"{summary_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_file, summary_file)
@@ -0,0 +1,394 @@
+import json
+import logging
+import os
+import os.path
+import shutil
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from observer.columnar import CATEGORY, COLUMN_DTYPES, PARQUET_EXTENSION, pyarrow
+from observer.error import ObserverException
+
+logger = logging.getLogger(__name__)
+
+FRAMES = "frames"
+UNIT_EVENTS = "unit_events"
+
+# memory-mapped columns are cached in this directory next to the game outputs
+COLUMN_CACHE_DIR = ".columns"
+COLUMN_CACHE_META = "meta.json"
+
+# missing values of integer columns (e.g. target of a unit event without target)
+NULL_VALUE = -1
+
+# rows decoded at once when building the column cache
+CHUNK_ROWS = 1 << 20
+
+# (start, stop) frames, stop is exclusive; either of them can be None
+FrameRange = Tuple[Optional[int], Optional[int]]
+
+
+class DatasetException(ObserverException):
+    pass
+
+
+def _column_dtype(column: str) -> str:
+    return COLUMN_DTYPES.get(column, CATEGORY)
+
+
+def _parquet_chunks(parquet_file: str) -> Iterator[Dict[str, Union[np.ndarray, tuple]]]:
+    """
+    Decoded chunks of the Parquet file. Integer columns are numpy arrays,
+    text columns are tuples of (codes, categories) with code -1 for missing values.
+    """
+    if pyarrow is None:
+        raise DatasetException(f"Reading {parquet_file} requires pyarrow, "
+                               f"install it with `pip install observer[parquet]`")
+
+    for batch in pyarrow.parquet.ParquetFile(parquet_file, memory_map=True) \
+            .iter_batches(batch_size=CHUNK_ROWS):
+        chunk = {}
+        for name, values in zip(batch.schema.names, batch.columns):
+            dtype = _column_dtype(name)
+            if dtype != CATEGORY:
+                chunk[name] = values.fill_null(NULL_VALUE).to_numpy().astype(dtype, copy=False)
+                continue
+
+            if not pyarrow.types.is_dictionary(values.type):
+                values = values.dictionary_encode()
+            codes = values.indices.fill_null(-1).to_numpy().astype(np.int32, copy=False)
+            chunk[name] = (codes, values.dictionary.to_pylist())
+        yield chunk
+
+
+def _csv_chunks(csv_file: str) -> Iterator[Dict[str, Union[np.ndarray, tuple]]]:
+    """
+    Decoded chunks of a CSV file which has not been converted to Parquet,
+    in the same form as _parquet_chunks.
+    """
+    header = pd.read_csv(csv_file, nrows=0).columns
+    reader = pd.read_csv(
+        csv_file, chunksize=CHUNK_ROWS, on_bad_lines="skip",
+        dtype={name: str for name in header if _column_dtype(name) == CATEGORY}
+    )
+    for frame in reader:
+        chunk = {}
+        for name in frame.columns:
+            dtype = _column_dtype(name)
+            if dtype != CATEGORY:
+                chunk[name] = pd.to_numeric(frame[name], errors="coerce") \
+                    .fillna(NULL_VALUE).to_numpy().astype(dtype)
+                continue
+
+            codes, categories = pd.factorize(frame[name])
+            chunk[name] = (codes.astype(np.int32), list(categories))
+        yield chunk
+
+
+class _ColumnCacheWriter:
+    """
+    Appends decoded chunks to one raw binary file per column.
+
+    Codes of text columns are remapped from the chunk categories
+    to categories shared by the whole table.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        self.num_rows = 0
+        self.is_frame_sorted = True
+        self._last_frame = None
+        self._files = {}
+        self._categories = {}
+
+    def _file(self, name: str):
+        if name not in self._files:
+            self._files[name] = open(f"{self.cache_dir}/{name}.bin", "wb")
+        return self._files[name]
+
+    def _global_codes(self, name: str, codes: np.ndarray, categories: List[str]) -> np.ndarray:
+        index = self._categories.setdefault(name, {})
+        mapping = np.array([index.setdefault(category, len(index)) for category in categories]
+                           + [NULL_VALUE], dtype=np.int32)
+        # code -1 of missing values maps to the last item, NULL_VALUE
+        return mapping[codes]
+
+    def _check_frame_order(self, frames: np.ndarray) -> None:
+        if not len(frames):
+            return
+        if self._last_frame is not None and frames[0] < self._last_frame:
+            self.is_frame_sorted = False
+        if np.any(frames[1:] < frames[:-1]):
+            self.is_frame_sorted = False
+        self._last_frame = frames[-1]
+
+    def append(self, chunk: Dict[str, Union[np.ndarray, tuple]]) -> None:
+        num_rows = None
+        for name, values in chunk.items():
+            if isinstance(values, tuple):
+                values = self._global_codes(name, *values)
+            elif name == "frame":
+                self._check_frame_order(values)
+            self._file(name).write(np.ascontiguousarray(values).tobytes())
+            num_rows = len(values)
+        self.num_rows += num_rows or 0
+
+    def close(self, columns: List[str]) -> List[dict]:
+        for name in columns:
+            self._file(name)  # empty tables still have (empty) column files
+        for f in self._files.values():
+            f.close()
+
+        return [dict(
+            name=name,
+            dtype="int32" if _column_dtype(name) == CATEGORY else _column_dtype(name),
+            categories=list(self._categories.get(name, {})) if _column_dtype(name) == CATEGORY else None
+        ) for name in columns]
+
+
+class GameTable:
+    """
+    One table of a game (frames or unit events) as memory-mapped numpy columns.
+
+    On first access, the Parquet file (or the CSV file, if the game has not
+    been converted) is decoded chunk by chunk into one raw binary file per column
+    in a cache directory next to it. Afterwards, opening the table only maps
+    these files, so nothing is parsed and only the touched pages are read.
+
+    Text columns are stored as int32 codes into `categories(column)`.
+    Missing values are NULL_VALUE.
+    """
+
+    def __init__(self, logs_dir: str, table: str) -> None:
+        self.logs_dir = logs_dir
+        self.table = table
+        self.cache_dir = f"{logs_dir}/{COLUMN_CACHE_DIR}/{table}"
+
+        self._lock = threading.Lock()
+        self._meta = None
+        self._columns = {}
+
+    @property
+    def source_file(self) -> str:
+        for extension in (PARQUET_EXTENSION, ".csv"):
+            source_file = f"{self.logs_dir}/{self.table}{extension}"
+            if os.path.isfile(source_file):
+                return source_file
+        raise DatasetException(f"No {self.table} data found in {self.logs_dir}")
+
+    @staticmethod
+    def _source_signature(source_file: str) -> dict:
+        stat = os.stat(source_file)
+        return dict(source=os.path.basename(source_file), size=stat.st_size, mtime=stat.st_mtime)
+
+    def _read_meta(self, signature: dict) -> Optional[dict]:
+        try:
+            with open(f"{self.cache_dir}/{COLUMN_CACHE_META}", "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if all(meta.get(key) == value for key, value in signature.items()) else None
+
+    def _build_cache(self, source_file: str, signature: dict) -> dict:
+        logger.debug(f"building column cache of {source_file}")
+        tmp_dir = f"{self.cache_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            writer = _ColumnCacheWriter(tmp_dir)
+            columns = None
+            if source_file.endswith(PARQUET_EXTENSION):
+                chunks = _parquet_chunks(source_file)
+                columns = pyarrow.parquet.read_schema(source_file).names
+            else:
+                chunks = _csv_chunks(source_file)
+                columns = list(pd.read_csv(source_file, nrows=0).columns)
+            for chunk in chunks:
+                writer.append(chunk)
+
+            meta = dict(signature, num_rows=writer.num_rows,
+                        is_frame_sorted=writer.is_frame_sorted,
+                        columns=writer.close(columns))
+            with open(f"{tmp_dir}/{COLUMN_CACHE_META}", "w") as f:
+                json.dump(meta, f)
+
+            # replace the cache at once, readers never see a partial one
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.replace(tmp_dir, self.cache_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return meta
+
+    @property
+    def meta(self) -> dict:
+        with self._lock:
+            if self._meta is None:
+                source_file = self.source_file
+                signature = self._source_signature(source_file)
+                self._meta = self._read_meta(signature)
+                if self._meta is None:
+                    try:
+                        self._meta = self._build_cache(source_file, signature)
+                    except (OSError, ValueError, pd.errors.ParserError) as e:
+                        raise DatasetException(f"Cannot read {source_file}: {e}") from e
+            return self._meta
+
+    @property
+    def columns(self) -> List[str]:
+        return [column["name"] for column in self.meta["columns"]]
+
+    def __len__(self) -> int:
+        return self.meta["num_rows"]
+
+    def _column_meta(self, name: str) -> dict:
+        for column in self.meta["columns"]:
+            if column["name"] == name:
+                return column
+        raise DatasetException(f"Column {name} not found in {self.table} of {self.logs_dir}")
+
+    def is_category(self, name: str) -> bool:
+        return self._column_meta(name)["categories"] is not None
+
+    def categories(self, name: str) -> np.ndarray:
+        return np.array(self._column_meta(name)["categories"], dtype=object)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Read-only memory-mapped view of the whole column.
+        """
+        if name not in self._columns:
+            dtype = np.dtype(self._column_meta(name)["dtype"])
+            if len(self) == 0:
+                self._columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(f"{self.cache_dir}/{name}.bin", dtype=dtype,
+                                                mode="r", shape=(len(self),))
+        return self._columns[name]
+
+    def _frame_index(self, frame_range: Optional[FrameRange]) -> Union[slice, np.ndarray]:
+        if frame_range is None:
+            return slice(None)
+
+        start, stop = frame_range
+        frames = self.column("frame")
+        if self.meta["is_frame_sorted"]:
+            # binary search only touches a few pages of the mapped column
+            lo = 0 if start is None else int(np.searchsorted(frames, start, side="left"))
+            hi = len(frames) if stop is None else int(np.searchsorted(frames, stop, side="left"))
+            return slice(lo, max(lo, hi))
+
+        is_selected = np.ones(len(frames), dtype=bool)
+        if start is not None:
+            is_selected &= frames >= start
+        if stop is not None:
+            is_selected &= frames < stop
+        return np.flatnonzero(is_selected)
+
+    def decode(self, name: str, codes: np.ndarray) -> np.ndarray:
+        """
+        Texts of the codes of a text column, missing values are empty strings.
+        """
+        return np.append(self.categories(name), "")[codes]
+
+    def select(
+            self,
+            frame_range: Optional[FrameRange] = None,
+            players: Optional[Iterable[int]] = None,
+            columns: Optional[Iterable[str]] = None,
+            decode: bool = True
+    ) -> Dict[str, np.ndarray]:
+        """
+        Columns of the rows in the frame range which belong to the players.
+
+        Without a player filter, integer columns are views of the mapped files
+        and no data is copied. With `decode`, text columns are returned
+        as arrays of strings, otherwise as int32 codes.
+        """
+        index = self._frame_index(frame_range)
+        mask = None
+        if players is not None:
+            mask = np.isin(self.column("player")[index], list(players))
+
+        selected = {}
+        for name in (self.columns if columns is None else columns):
+            values = self.column(name)[index]
+            if mask is not None:
+                values = values[mask]
+            if decode and self.is_category(name):
+                values = self.decode(name, values)
+            selected[name] = values
+        return selected
+
+
+class GameData:
+    """
+    Data extracted from one game, see GameTable.select for the selection options.
+    """
+
+    def __init__(self, game_dir: str, game_name: str, nth_player: int = 0) -> None:
+        self.game_dir = game_dir
+        self.game_name = game_name
+        self.logs_dir = f"{game_dir}/{game_name}/logs_{nth_player}"
+        self.frames_table = GameTable(self.logs_dir, FRAMES)
+        self.unit_events_table = GameTable(self.logs_dir, UNIT_EVENTS)
+
+    def frames(self, *args, **kwargs) -> Dict[str, np.ndarray]:
+        return self.frames_table.select(*args, **kwargs)
+
+    def unit_events(self, *args, **kwargs) -> Dict[str, np.ndarray]:
+        return self.unit_events_table.select(*args, **kwargs)
+
+
+class Dataset:
+    """
+    All games in a game dir. Games are opened lazily one by one,
+    so iterating over thousands of them keeps only one in memory.
+    """
+
+    def __init__(self, game_dir: str, nth_player: int = 0) -> None:
+        self.game_dir = game_dir
+        self.nth_player = nth_player
+        self._game_names = None
+
+    @property
+    def game_names(self) -> List[str]:
+        if self._game_names is None:
+            self._game_names = sorted(
+                name for name in os.listdir(self.game_dir)
+                if not name.startswith(".")
+                and os.path.isdir(f"{self.game_dir}/{name}/logs_{self.nth_player}")
+            )
+        return self._game_names
+
+    def __len__(self) -> int:
+        return len(self.game_names)
+
+    def __iter__(self) -> Iterator[GameData]:
+        for game_name in self.game_names:
+            yield self.game(game_name)
+
+    def game(self, game_name: str) -> GameData:
+        return GameData(self.game_dir, game_name, self.nth_player)
+
+    def _iter_table(self, table: str, **select_kwargs) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        for game in self:
+            try:
+                yield game.game_name, getattr(game, f"{table}_table").select(**select_kwargs)
+            except DatasetException as e:
+                logger.warning(f"Skipping game {game.game_name}: {e}")
+
+    def iter_frames(self, **select_kwargs) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        (game name, frames) of every game which has them.
+        """
+        return self._iter_table(FRAMES, **select_kwargs)
+
+    def iter_unit_events(self, **select_kwargs) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """
+        (game name, unit events) of every game which has them.
+        """
+        return self._iter_table(UNIT_EVENTS, **select_kwargs)
@@ -18,6 +18,13 @@ SC_BWAPI_DATA_BWTA_DIR = f"{OBSERVER_BASE_DIR}/bwapi-data/BWTA"
 SC_BWAPI_DATA_BWTA2_DIR = f"{OBSERVER_BASE_DIR}/bwapi-data/BWTA2"
 SC_BOT_DIR = f"{OBSERVER_BASE_DIR}/bots"
 SC_MAP_DIR = f"{OBSERVER_BASE_DIR}/maps"
+SC_REPLAY_CATALOGUE = f"{OBSERVER_BASE_DIR}/replays.sqlite"
+SC_ENV_CACHE = f"{OBSERVER_BASE_DIR}/env_cache.json"
+SC_BOT_REGISTRY = f"{OBSERVER_BASE_DIR}/bot_registry.json"
+SC_RESULTS_DB = f"{OBSERVER_BASE_DIR}/results.sqlite"
+SC_SERVER_DB = f"{OBSERVER_BASE_DIR}/server.sqlite"
 
 SC_IMAGE = "starcraft:game"
+BASE_VNC_PORT = 5900
+VNC_HOST = "localhost"
 SC_JAVA_IMAGE = "starcraft:java"
@@ -0,0 +1,234 @@
+import logging
+import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import docker
+import docker.context
+import docker.tls
+
+from observer.error import DockerException, HostDroppedException
+
+logger = logging.getLogger(__name__)
+
+LOCAL_HOST = "local"
+# alive hosts are pinged, and dropped hosts are tried again, this often
+HEALTH_CHECK_INTERVAL = 10.0
+# timeout of requests to the docker daemons, except of waiting for containers
+CLIENT_TIMEOUT = 60
+
+
+class DockerHost:
+    """
+    Docker daemon which runs up to `capacity` games at once.
+
+    Containers on local daemons (the default one, or unix:// sockets) mount
+    the directories of the observer, other hosts get the inputs copied
+    into the containers and the outputs are copied back.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            base_url: Optional[str] = None,
+            capacity: int = 1,
+            tls: Optional[docker.tls.TLSConfig] = None
+    ) -> None:
+        if capacity < 1:
+            raise DockerException(f"capacity of docker host {name} must be positive, got {capacity}")
+        self.name = name
+        self.base_url = base_url
+        self.capacity = capacity
+        self.tls = tls
+
+        self.in_use = 0
+        self.is_alive = False
+        self.error = None  # type: Optional[str]
+        self._client = None
+
+    @property
+    def is_local(self) -> bool:
+        return self.base_url is None or self.base_url.startswith("unix://")
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            if self.base_url is None:
+                from observer.docker_utils import docker_client
+                self._client = docker_client()
+            else:
+                self._client = docker.DockerClient(base_url=self.base_url, tls=self.tls or False,
+                                                   timeout=CLIENT_TIMEOUT)
+        return self._client
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.client.ping())
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def _parse_host(spec: str) -> DockerHost:
+    url, _, capacity = spec.strip().rpartition("=")
+    if not url or not capacity.isdigit():
+        url, capacity = spec.strip(), "1"
+
+    if url == LOCAL_HOST:
+        return DockerHost(LOCAL_HOST, None, int(capacity))
+    if url.startswith("context:"):
+        name = url[len("context:"):]
+        context = docker.context.ContextAPI.get_context(name)
+        if context is None:
+            raise DockerException(f"docker context {name} does not exist")
+        return DockerHost(url, context.Host, int(capacity), context.TLSConfig)
+    return DockerHost(url, url, int(capacity))
+
+
+def parse_docker_hosts(spec: str) -> List[DockerHost]:
+    """
+    Hosts given as a comma separated list, or a file with one host per line,
+    of URL=CAPACITY, e.g. "local=4,tcp://10.0.0.2:2375=8,ssh://me@box3=8,context:rack1=8".
+    "local" is the daemon of the environment (DOCKER_HOST), the capacity defaults to 1.
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r") as f:
+            specs = [line for line in f.read().splitlines()
+                     if line.strip() and not line.strip().startswith("#")]
+    else:
+        specs = [part for part in spec.split(",") if part.strip()]
+
+    hosts = [_parse_host(host_spec) for host_spec in specs]
+    if not hosts:
+        raise DockerException(f"no docker hosts in {spec}")
+    names = [host.name for host in hosts]
+    if len(set(names)) != len(names):
+        raise DockerException(f"docker hosts are given more than once in {spec}")
+    return hosts
+
+
+class HostPool:
+    """
+    Dispatches games to the least loaded docker host with free capacity.
+
+    Hosts are pinged in the background. A host which does not respond
+    is dropped: no more games are dispatched to it and the games running
+    on it fail with HostDroppedException, so they can be played elsewhere.
+    Dropped hosts are tried again and rejoin once they respond.
+
+    :param on_join: prepares a host before the first game is dispatched to it,
+                    e.g. creates the network. Hosts for which it fails are dropped.
+    """
+
+    def __init__(
+            self,
+            hosts: List[DockerHost],
+            on_join: Callable[[DockerHost], None] = lambda host: None
+    ) -> None:
+        self.hosts = hosts
+        self.on_join = on_join
+
+        self._changed = threading.Condition()
+        self._stop_event = threading.Event()
+        self._health_thread = None
+
+    @property
+    def capacity(self) -> int:
+        return sum(host.capacity for host in self.hosts)
+
+    def _join(self, host: DockerHost) -> bool:
+        if not host.ping():
+            return False
+        try:
+            self.on_join(host)
+        except Exception as e:
+            host.error = str(e)
+            return False
+
+        with self._changed:
+            host.is_alive = True
+            host.error = None
+            self._changed.notify_all()
+        logger.info(f"docker host {host} joined with capacity {host.capacity}")
+        return True
+
+    def start(self) -> None:
+        """
+        :raises DockerException if none of the hosts can be used
+        """
+        with ThreadPoolExecutor(max_workers=len(self.hosts)) as executor:
+            joined = list(executor.map(self._join, self.hosts))
+        for host, is_joined in zip(self.hosts, joined):
+            if not is_joined:
+                logger.warning(f"docker host {host} cannot be used: {host.error}")
+        if not any(joined):
+            raise DockerException("none of the docker hosts can be used")
+
+        self._stop_event.clear()
+        self._health_thread = threading.Thread(target=self._check_health, name="observer-hosts", daemon=True)
+        self._health_thread.start()
+
+    def close(self) -> None:
+        self._stop_event.set()
+
+    def drop(self, host: DockerHost, error: str) -> None:
+        with self._changed:
+            if not host.is_alive:
+                return
+            host.is_alive = False
+            host.error = error
+            self._changed.notify_all()
+        logger.error(f"docker host {host} dropped out: {error}")
+
+    def check(self, host: DockerHost) -> bool:
+        """
+        Whether the host still responds, drops it if not.
+        """
+        if host.is_alive and host.ping():
+            return True
+        self.drop(host, host.error or "does not respond")
+        return False
+
+    def ensure_alive(self, host: DockerHost) -> None:
+        """
+        :raises HostDroppedException
+        """
+        if not host.is_alive:
+            raise HostDroppedException(f"docker host {host} dropped out: {host.error}")
+
+    def _check_health(self) -> None:
+        while not self._stop_event.wait(HEALTH_CHECK_INTERVAL):
+            for host in self.hosts:
+                if host.is_alive:
+                    self.check(host)
+                else:
+                    self._join(host)
+
+    def acquire(self) -> DockerHost:
+        """
+        Reserve a slot on the least loaded alive host, waits for a free one.
+
+        :raises DockerException if all the hosts have dropped out
+        """
+        with self._changed:
+            while True:
+                alive = [host for host in self.hosts if host.is_alive]
+                if not alive and self._health_thread is not None and not self._health_thread.is_alive():
+                    raise DockerException("all docker hosts have dropped out")
+                free = [host for host in alive if host.in_use < host.capacity]
+                if free:
+                    host = min(free, key=lambda host: host.in_use / host.capacity)
+                    host.in_use += 1
+                    return host
+                if not alive:
+                    logger.warning("all docker hosts have dropped out, waiting for some to come back")
+                self._changed.wait(HEALTH_CHECK_INTERVAL)
+
+    def release(self, host: DockerHost) -> None:
+        with self._changed:
+            host.in_use -= 1
+            self._changed.notify_all()
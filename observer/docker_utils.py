@@ -1,34 +1,79 @@
-import distutils.dir_util
-import distutils.errors
+import io
 import logging
 import os
 import os.path
+import queue
 import re
 import shutil
+import socket
 import subprocess
+import tarfile
+import tempfile
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
 from pprint import pformat
 from typing import List, Optional, Callable, Dict, Any
 
 import docker
 import docker.errors
+import docker.models.containers
 import docker.types
 
-from observer.error import ContainerException, DockerException, GameException, RealtimeOutedException
+from observer.bot_image import find_bot_image
+from observer.defaults import BASE_VNC_PORT, VNC_HOST
+from observer.docker_hosts import DockerHost
+from observer.env_cache import cached_check, invalidate_check
+from observer.error import (
+    ContainerException, DockerException, GameException, OutOfMemoryException, RealtimeOutedException,
+    StalledException
+)
 from observer.game_type import GameType
 from observer.player import BotPlayer, HumanPlayer, Player
+from observer.resource_sampler import ResourceSampler
+from observer.stall_watchdog import TAIL_BYTES, StallWatchdog, last_frame, read_tail
 from observer.vnc import launch_vnc_viewer
 
 logger = logging.getLogger(__name__)
 # disable docker package spam logging
 logging.getLogger('urllib3.connectionpool').propagate = False
 
-docker_client = docker.from_env()
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+
+def docker_client() -> docker.DockerClient:
+    """
+    Client of the local docker daemon, created on first use,
+    so that importing this module does not connect to docker.
+    """
+    global _docker_client
+    with _docker_client_lock:
+        if _docker_client is None:
+            _docker_client = docker.from_env()
+        return _docker_client
+
+
+def set_docker_client(client: Optional[docker.DockerClient]) -> None:
+    """
+    Use the client instead of the one of the environment, e.g. the fake of observer.fake_docker.
+    None goes back to the environment.
+    """
+    global _docker_client
+    with _docker_client_lock:
+        _docker_client = client
+
+
+def _client(docker_host: Optional[DockerHost]) -> docker.DockerClient:
+    return docker_host.client if docker_host is not None else docker_client()
+
 
 DOCKER_STARCRAFT_NETWORK = "sc_net"
+# label of the containers which play games, lean ones are not on the network
+GAME_CONTAINER_LABEL = "observer.game"
+# label with the observer process which has launched the container, "<hostname>:<pid>"
+OWNER_LABEL = "observer.owner"
 SUBNET_CIDR = "172.18.0.0/16"
-BASE_VNC_PORT = 5900
-VNC_HOST = "localhost"
 APP_DIR = "/app"
 LOG_DIR = f"{APP_DIR}/logs"
 SC_DIR = f"{APP_DIR}/sc"
@@ -36,6 +81,7 @@ BWTA_DIR = f"{APP_DIR}/bwta"
 BWAPI_DIR = f"{APP_DIR}/bwapi"
 BOT_DIR = f"{APP_DIR}/bot"
 MAP_DIR = f"{SC_DIR}/maps"
+REPLAY_DIR = f"{SC_DIR}/replay"
 ERRORS_DIR = f"{SC_DIR}/Errors"
 BWAPI_DATA_DIR = f"{SC_DIR}/bwapi-data"
 BOT_DATA_SAVE_DIR = f"{BWAPI_DATA_DIR}/save"
@@ -46,6 +92,23 @@ BOT_DATA_LOGS_DIR = f"{BWAPI_DATA_DIR}/logs"
 
 EXIT_CODE_REALTIME_OUTED = 2
 MAX_TIME_RUNNING_SINGLE_CONTAINER = 3600
+# how often is wait_callback called while waiting for the game containers
+WAIT_CALLBACK_INTERVAL = 3
+# stages signalled by play_common.sh with marker files in the log dir
+READY_GUI = "gui"
+READY_REGISTRY = "registry"
+READY_GAME = "game"
+READY_BOT = "bot"
+READY_REPLAY = "replay"
+READY_FINISHED = "finished"
+# StarCraft is expected to run this many seconds after the containers are launched
+GAME_START_TIMEOUT = 60
+READY_POLL_INTERVAL = 0.1
+# containers are removed by this many threads in the background
+REAPER_THREADS = 4
+# owner of the files copied into containers (starcraft:users)
+CONTAINER_UID = 1000
+CONTAINER_GID = 100
 
 try:
     from subprocess import DEVNULL  # py3k
@@ -60,8 +123,8 @@ def ensure_docker_can_run() -> None:
     :raises docker.errors.APIError
     """
     logger.info("checking docker can run")
-    version = docker_client.version()["ApiVersion"]
-    docker_client.containers.run("hello-world")
+    version = docker_client().version()["ApiVersion"]
+    docker_client().containers.run("hello-world")
     logger.debug(f"using docker API version {version}")
 
 
@@ -75,19 +138,43 @@ def ensure_local_net(
     :raises docker.errors.APIError
     """
     logger.info(f"checking whether docker has network {network_name}")
+    output = cached_check(_network_check_key(network_name),
+                          lambda: _find_or_create_network(docker_client(), network_name, subnet_cidr))
+    logger.debug(f"docker network id: {output}")
+
+
+def _network_check_key(network_name: str) -> str:
+    return f"network:{network_name}"
+
+
+def _find_or_create_network(client: docker.DockerClient, network_name: str, subnet_cidr: str) -> str:
     ipam_pool = docker.types.IPAMPool(subnet=subnet_cidr)
     ipam_config = docker.types.IPAMConfig(pool_configs=[ipam_pool])
-    networks = docker_client.networks.list(names=DOCKER_STARCRAFT_NETWORK)
+    networks = client.networks.list(names=network_name)
     output = networks[0].short_id if networks else None
     if not output:
         logger.info("network not found, creating ...")
-        output = docker_client.networks.create(DOCKER_STARCRAFT_NETWORK, ipam=ipam_config).short_id
-    logger.debug(f"docker network id: {output}")
+        output = client.networks.create(network_name, ipam=ipam_config).short_id
+    return output
+
+
+def prepare_docker_host(docker_host: DockerHost, docker_image: str) -> None:
+    """
+    Create the network on the host, if not found.
+
+    :raises DockerException if the host does not have the game image
+    :raises docker.errors.APIError
+    """
+    _find_or_create_network(docker_host.client, DOCKER_STARCRAFT_NETWORK, SUBNET_CIDR)
+    try:
+        docker_host.client.images.get(docker_image)
+    except docker.errors.ImageNotFound:
+        raise DockerException(f"docker host {docker_host} does not have the image {docker_image}")
 
 
 def check_for_game_image(image_name: str) -> None:
     try:
-        docker_client.images.get(image_name)
+        docker_client().images.get(image_name)
     except docker.errors.ImageNotFound:
         logger.error(f"please make sure to have pulled or built the image {image_name}")
     except docker.errors.APIError:
@@ -123,7 +210,13 @@ def dockermachine_ip() -> Optional[str]:
     Returns None if no docker-machine executable
     in the PATH and if there no Docker machine
     with name default present
+
+    The result is cached, docker-machine is not spawned on every run.
     """
+    return cached_check("dockermachine_ip", _dockermachine_ip)
+
+
+def _dockermachine_ip() -> Optional[str]:
     if not check_dockermachine():
         return None
 
@@ -147,6 +240,85 @@ def xoscmounts(host_mount):
     return host_mount
 
 
+def _input_archive(files: Dict[str, str], dirs: List[str]) -> bytes:
+    """
+    Tar archive to be extracted at / of a container, with the host `files`
+    (or directories) at the given container paths and the empty `dirs`.
+    """
+    def owned(info: tarfile.TarInfo) -> tarfile.TarInfo:
+        info.uid, info.gid = CONTAINER_UID, CONTAINER_GID
+        return info
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for dir_name in dirs:
+            dir_info = tarfile.TarInfo(dir_name.lstrip("/"))
+            dir_info.type, dir_info.mode = tarfile.DIRTYPE, 0o777
+            tar.addfile(owned(dir_info))
+        for container_path, host_path in files.items():
+            tar.add(host_path, arcname=container_path.lstrip("/"), filter=owned)
+    return archive.getvalue()
+
+
+def copy_from_container(
+        container: docker.models.containers.Container,
+        container_dir: str,
+        host_dir: str,
+        prefix: str = ""
+) -> None:
+    """
+    Copy the contents of the container directory (only the files
+    whose path starts with `prefix`) into the host directory.
+
+    :raises docker.errors.APIError
+    """
+    try:
+        chunks, _ = container.get_archive(container_dir)
+    except docker.errors.NotFound:
+        return
+
+    # outputs can be large, they are not kept in memory
+    with tempfile.TemporaryFile() as archive:
+        for chunk in chunks:
+            archive.write(chunk)
+        archive.seek(0)
+
+        with tarfile.open(fileobj=archive) as tar:
+            for member in tar:
+                # paths in the archive start with the name of the directory
+                _, _, path = member.name.partition("/")
+                if not path or not path.startswith(prefix) or ".." in path.split("/"):
+                    continue
+                host_path = os.path.join(host_dir, path)
+                if member.isdir():
+                    os.makedirs(host_path, mode=0o777, exist_ok=True)
+                elif member.isfile():
+                    os.makedirs(os.path.dirname(host_path), mode=0o777, exist_ok=True)
+                    with tar.extractfile(member) as src, open(host_path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+
+
+def copy_game_outputs(
+        container: docker.models.containers.Container,
+        player: Player,
+        nth_player: int,
+        game_dir: str,
+        game_name: str,
+        map_dir: str
+) -> None:
+    """
+    Copy outputs of a container which does not mount the observer directories
+    into the directories which local containers mount.
+
+    :raises docker.errors.APIError
+    """
+    copy_from_container(container, LOG_DIR, f"{game_dir}/{game_name}/logs_{nth_player}")
+    copy_from_container(container, ERRORS_DIR, f"{game_dir}/{game_name}/crashes_{nth_player}")
+    if isinstance(player, BotPlayer):
+        copy_from_container(container, BOT_DATA_WRITE_DIR, f"{game_dir}/{game_name}/write_{nth_player}")
+    copy_from_container(container, f"{MAP_DIR}/replays", f"{map_dir}/replays", prefix=f"{game_name}_")
+
+
 def launch_image(
         # players info
         player: Player,
@@ -155,6 +327,7 @@ def launch_image(
 
         # game settings
         headless: bool,
+        lean: bool,
         game_name: str,
         map_name: str,
         game_type: GameType,
@@ -164,6 +337,7 @@ def launch_image(
         timeout_at_frame: Optional[int],
         allow_input: bool,
         auto_launch: bool,
+        replay_file: Optional[str],
 
         # mount dirs
         game_dir: str,
@@ -177,9 +351,16 @@ def launch_image(
         # docker
         docker_image: str,
         nano_cpus: Optional[int],
-        mem_limit: Optional[str]
-) -> None:
+        mem_limit: Optional[str],
+
+        docker_host: Optional[DockerHost] = None
+) -> docker.models.containers.Container:
     """
+    :param lean: nobody watches the game: no VNC server, no network
+                 and StarCraft settings for speed, see play_common.sh
+    :param docker_host: the host to run the container on, by default the local docker.
+                        Directories cannot be mounted on other machines,
+                        instead the inputs are copied into the container.
     :raises docker,errors.APIError
     :raises DockerException
     """
@@ -189,15 +370,29 @@ def launch_image(
     crashes_dir = f"{game_dir}/{game_name}/crashes_{nth_player}"
     os.makedirs(log_dir, mode=0o777, exist_ok=True)  # todo: proper mode
     os.makedirs(crashes_dir, mode=0o777, exist_ok=True)  # todo: proper mode
+    remove_ready_markers(log_dir)
 
     volumes = {
         xoscmounts(log_dir): {"bind": LOG_DIR, "mode": "rw"},
         xoscmounts(map_dir): {"bind": MAP_DIR, "mode": "rw"},
         xoscmounts(crashes_dir): {"bind": ERRORS_DIR, "mode": "rw"},
     }
+    # the same for hosts which cannot mount the directories
+    copied_files = {}
+    copied_dirs = [LOG_DIR, ERRORS_DIR, f"{MAP_DIR}/replays"]
+    if os.path.isfile(f"{map_dir}/{map_name}"):
+        copied_files[f"{MAP_DIR}/{map_name}"] = f"{map_dir}/{map_name}"
+
+    if replay_file is not None:
+        # the replay is started by BWAPI auto menu, see prepare_bwapi in play_common.sh
+        container_replay_file = f"{REPLAY_DIR}/{game_name}.rep"
+        volumes.update({
+            xoscmounts(os.path.abspath(replay_file)): {"bind": container_replay_file, "mode": "ro"},
+        })
+        copied_files[container_replay_file] = os.path.abspath(replay_file)
 
     ports = {}
-    if not headless:
+    if not headless and not lean:
         ports.update({"5900/tcp": vnc_base_port + nth_player})
 
     env = dict(
@@ -225,6 +420,12 @@ def launch_image(
         JAVA_DEBUG="0"
     )
 
+    if lean:
+        env["LEAN_PROFILE"] = "1"
+
+    if replay_file is not None:
+        env["INPUT_REPLAY"] = container_replay_file
+
     if timeout is not None:
         env["PLAY_TIMEOUT"] = timeout
 
@@ -235,8 +436,17 @@ def launch_image(
         os.makedirs(bot_data_write_dir, mode=0o777, exist_ok=True)  # todo: proper mode
         volumes.update({
             xoscmounts(bot_data_write_dir): {"bind": BOT_DATA_WRITE_DIR, "mode": "rw"},
-            xoscmounts(player.bot_dir): {"bind": BOT_DIR, "mode": "ro"},
         })
+        copied_dirs.append(BOT_DATA_WRITE_DIR)
+        bot_image = find_bot_image(_client(docker_host), docker_image, player)
+        if bot_image is not None:
+            # the bot is laid out in the image already
+            docker_image = bot_image
+        else:
+            volumes.update({
+                xoscmounts(player.bot_dir): {"bind": BOT_DIR, "mode": "ro"},
+            })
+            copied_files[BOT_DIR] = player.bot_dir
         env["BOT_FILE"] = player.bot_basefilename
         env["BOT_BWAPI"] = player.bwapi_version
 
@@ -274,6 +484,9 @@ def launch_image(
             entrypoint_opts += ["--join"]
     command += entrypoint_opts
 
+    # a replay needs no other player to connect to
+    network = dict(network_mode="none") if lean else dict(network=DOCKER_STARCRAFT_NETWORK)
+
     logger.debug(
         "\n"
         f"docker_image={docker_image}\n"
@@ -282,47 +495,237 @@ def launch_image(
         f"detach={True}\n"
         f"environment={pformat(env, indent=4)}\n"
         f"volumes={pformat(volumes, indent=4)}\n"
-        f"network={DOCKER_STARCRAFT_NETWORK}\n"
+        f"network={network}\n"
         f"ports={ports}\n"
         f"nano_cpus={nano_cpus}\n"
         f"mem_limit={mem_limit}\n"
+        f"docker_host={docker_host or 'default'}\n"
     )
 
-    container = docker_client.containers.run(
-        docker_image,
+    run_params = dict(
         command=command,
         name=container_name,
-        detach=True,
         environment=env,
-        volumes=volumes,
-        network=DOCKER_STARCRAFT_NETWORK,
+        labels={GAME_CONTAINER_LABEL: game_name, OWNER_LABEL: container_owner()},
         ports=ports,
         nano_cpus=nano_cpus,
-        mem_limit=mem_limit or None
+        mem_limit=mem_limit or None,
+        **network
     )
+    if docker_host is None or docker_host.is_local:
+        try:
+            container = _client(docker_host).containers.run(docker_image, detach=True, volumes=volumes, **run_params)
+        except docker.errors.NotFound as e:
+            if "network" not in run_params or DOCKER_STARCRAFT_NETWORK not in str(e):
+                raise
+            # the network was removed since it has been checked
+            logger.warning(f"docker network {DOCKER_STARCRAFT_NETWORK} was not found, creating it again")
+            invalidate_check(_network_check_key(DOCKER_STARCRAFT_NETWORK))
+            ensure_local_net()
+            container = _client(docker_host).containers.run(docker_image, detach=True, volumes=volumes, **run_params)
+    else:
+        container = docker_host.client.containers.create(docker_image, **run_params)
+        try:
+            container.put_archive("/", _input_archive(copied_files, copied_dirs))
+            container.start()
+        except BaseException:
+            reap_containers([container])
+            raise
     if container:
-        container_id = running_containers(container_name)
         logger.info(f"launched {player}")
-        logger.debug(f"container name = '{container_name}', container id = '{container_id}'")
+        logger.debug(f"container name = '{container_name}', container id = '{container.short_id}'")
     else:
         raise DockerException(f"could not launch {player} in container {container_name}")
+    return container
+
 
+def ready_marker(log_dir: str, stage: str) -> str:
+    return f"{log_dir}/.ready_{stage}"
 
-def running_containers(name_filter: str) -> List[str]:
+
+def remove_ready_markers(log_dir: str) -> None:
+    """
+    Markers of a previous game with the same name would signal readiness too early.
+    """
+    for stage in (READY_GUI, READY_REGISTRY, READY_GAME, READY_BOT, READY_REPLAY, READY_FINISHED):
+        try:
+            os.remove(ready_marker(log_dir, stage))
+        except FileNotFoundError:
+            pass
+
+
+def _has_signalled(
+        container: docker.models.containers.Container,
+        log_dir: str,
+        stage: str,
+        docker_host: Optional[DockerHost]
+) -> bool:
+    if docker_host is None or docker_host.is_local:
+        return os.path.isfile(ready_marker(log_dir, stage))
+    # the log dir is not mounted on other machines
+    try:
+        return container.exec_run(["test", "-f", ready_marker(LOG_DIR, stage)]).exit_code == 0
+    except docker.errors.APIError:
+        return False
+
+
+def wait_for_ready(
+        containers: List[docker.models.containers.Container],
+        log_dirs: List[str],
+        stage: str,
+        timeout: float,
+        docker_host: Optional[DockerHost] = None
+) -> bool:
+    """
+    Wait until all the containers have signalled the stage (see signal_ready in play_common.sh).
+    Returns False if some of them have not within the timeout, e.g. images older than the signals.
+
+    :raises DockerException if a container exits without signalling
+    """
+    waiting = dict(zip(containers, log_dirs))
+    time_start = time.time()
+    last_status_check = time_start
+    while True:
+        for container, log_dir in list(waiting.items()):
+            if _has_signalled(container, log_dir, stage, docker_host):
+                del waiting[container]
+        if not waiting:
+            return True
+        if time.time() - time_start >= timeout:
+            return False
+
+        if time.time() - last_status_check >= 1:
+            last_status_check = time.time()
+            for container, log_dir in waiting.items():
+                container.reload()
+                if container.status not in ("created", "running") \
+                        and not _has_signalled(container, log_dir, stage, docker_host):
+                    raise DockerException(f"container {container.name} exited prematurely, please check logs")
+        time.sleep(READY_POLL_INTERVAL)
+
+
+def running_containers(name_filter: str, docker_host: Optional[DockerHost] = None) -> List[str]:
     """
     :raises docker.exceptions.APIError
     """
     return [container.short_id for container in
-            docker_client.containers.list(filters={"name": name_filter})]
+            _client(docker_host).containers.list(filters={"name": name_filter})]
 
 
-def remove_game_containers(name_filter: str) -> None:
+def container_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _remove_container(container: docker.models.containers.Container) -> None:
+    try:
+        # running containers are killed, there is nothing left to save in them
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    except docker.errors.APIError as e:
+        logger.warning(f"could not remove container {container.name}: {e}")
+
+
+class ContainerReaper:
+    """
+    Removes containers in the background and in parallel, so that games do not wait for their teardown.
+
+    The threads of the reaper finish all the queued removals before the process exits.
+    Containers left behind by processes which could not do so are removed on the next start,
+    see `remove_orphan_containers`.
+    """
+
+    def __init__(self, threads: int = REAPER_THREADS) -> None:
+        self.threads = threads
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._pending = {}  # type: Dict[str, Future]
+        self._lock = threading.Lock()
+
+    def reap(self, containers: List[docker.models.containers.Container]) -> List[Future]:
+        futures = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="reaper")
+            for container in containers:
+                future = self._executor.submit(_remove_container, container)
+                self._pending[container.name] = future
+                futures.append(future)
+        for container, future in zip(containers, futures):
+            future.add_done_callback(lambda done, name=container.name: self._done(name, done))
+        return futures
+
+    def _done(self, name: str, future: Future) -> None:
+        with self._lock:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+
+    def wait(self, name_prefix: str = "", timeout: Optional[float] = None) -> None:
+        """
+        Wait until the containers whose name starts with the prefix are removed.
+        """
+        with self._lock:
+            futures = [future for name, future in self._pending.items() if name.startswith(name_prefix)]
+        wait_futures(futures, timeout)
+
+
+_reaper = ContainerReaper()
+
+
+def reap_containers(containers: List[docker.models.containers.Container]) -> None:
+    """
+    Remove the containers in the background.
+    """
+    _reaper.reap(containers)
+
+
+def remove_containers(containers: List[docker.models.containers.Container]) -> None:
+    """
+    Remove the containers in parallel and wait until they are removed.
+    """
+    wait_futures(_reaper.reap(containers))
+
+
+def remove_game_containers(name_filter: str, docker_host: Optional[DockerHost] = None) -> None:
     """
     :raises docker.exceptions.APIError
     """
-    for container in docker_client.containers.list(filters={"name": name_filter}, all=True):
-        container.stop()
-        container.remove()
+    remove_containers(_client(docker_host).containers.list(filters={"name": name_filter}, all=True))
+
+
+def _is_orphan(container: docker.models.containers.Container) -> bool:
+    owner = container.labels.get(OWNER_LABEL)
+    if owner == container_owner():
+        return False
+    if container.status != "running":
+        return True
+    # a running container is left behind only by a process of this machine which is gone
+    hostname, _, pid = (owner or "").rpartition(":")
+    if hostname != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def remove_orphan_containers(docker_host: Optional[DockerHost] = None) -> int:
+    """
+    Remove game containers left behind by observer processes which were killed:
+    those which have stopped, and running ones of processes of this machine which are gone.
+    Running containers of other processes are left alone.
+
+    :returns: number of the removed containers
+    :raises docker.exceptions.APIError
+    """
+    containers = _client(docker_host).containers.list(filters={"label": GAME_CONTAINER_LABEL}, all=True)
+    orphans = [container for container in containers if _is_orphan(container)]
+    if orphans:
+        logger.info(f"removing {len(orphans)} containers left behind by earlier runs")
+        remove_containers(orphans)
+    return len(orphans)
 
 
 def container_exit_code(container_id: str) -> Optional[int]:
@@ -330,19 +733,120 @@ def container_exit_code(container_id: str) -> Optional[int]:
     :raises docker.errors.NotFound
     :raises docker.errors.APIError
     """
-    container = docker_client.containers.get(container_id)
+    container = docker_client().containers.get(container_id)
     return container.wait()["StatusCode"]
 
 
+def wait_for_containers(
+        containers: List[docker.models.containers.Container],
+        wait_callback: Callable
+) -> List[int]:
+    """
+    Block until all containers exit and return their exit codes (in the same order).
+
+    Each container is waited for in its own thread, so a finished container
+    is noticed as soon as the daemon reports it, together with its exit code.
+    wait_callback is called every WAIT_CALLBACK_INTERVAL seconds
+    while none of the running containers finishes.
+
+    :raises docker.errors.APIError
+    """
+    exit_codes = [None] * len(containers)
+    finished = queue.Queue()
+
+    def wait_container(index: int) -> None:
+        try:
+            finished.put((index, containers[index].wait()["StatusCode"], None))
+        except Exception as e:
+            finished.put((index, None, e))
+
+    # daemon threads: when the callback gives up, e.g. the docker host has dropped out,
+    # the waits may never return and must not keep the process alive
+    for index in range(len(containers)):
+        threading.Thread(target=wait_container, args=(index,), daemon=True).start()
+
+    for _ in containers:
+        while True:
+            try:
+                index, exit_code, error = finished.get(timeout=WAIT_CALLBACK_INTERVAL)
+                break
+            except queue.Empty:
+                wait_callback()
+        if error is not None:
+            raise error
+        exit_codes[index] = exit_code
+        logger.debug(f"container {containers[index].name} exited with code {exit_code}")
+
+    return exit_codes
+
+
+def is_oom_killed(container: docker.models.containers.Container) -> bool:
+    """
+    :raises docker.errors.APIError
+    """
+    container.reload()
+    return bool(container.attrs.get("State", {}).get("OOMKilled"))
+
+
+def _progress_reader(
+        container: docker.models.containers.Container,
+        log_dir: str,
+        docker_host: Optional[DockerHost]
+) -> Callable[[], Optional[int]]:
+    """
+    Last frame written to frames.csv by the container, read from the mounted log dir
+    or, on other machines, from the container.
+    """
+    if docker_host is None or docker_host.is_local:
+        return lambda: last_frame(read_tail(f"{log_dir}/frames.csv") or b"")
+
+    def read_progress() -> Optional[int]:
+        exit_code, output = container.exec_run(["tail", "-c", str(TAIL_BYTES), f"{LOG_DIR}/frames.csv"])
+        return last_frame(output) if exit_code == 0 else None
+
+    return read_progress
+
+
+def kill_containers(containers: List[docker.models.containers.Container]) -> None:
+    for container in containers:
+        try:
+            container.kill()
+        except docker.errors.APIError as e:
+            # the container has exited meanwhile
+            logger.debug(f"cannot kill container {container.name}: {e}")
+
+
+def check_exit_codes(exit_codes: List[int]) -> None:
+    """
+    :raises ContainerException, RealtimeOutedException
+    """
+    if any(exit_code == EXIT_CODE_REALTIME_OUTED for exit_code in exit_codes):
+        raise RealtimeOutedException(f"some of the game containers has realtime outed.")
+    if any(exit_code == 1 for exit_code in exit_codes):
+        raise ContainerException(f"some of the game containers has finished with error exit code.")
+
+
 def launch_game(
         players: List[Player],
         launch_params: Dict[str, Any],
         show_all: bool,
         read_overwrite: bool,
-        wait_callback: Callable
+        wait_callback: Callable,
+        launch_viewers: bool = True,
+        docker_host: Optional[DockerHost] = None,
+        phase_callback: Callable[[str], None] = lambda phase: None,
+        sampler: Optional[ResourceSampler] = None,
+        stall_timeout: Optional[float] = None
 ) -> None:
     """
-    :raises DockerException, ContainerException, RealtimeOutedException
+    :param docker_host: the host to play the game on, by default the local docker.
+                        Outputs of games on other machines are copied back.
+    :param phase_callback: called with the name of each phase the observer sees, see observer.timing
+    :param sampler: follows the resource usage of the containers while they run
+    :param stall_timeout: kill the containers when the frames of the game do not advance
+                          for this many seconds, only for games which start by themselves
+    :raises DockerException, ContainerException, RealtimeOutedException, OutOfMemoryException,
+            StalledException
     """
     if not players:
         raise GameException("at least one player must be specified")
@@ -354,55 +858,92 @@ def launch_game(
     #     logger.info(f"removing existing game results of {game_name}")
     #     shutil.rmtree(f"{game_dir}/{game_name}")
 
-    for nth_player, player in enumerate(players):
-        launch_image(player, nth_player=nth_player, num_players=len(players), **launch_params)
-
-    logger.debug("checking if game has launched properly...")
-    time.sleep(1)
-    start_containers = running_containers(game_name + "_")
-    if len(start_containers) != len(players):
-        raise DockerException("some containers exited prematurely, please check logs")
-
-    if not launch_params["headless"]:
-        for index, player in enumerate(players if show_all else players[:1]):
-            port = launch_params["vnc_base_port"] + index
-            host = launch_params["vnc_host"]
-            logger.info(f"launching vnc viewer for {player} on address {host}:{port}")
-            launch_vnc_viewer(host, port)
-
-        logger.info("\n"
-                    "In headful mode, you must specify and start the game manually.\n"
-                    "Select the map, wait for bots to join the game "
-                    "and then start the game.")
-
-    logger.info(f"waiting until game {game_name} is finished...")
-    running_time = time.time()
-    while True:
-        containers = running_containers(game_name)
-        if len(containers) == 0:  # game finished
-            break
-        logger.debug(f"waiting. {containers}")
-        wait_callback()
+    # a game played again has the same container names
+    _reaper.wait(game_name + "_")
 
-    containers = docker_client.containers.list(filters={"name": game_name}, all=True)
-    exit_codes = [container_exit_code(container.short_id) for container in containers]
-    logger.debug(f"Exit codes: {exit_codes}")
-
-    # remove containers before throwing exception
-    logger.debug("removing game containers")
-    remove_game_containers(game_name)
-
-    if any(exit_code == EXIT_CODE_REALTIME_OUTED for exit_code in exit_codes):
-        raise RealtimeOutedException(f"some of the game containers has realtime outed.")
-    if any(exit_code == 1 for exit_code in exit_codes):
-        raise ContainerException(f"some of the game containers has finished with error exit code.")
+    phase_callback("create")
+    log_dirs = [f"{game_dir}/{game_name}/logs_{nth_player}" for nth_player in range(len(players))]
+    containers = []  # type: List[docker.models.containers.Container]
+    watchdog = None
+    try:
+        # one by one, so that the containers which were started are removed when another one fails
+        for nth_player, player in enumerate(players):
+            containers.append(launch_image(player, nth_player=nth_player, num_players=len(players),
+                                           docker_host=docker_host, **launch_params))
+        phase_callback("containers_started")
+        if sampler is not None:
+            sampler.start(containers, log_dirs)
+
+        logger.debug("checking if game has launched properly...")
+        if not wait_for_ready(containers, log_dirs, READY_GAME, GAME_START_TIMEOUT, docker_host):
+            start_containers = running_containers(game_name + "_", docker_host)
+            if len(start_containers) != len(players):
+                raise DockerException("some containers exited prematurely, please check logs")
+            logger.warning(f"game {game_name} has not signalled its start within {GAME_START_TIMEOUT} s")
+
+        if not launch_params["headless"] and not launch_params["lean"] and launch_viewers:
+            for index, player in enumerate(players if show_all else players[:1]):
+                port = launch_params["vnc_base_port"] + index
+                host = launch_params["vnc_host"]
+                logger.info(f"launching vnc viewer for {player} on address {host}:{port}")
+                launch_vnc_viewer(host, port)
+
+            if launch_params["replay_file"] is None:
+                logger.info("\n"
+                            "In headful mode, you must specify and start the game manually.\n"
+                            "Select the map, wait for bots to join the game "
+                            "and then start the game.")
+
+        is_started_automatically = launch_params["headless"] or launch_params["replay_file"] is not None
+        if stall_timeout and is_started_automatically:
+            watchdog = StallWatchdog([_progress_reader(container, log_dir, docker_host)
+                                      for container, log_dir in zip(containers, log_dirs)], stall_timeout)
+
+        def _wait_callback() -> None:
+            wait_callback()
+            if watchdog is not None and not watchdog.is_stalled and watchdog.check():
+                logger.warning(f"game {game_name} has stalled, killing its containers")
+                kill_containers(containers)
+
+        logger.info(f"waiting until game {game_name} is finished...")
+        exit_codes = wait_for_containers(containers, _wait_callback)
+        logger.debug(f"Exit codes: {exit_codes}")
+        phase_callback("containers_exited")
+
+        oom_killed = [container.name for container in containers if is_oom_killed(container)]
+    finally:
+        if sampler is not None:
+            sampler.stop()
+
+        if docker_host is not None and not docker_host.is_local:
+            logger.debug(f"copying outputs of game {game_name} from docker host {docker_host}")
+            try:
+                for nth_player, (player, container) in enumerate(zip(players, containers)):
+                    copy_game_outputs(container, player, nth_player, game_dir, game_name,
+                                      launch_params["map_dir"])
+            except Exception as e:
+                # the game is judged by the outputs which could be copied
+                logger.warning(f"could not copy outputs of game {game_name} from {docker_host}: {e}")
+
+        # containers are removed in the background, also when an exception is thrown
+        logger.debug("removing game containers")
+        reap_containers(containers)
+        phase_callback("teardown")
+
+    if watchdog is not None and watchdog.is_stalled:
+        raise StalledException(f"game {game_name} has not advanced for {stall_timeout:.0f} s "
+                               f"(last frames {watchdog.last_progress}), its containers were killed.")
+    if oom_killed:
+        raise OutOfMemoryException(f"game containers {', '.join(oom_killed)} were killed out of memory.")
+    check_exit_codes(exit_codes)
 
     if read_overwrite:
         logger.info("overwriting bot files")
         for nth_player, player in enumerate(players):
             if isinstance(player, BotPlayer):
                 logger.debug(f"overwriting files for {player}")
-                distutils.dir_util.copy_tree(
+                shutil.copytree(
                     f"{game_dir}/{game_name}/write_{nth_player}",
-                    player.read_dir
+                    player.read_dir,
+                    dirs_exist_ok=True
                 )
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import os.path
+import time
+from typing import Any, Callable
+
+from observer.defaults import SC_ENV_CACHE
+
+logger = logging.getLogger(__name__)
+
+# results of environment checks are trusted for this many seconds
+ENV_CACHE_TTL = 3600
+
+
+def _read_cache() -> dict:
+    try:
+        with open(SC_ENV_CACHE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache: dict) -> None:
+    # other processes never read a partially written cache
+    tmp_file = f"{SC_ENV_CACHE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, SC_ENV_CACHE)
+    except OSError as e:
+        # e.g. the data dir does not exist before --install
+        logger.debug(f"cannot write environment cache {SC_ENV_CACHE}: {e}")
+
+
+def cached_check(
+        key: str,
+        check: Callable[[], Any],
+        ttl: float = ENV_CACHE_TTL,
+        should_cache: Callable[[Any], bool] = lambda value: True
+) -> Any:
+    """
+    Result of the check, cached in the data dir for `ttl` seconds,
+    so that repeated invocations of observer do not query docker
+    or spawn docker-machine again. Results are cached only if `should_cache`
+    accepts them, e.g. failed checks can be repeated every time.
+    """
+    entry = _read_cache().get(key)
+    if entry is not None and entry["expires_at"] > time.time():
+        logger.debug(f"using cached result of {key}")
+        return entry["value"]
+
+    value = check()
+    if should_cache(value):
+        # re-read, other processes may have cached other checks meanwhile
+        cache = _read_cache()
+        cache[key] = dict(value=value, expires_at=time.time() + ttl)
+        _write_cache(cache)
+    return value
+
+
+def invalidate_check(key: str) -> None:
+    """
+    Forget the cached result of the check, e.g. when it turned out to be stale.
+    """
+    cache = _read_cache()
+    if cache.pop(key, None) is not None:
+        _write_cache(cache)
+
+
+def clear_env_cache() -> None:
+    if os.path.exists(SC_ENV_CACHE):
+        os.remove(SC_ENV_CACHE)
@@ -20,3 +20,15 @@ class ContainerException(DockerException):
 
 class RealtimeOutedException(ContainerException):
     pass
+
+
+class HostDroppedException(DockerException):
+    pass
+
+
+class OutOfMemoryException(ContainerException):
+    pass
+
+
+class StalledException(ContainerException):
+    pass
@@ -0,0 +1,111 @@
+import glob
+import logging
+import os.path
+import re
+from typing import Iterator, Optional
+
+from observer.error import HostDroppedException, OutOfMemoryException, RealtimeOutedException, StalledException
+
+logger = logging.getLogger(__name__)
+
+# causes which may not happen again when the game is played again
+CAUSE_WINE_START = "wine_start"
+CAUSE_MAP_DISTRIBUTION = "map_distribution"
+CAUSE_REALTIME_OUT = "realtime_out"
+CAUSE_STALLED = "stalled"
+CAUSE_OUT_OF_MEMORY = "out_of_memory"
+CAUSE_HOST_DROPPED = "host_dropped"
+CAUSE_GAME_CRASH = "game_crash"
+CAUSE_UNKNOWN = "unknown"
+# causes which happen every time the replay is played
+CAUSE_CORRUPT_REPLAY = "corrupt_replay"
+CAUSE_UNSUPPORTED_VERSION = "unsupported_version"
+CAUSE_BOT_SETUP = "bot_setup"
+
+DETERMINISTIC_CAUSES = (CAUSE_CORRUPT_REPLAY, CAUSE_UNSUPPORTED_VERSION, CAUSE_BOT_SETUP)
+
+# patterns of the logs and crash reports, causes listed first win over the later ones,
+# so that deterministic causes win over their transient symptoms
+_LOG_PATTERNS = (
+    (CAUSE_CORRUPT_REPLAY, rb"(?:invalid|corrupt(?:ed)?|damaged) replay|replay (?:file )?is (?:invalid|corrupt)"
+                           rb"|(?:unable|failed) to (?:open|load|read) replay|couldn't (?:open|load) replay"),
+    (CAUSE_UNSUPPORTED_VERSION, rb"unsupported (?:replay )?version|replay version mismatch"
+                                rb"|replay (?:was )?made with a (?:different|newer|older) version"),
+    (CAUSE_BOT_SETUP, rb"Bot not found in|Bot type can be only one of"),
+    (CAUSE_MAP_DISTRIBUTION, rb"Unable to distribute map"),
+    (CAUSE_REALTIME_OUT, rb"realtime outed!"),
+    (CAUSE_WINE_START, rb"X server is not running yet|StarCraft has not started yet|wine client error"
+                       rb"|wine: (?:could not|cannot|failed)|err:module:import_dll|cannot open display"),
+    (CAUSE_OUT_OF_MEMORY, rb"out of memory|std::bad_alloc"),
+)
+_LOG_PATTERN = re.compile(b"|".join(b"(?P<%s>%s)" % (cause.encode(), pattern)
+                                    for cause, pattern in _LOG_PATTERNS), re.IGNORECASE)
+_CAUSE_PRIORITY = [cause for cause, _ in _LOG_PATTERNS]
+
+_EXCEPTION_CAUSES = (
+    (OutOfMemoryException, CAUSE_OUT_OF_MEMORY),
+    (RealtimeOutedException, CAUSE_REALTIME_OUT),
+    (StalledException, CAUSE_STALLED),
+    (HostDroppedException, CAUSE_HOST_DROPPED),
+)
+
+
+class Failure:
+    def __init__(self, cause: str, detail: Optional[str] = None) -> None:
+        self.cause = cause
+        self.detail = detail
+
+    @property
+    def is_transient(self) -> bool:
+        return self.cause not in DETERMINISTIC_CAUSES
+
+    def __str__(self) -> str:
+        return f"{self.cause}: {self.detail}" if self.detail else self.cause
+
+    def __repr__(self) -> str:
+        return f"Failure({self})"
+
+
+def _failure_files(game_dir: str, game_name: str) -> Iterator[str]:
+    yield from sorted(glob.glob(f"{game_dir}/{game_name}/logs_*/game.log"))
+    yield from sorted(glob.glob(f"{game_dir}/{game_name}/logs_*/bot.log"))
+    yield from sorted(glob.glob(f"{game_dir}/{game_name}/crashes_*/*"))
+
+
+def has_crash_reports(game_dir: str, game_name: str) -> bool:
+    return any(os.path.isfile(file) for file in glob.glob(f"{game_dir}/{game_name}/crashes_*/*"))
+
+
+def classify_failure(game_dir: str, game_name: str, error: Optional[Exception] = None) -> Optional[Failure]:
+    """
+    Cause of a failed game, from what the observer has seen and from its logs and crash reports,
+    which are read line by line in a single pass. The pass ends at the first deterministic cause.
+
+    :returns: None if nothing in the logs points to a failure and there is no error
+    """
+    for exception_class, cause in _EXCEPTION_CAUSES:
+        if isinstance(error, exception_class):
+            return Failure(cause, str(error))
+
+    found, found_line = None, None
+    for file in _failure_files(game_dir, game_name):
+        try:
+            with open(file, "rb") as f:
+                for line in f:
+                    for match in _LOG_PATTERN.finditer(line):
+                        if found is None or _CAUSE_PRIORITY.index(match.lastgroup) < _CAUSE_PRIORITY.index(found):
+                            found, found_line = match.lastgroup, line
+                    if found in DETERMINISTIC_CAUSES:
+                        break
+        except OSError as e:
+            logger.debug(f"cannot read {file}: {e}")
+        if found in DETERMINISTIC_CAUSES:
+            break
+
+    if found is not None:
+        return Failure(found, found_line.decode("utf-8", "replace").strip())
+    if has_crash_reports(game_dir, game_name):
+        return Failure(CAUSE_GAME_CRASH, "StarCraft has written crash reports")
+    if error is not None:
+        return Failure(CAUSE_UNKNOWN, str(error) or error.__class__.__name__)
+    return None
@@ -0,0 +1,336 @@
+"""
+In-process fake of the part of the docker SDK which the observer uses,
+so that the orchestration can be run and measured without docker, see observer.benchmark.
+
+Containers "play" for a simulated duration and write what the real ones
+signal to the observer: the ready markers and the scores of the module.
+Every call of the SDK is counted in `FakeDockerClient.calls`.
+"""
+import io
+import json
+import os
+import os.path
+import re
+import tarfile
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import docker.errors
+
+from observer.docker_utils import (
+    LOG_DIR, ready_marker, READY_GUI, READY_REGISTRY, READY_GAME, READY_BOT, READY_FINISHED
+)
+
+ExecResult = namedtuple("ExecResult", ["exit_code", "output"])
+
+
+class ApiCalls:
+    """
+    Number of calls of each SDK method.
+    """
+
+    def __init__(self) -> None:
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, method: str) -> None:
+        with self._lock:
+            self._counts[method] += 1
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(self._counts.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+def _write_marker(log_dir: str, stage: str) -> None:
+    with open(ready_marker(log_dir, stage), "w") as f:
+        f.write(f"{time.time():.6f}\n")
+
+
+class FakeContainer:
+    def __init__(
+            self,
+            client: 'FakeDockerClient',
+            image: str,
+            name: str,
+            environment: Dict[str, Any],
+            volumes: Dict[str, Dict[str, str]],
+            labels: Dict[str, str],
+            network: Optional[str]
+    ) -> None:
+        self.client = client
+        self.image = image
+        self.name = name
+        self.id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.short_id = self.id[:12]
+        self.environment = environment
+        self.labels = labels
+        self.network = network
+        self.status = "created"
+        self.exit_code = None  # type: Optional[int]
+
+        # host dir of the logs, where the markers and outputs are written
+        self.log_dir = next((host_dir for host_dir, bind in volumes.items() if bind["bind"] == LOG_DIR), None)
+        self._exited = threading.Event()
+        self._timer = None
+
+    @property
+    def attrs(self) -> Dict[str, Any]:
+        return {"State": {"Status": self.status, "ExitCode": self.exit_code, "OOMKilled": False}}
+
+    def _signal(self, *stages: str) -> None:
+        if self.log_dir is None or not os.path.isdir(self.log_dir):
+            return
+        for stage in stages:
+            _write_marker(self.log_dir, stage)
+
+    def start(self) -> None:
+        self.client.calls.count("containers.start")
+        self.status = "running"
+        self._signal(READY_GUI, READY_REGISTRY, READY_GAME)
+        self._timer = threading.Timer(self.client.duration(self.name), self._finish, args=(0,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _finish(self, exit_code: int) -> None:
+        if self._exited.is_set():
+            return
+        if exit_code == 0 and self.log_dir is not None and os.path.isdir(self.log_dir):
+            self._signal(READY_BOT)
+            with open(f"{self.log_dir}/scores.json", "w") as f:
+                json.dump(dict(is_winner=False, is_crashed=False, timed_out=False, building_score=0,
+                               kill_score=0, razing_score=0, unit_score=0), f)
+            self._signal(READY_FINISHED)
+        self.exit_code = exit_code
+        self.status = "exited"
+        self._exited.set()
+
+    def reload(self) -> None:
+        self.client.calls.count("containers.reload")
+
+    def wait(self, timeout: Optional[float] = None, **kwargs) -> Dict[str, Any]:
+        self.client.calls.count("containers.wait")
+        if not self._exited.wait(timeout):
+            raise docker.errors.APIError(f"timed out waiting for container {self.name}")
+        return {"StatusCode": self.exit_code, "Error": None}
+
+    def stop(self, timeout: Optional[int] = None) -> None:
+        self.client.calls.count("containers.stop")
+        if self._timer is not None:
+            self._timer.cancel()
+        self._finish(137)
+
+    def kill(self, signal: Optional[str] = None) -> None:
+        self.client.calls.count("containers.kill")
+        self.stop()
+
+    def remove(self, force: bool = False, **kwargs) -> None:
+        self.client.calls.count("containers.remove")
+        if self.status == "running" and not force:
+            raise docker.errors.APIError(f"cannot remove running container {self.name}")
+        if self._timer is not None:
+            self._timer.cancel()
+        self._finish(137)
+        self.client.forget(self)
+
+    def exec_run(self, cmd: List[str], **kwargs) -> ExecResult:
+        self.client.calls.count("containers.exec_run")
+        if self.status != "running":
+            raise docker.errors.APIError(f"container {self.name} is not running")
+        return ExecResult(0, b"")
+
+    def put_archive(self, path: str, data: bytes) -> bool:
+        self.client.calls.count("containers.put_archive")
+        return True
+
+    def get_archive(self, path: str, **kwargs) -> Tuple[Iterator[bytes], Dict[str, Any]]:
+        self.client.calls.count("containers.get_archive")
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            info = tarfile.TarInfo(os.path.basename(path))
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        return iter([archive.getvalue()]), {"name": os.path.basename(path)}
+
+    def _stats(self) -> Dict[str, Any]:
+        return {"memory_stats": {"usage": 0, "limit": 0},
+                "cpu_stats": {"cpu_usage": {"total_usage": 0}, "system_cpu_usage": 0, "online_cpus": 1},
+                "precpu_stats": {"cpu_usage": {"total_usage": 0}, "system_cpu_usage": 0}}
+
+    def _stream_stats(self, interval: float) -> Iterator[Dict[str, Any]]:
+        while not self._exited.is_set():
+            yield self._stats()
+            self._exited.wait(interval)
+
+    def stats(self, stream: bool = False, **kwargs) -> Any:
+        """
+        Like the daemon, the stream sends one sample per second until the container exits.
+        """
+        self.client.calls.count("containers.stats")
+        if stream:
+            return self._stream_stats(1.0)
+        return self._stats()
+
+
+class FakeContainerCollection:
+    def __init__(self, client: 'FakeDockerClient') -> None:
+        self.client = client
+
+    def create(
+            self,
+            image: str,
+            command: Any = None,
+            name: Optional[str] = None,
+            environment: Optional[Dict[str, Any]] = None,
+            volumes: Optional[Dict[str, Dict[str, str]]] = None,
+            labels: Optional[Dict[str, str]] = None,
+            network: Optional[str] = None,
+            **kwargs
+    ) -> FakeContainer:
+        self.client.calls.count("containers.create")
+        self.client.images.get(image, count=False)
+        container = FakeContainer(self.client, image, name or uuid.uuid4().hex[:12], environment or {},
+                                  volumes or {}, labels or {}, network)
+        self.client.register(container)
+        return container
+
+    def run(self, image: str, detach: bool = False, **kwargs) -> FakeContainer:
+        self.client.calls.count("containers.run")
+        container = self.create(image, **kwargs)
+        container.start()
+        return container
+
+    def get(self, container_id: str) -> FakeContainer:
+        self.client.calls.count("containers.get")
+        for container in self.client.all_containers():
+            if container_id in (container.id, container.short_id, container.name):
+                return container
+        raise docker.errors.NotFound(f"no such container: {container_id}")
+
+    def list(self, all: bool = False, filters: Optional[Dict[str, Any]] = None, **kwargs) -> List[FakeContainer]:
+        self.client.calls.count("containers.list")
+        filters = filters or {}
+        containers = []
+        for container in self.client.all_containers():
+            if not all and container.status != "running":
+                continue
+            if "name" in filters and not re.search(filters["name"], container.name):
+                continue
+            if "label" in filters:
+                key, _, value = filters["label"].partition("=")
+                if key not in container.labels or (value and container.labels[key] != value):
+                    continue
+            if "network" in filters and container.network != filters["network"]:
+                continue
+            containers.append(container)
+        return containers
+
+
+class FakeNetwork:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.short_id = uuid.uuid4().hex[:10]
+
+
+class FakeNetworkCollection:
+    def __init__(self, client: 'FakeDockerClient') -> None:
+        self.client = client
+        self._networks = {}  # type: Dict[str, FakeNetwork]
+
+    def list(self, names: Optional[str] = None, **kwargs) -> List[FakeNetwork]:
+        self.client.calls.count("networks.list")
+        return [network for name, network in self._networks.items() if names is None or name in names]
+
+    def create(self, name: str, **kwargs) -> FakeNetwork:
+        self.client.calls.count("networks.create")
+        network = self._networks.setdefault(name, FakeNetwork(name))
+        return network
+
+
+class FakeImage:
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None) -> None:
+        self.tags = [name]
+        self.id = f"sha256:{uuid.uuid4().hex}"
+        self.labels = labels or {}
+
+
+class FakeImageCollection:
+    def __init__(self, client: 'FakeDockerClient', images: List[str]) -> None:
+        self.client = client
+        self._images = {name: FakeImage(name) for name in images}
+
+    def get(self, name: str, count: bool = True) -> FakeImage:
+        if count:
+            self.client.calls.count("images.get")
+        if name not in self._images:
+            raise docker.errors.ImageNotFound(f"no such image: {name}")
+        return self._images[name]
+
+    def build(self, tag: str, labels: Optional[Dict[str, str]] = None, **kwargs) -> Tuple[FakeImage, list]:
+        self.client.calls.count("images.build")
+        self._images[tag] = FakeImage(tag, labels)
+        return self._images[tag], []
+
+
+class FakeApi:
+    base_url = "fake://docker"
+
+
+class FakeDockerClient:
+    """
+    :param duration: simulated seconds each container plays, by container name
+    :param images: images which exist on the fake daemon
+    """
+
+    def __init__(
+            self,
+            duration: Callable[[str], float] = lambda name: 0.0,
+            images: Optional[List[str]] = None
+    ) -> None:
+        from observer.defaults import SC_IMAGE
+        self.duration = duration
+        self.calls = ApiCalls()
+        self.api = FakeApi()
+        self.containers = FakeContainerCollection(self)
+        self.networks = FakeNetworkCollection(self)
+        self.images = FakeImageCollection(self, images if images is not None else [SC_IMAGE])
+
+        self._containers = {}  # type: Dict[str, FakeContainer]
+        self._lock = threading.Lock()
+
+    def register(self, container: FakeContainer) -> None:
+        with self._lock:
+            if container.name in self._containers:
+                raise docker.errors.APIError(f"container name {container.name} is already in use")
+            self._containers[container.name] = container
+
+    def forget(self, container: FakeContainer) -> None:
+        with self._lock:
+            self._containers.pop(container.name, None)
+
+    def all_containers(self) -> List[FakeContainer]:
+        with self._lock:
+            return list(self._containers.values())
+
+    def ping(self) -> bool:
+        self.calls.count("ping")
+        return True
+
+    def version(self) -> Dict[str, str]:
+        self.calls.count("version")
+        return {"Version": "fake"}
+
+    def close(self) -> None:
+        pass
@@ -4,17 +4,22 @@ import json
 import logging
 import os
 import signal
+import sqlite3
 import time
 from argparse import Namespace
-from typing import List, Optional, Callable
+from typing import Any, Callable, Dict, List, Optional
 
 from observer.bot_factory import retrieve_bots
 from observer.bot_storage import LocalBotStorage
+from observer.docker_hosts import DockerHost
 from observer.docker_utils import dockermachine_ip, launch_game, remove_game_containers
-from observer.error import GameException, RealtimeOutedException
+from observer.error import GameException, RealtimeOutedException, StalledException
 from observer.game_type import GameType
-from observer.player import HumanPlayer, BotPlayer
+from observer.player import HumanPlayer, BotPlayer, Player
 from observer.result import GameResult
+from observer.resource_sampler import ResourceSampler
+from observer.results_store import OUTCOME_CRASH, open_results_store, player_outcomes
+from observer.timing import PhaseTimer, record_timings
 from observer.vnc import check_vnc_exists
 
 
@@ -25,6 +30,7 @@ class GameArgs(Namespace):
     human: bool
     map: str
     headless: bool
+    lean: bool
     game_name: str
     game_type: str
     game_speed: int
@@ -44,29 +50,23 @@ class GameArgs(Namespace):
     docker_image: str
     nano_cpus: int
     mem_limit: str
+    extract: bool
+    record: bool
+    replay: Optional[str]
+    replay_catalogue: str
+    results_db: str
+    metrics: Optional[str]
+    sample_resources: Optional[float]
+    stall_timeout: float
+    retries: int
+    quarantine_after: int
+    convert: bool
+    remove_csv: bool
 
 
-def run_game(
-        args: GameArgs,
-        wait_callback: Optional[Callable] = None
-) -> Optional[GameResult]:
-    # Check all startup requirements
-    if not args.headless:
-        check_vnc_exists()
-    
-    if args.headless and args.show_all:
-        raise GameException("Cannot show all screens in headless mode")
-
-    if args.extract:
-        game_name = "Extractor"
-    elif args.record:
-        game_name = "Record"
-    else:
-        pass
-
-    # Prepare players
+def game_players(args: GameArgs) -> List[Player]:
     players = []
-    
+
     if args.bots is None:
         args.bots = []
 
@@ -74,28 +74,26 @@ def run_game(
         LocalBotStorage(args.bot_dir),
     )
     players += retrieve_bots(args.bots, bot_storages)
+    return players
 
-    is_1v1_game = len(players) == 2
 
-    if args.vnc_host == "":
-        args.vnc_host = dockermachine_ip() or "localhost"
-        logger.debug(f"Using vnc host '{args.vnc_host}'")
+def default_game_name(args: GameArgs) -> str:
+    if args.game_name is not None:
+        return args.game_name
+    return "Extractor" if args.extract else "Record"
 
-    # make sure we always have a sleeping wait callback!
-    if wait_callback is None:
-        wait_callback = lambda: time.sleep(3)
-
-    _wait_callback = wait_callback
 
+def game_launch_params(args: GameArgs, game_name: str) -> Dict[str, Any]:
     # Seed override is empty string if not specified, integer otherwise
     seed_override = ""
     if args.seed_override is not None:
         seed_override = str(args.seed_override)
 
     # Prepare game launching
-    launch_params = dict(
+    return dict(
         # game settings
         headless=args.headless,
+        lean=args.lean,
         game_name=game_name,
         map_name=args.map,
         game_type=GameType(args.game_type),
@@ -105,6 +103,7 @@ def run_game(
         timeout_at_frame=args.timeout_at_frame,
         allow_input=args.allow_input,
         auto_launch=args.auto_launch,
+        replay_file=args.replay,
 
         # mount dirs
         game_dir=args.game_dir,
@@ -122,24 +121,73 @@ def run_game(
         mem_limit=args.mem_limit
     )
 
+
+def run_game(
+        args: GameArgs,
+        wait_callback: Optional[Callable] = None,
+        launch_viewers: bool = True,
+        docker_host: Optional[DockerHost] = None
+) -> Optional[GameResult]:
+    # Check all startup requirements
+    if not args.headless and not args.lean and launch_viewers:
+        check_vnc_exists()
+    
+    if args.headless and args.show_all:
+        raise GameException("Cannot show all screens in headless mode")
+
+    game_name = default_game_name(args)
+
+    if args.replay is not None:
+        if args.headless:
+            raise GameException("Replays cannot be played in headless mode")
+        if not os.path.isfile(args.replay):
+            raise GameException(f"Replay {args.replay} could not be found")
+    elif args.lean:
+        raise GameException("The lean profile can only play replays, the game cannot be set up without VNC")
+
+    players = game_players(args)
+
+    is_1v1_game = len(players) == 2
+
+    if args.vnc_host == "":
+        args.vnc_host = dockermachine_ip() or "localhost"
+        logger.debug(f"Using vnc host '{args.vnc_host}'")
+
+    # containers are waited for in a blocking way,
+    # the callback is only called periodically while the game runs
+    if wait_callback is None:
+        wait_callback = lambda: None
+
+    _wait_callback = wait_callback
+
+    launch_params = game_launch_params(args, game_name)
+
     time_start = time.time()
+    timer = PhaseTimer()
+    sampler = ResourceSampler(args.sample_resources) if args.sample_resources is not None else None
     is_realtime_outed = False
+    stalled = None
     try:
         launch_game(
             players, launch_params, args.show_all,
-            args.read_overwrite, _wait_callback
+            args.read_overwrite, _wait_callback, launch_viewers, docker_host, timer.mark, sampler,
+            args.stall_timeout
         )
     except RealtimeOutedException:
         is_realtime_outed = True
         logger.debug(f"Game timed out")
 
+    except StalledException as e:
+        # the game is recorded, then the caller is told it has failed
+        stalled = e
+
     except KeyboardInterrupt:
         logger.warning("Caught interrupt, shutting down containers")
         logger.warning("This can take a moment, please wait.")
 
         # prevent another throw of KeyboardInterrupt exception
         signal.signal(signal.SIGINT, signal.SIG_IGN)
-        remove_game_containers(game_name)
+        remove_game_containers(game_name, docker_host)
         logger.info(f"Game cancelled.")
         raise
 
@@ -153,8 +201,33 @@ def run_game(
         nth_player = int(replay_file[:-4].split("_")[-1])
         os.rename(replay_file, f"{args.game_dir}/{game_name}/player_{nth_player}.rep")
 
+    game_time = time.time() - time_start
+    timer.read_markers([f"{args.game_dir}/{game_name}/logs_{nth_player}" for nth_player in range(len(players))])
+    timings = timer.timings()
+    record_timings(game_name, timings, args.metrics)
+
+    game_result = None
+    info = launch_params.copy()
+    info.update(dict(
+        read_overwrite=args.read_overwrite,
+        bots=args.bots,
+        docker_host=docker_host.name if docker_host is not None else None,
+
+        is_crashed=None,
+        is_gametime_outed=None,
+        is_realtime_outed=is_realtime_outed,
+        is_stalled=stalled is not None,
+        game_time=game_time,
+        timings=timings,
+        resources=sampler.summary() if sampler is not None else None,
+
+        winner=None,
+        loser=None,
+        winner_race=None,
+        loser_race=None,
+    ))
+
     if is_1v1_game:
-        game_time = time.time() - time_start
         game_result = GameResult(
             game_name, players, game_time,
             # game error states
@@ -163,20 +236,11 @@ def run_game(
             args.map_dir, args.game_dir
         )
 
-        info = launch_params.copy()
         info.update(dict(
-            read_overwrite=args.read_overwrite,
-            bots=args.bots,
-
             is_crashed=game_result.is_crashed,
             is_gametime_outed=game_result.is_gametime_outed,
             is_realtime_outed=game_result.is_realtime_outed,
             game_time=game_result.game_time,
-
-            winner=None,
-            loser=None,
-            winner_race=None,
-            loser_race=None,
         ))
         if game_result.is_valid:
             info.update(dict(
@@ -186,14 +250,31 @@ def run_game(
                 loser_race=game_result.loser_player.race.value,
             ))
 
-        logger.debug(info)
-        with open(f"{args.game_dir}/{game_name}/result.json", "w") as f:
-            json.dump(info, f, cls=EnumEncoder)
+    logger.debug(info)
+    write_game_info(args.game_dir, game_name, info)
+
+    outcomes = player_outcomes(players, game_result, is_realtime_outed, args.game_dir, game_name)
+    if stalled is not None:
+        outcomes = [OUTCOME_CRASH] * len(players)
+    try:
+        open_results_store(args.results_db).add(args.game_dir, game_name, info, [
+            dict(bot=player.name, race=player.race.value, outcome=outcome)
+            for player, outcome in zip(players, outcomes)
+        ])
         logger.info(f"game {game_name} recorded")
+    except sqlite3.OperationalError as e:
+        # e.g. the database is locked by another process, the game stays buffered for the next write
+        logger.error(f"cannot store results of game {game_name}: {e}")
+
+    if stalled is not None:
+        raise stalled
+
+    return game_result
 
-        return game_result
 
-    return None
+def write_game_info(game_dir: str, game_name: str, info: Dict[str, Any]) -> None:
+    with open(f"{game_dir}/{game_name}/result.json", "w") as f:
+        json.dump(info, f, cls=EnumEncoder)
 
 
 class EnumEncoder(json.JSONEncoder):
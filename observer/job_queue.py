@@ -0,0 +1,257 @@
+import collections
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from observer.error import ObserverException
+
+logger = logging.getLogger(__name__)
+
+JOB_EXTRACT = "extract"
+JOB_RECORD = "record"
+JOB_MATCH = "match"
+JOB_KINDS = (JOB_EXTRACT, JOB_RECORD, JOB_MATCH)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINAL_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+# recent job changes kept in memory for streaming to clients
+MAX_CHANGES = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    game_name TEXT,
+    source TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+
+CREATE TABLE IF NOT EXISTS watched_files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    job_id INTEGER
+);
+"""
+
+
+class JobException(ObserverException):
+    pass
+
+
+def validate_job(kind: str, params: Dict[str, Any]) -> None:
+    """
+    :raises JobException if the job cannot be run
+    """
+    if kind not in JOB_KINDS:
+        raise JobException(f"unknown job kind {kind}, use one of {', '.join(JOB_KINDS)}")
+    if kind in (JOB_EXTRACT, JOB_RECORD):
+        replay = params.get("replay")
+        if not isinstance(replay, str) or not os.path.isfile(replay):
+            raise JobException(f"replay {replay} could not be found")
+    if kind == JOB_MATCH:
+        bots = params.get("bots")
+        if not isinstance(bots, list) or len(bots) < 1 or not all(isinstance(bot, str) for bot in bots):
+            raise JobException("match needs a list of bots")
+
+
+class JobQueue:
+    """
+    Persistent queue of server jobs in SQLite.
+
+    Jobs which were running when the server stopped are queued again on start.
+    Every change of a job is also kept in memory with a sequence number,
+    so clients can wait for and stream the changes.
+    """
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._seq = 0
+        self._changes = collections.deque(maxlen=MAX_CHANGES)
+
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+        with self.conn:
+            num_requeued = self.conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                (STATUS_QUEUED, STATUS_RUNNING)
+            ).rowcount
+        if num_requeued:
+            logger.info(f"queued again {num_requeued} jobs which did not finish")
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def _job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def _notify(self, job_id: int) -> None:
+        self._seq += 1
+        self._changes.append((self._seq, self._job(job_id)))
+        self._changed.notify_all()
+
+    def submit(self, kind: str, params: Dict[str, Any], source: str = "api") -> Dict[str, Any]:
+        validate_job(kind, params)
+        with self._lock:
+            with self.conn:
+                job_id = self.conn.execute(
+                    "INSERT INTO jobs (kind, params, status, source, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, json.dumps(params), STATUS_QUEUED, source, time.time())
+                ).lastrowid
+            self._notify(job_id)
+            logger.info(f"queued {kind} job {job_id} from {source}")
+            return self._job(job_id)
+
+    def submit_watched(self, kind: str, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Queue a job for a file of the watched directory,
+        unless the same version of the file has already been queued.
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            row = self.conn.execute("SELECT mtime FROM watched_files WHERE path = ?", (path,)).fetchone()
+            if row is not None and row["mtime"] == mtime:
+                return None
+            job = self.submit(kind, dict(replay=path), source="watch")
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO watched_files (path, mtime, job_id) VALUES (?, ?, ?)",
+                                  (path, mtime, job["id"]))
+            return job
+
+    def take(self) -> Optional[Dict[str, Any]]:
+        """
+        Mark the oldest queued job as running and return it.
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                                    (STATUS_QUEUED,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                                  (STATUS_RUNNING, time.time(), row["id"]))
+            self._notify(row["id"])
+            return self._job(row["id"])
+
+    def wait_for_job(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Take a queued job, waiting at most `timeout` seconds for one to be submitted.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                job = self.take()
+                remaining = deadline - time.time()
+                if job is not None or remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def set_game_name(self, job_id: int, game_name: str) -> None:
+        with self._lock:
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET game_name = ? WHERE id = ?", (game_name, job_id))
+            self._notify(job_id)
+
+    def finish(
+            self,
+            job_id: int,
+            error: Optional[str] = None,
+            result: Optional[Dict[str, Any]] = None
+    ) -> None:
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+                    (STATUS_FAILED if error is not None else STATUS_DONE, error,
+                     json.dumps(result) if result is not None else None, time.time(), job_id)
+                )
+            self._notify(job_id)
+
+    def requeue(self, job_id: int) -> None:
+        with self._lock:
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE id = ?",
+                                  (STATUS_QUEUED, job_id))
+            self._notify(job_id)
+
+    def cancel(self, job_id: int) -> Dict[str, Any]:
+        """
+        Cancel a queued job. Running jobs cannot be cancelled.
+        """
+        with self._lock:
+            job = self._job(job_id)
+            if job is None:
+                raise JobException(f"job {job_id} does not exist")
+            if job["status"] != STATUS_QUEUED:
+                raise JobException(f"job {job_id} is {job['status']}, only queued jobs can be cancelled")
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                                  (STATUS_CANCELLED, time.time(), job_id))
+            self._notify(job_id)
+            return self._job(job_id)
+
+    def job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._job(job_id)
+
+    def jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Newest jobs first.
+        """
+        with self._lock:
+            if status is None:
+                rows = self.conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+            else:
+                rows = self.conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?",
+                                         (status, limit))
+            return [self._to_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    @property
+    def seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def wait_changes(self, after_seq: int, timeout: float) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Jobs changed after the sequence number, waiting at most `timeout`
+        seconds for a change. Returns the last sequence number and the jobs.
+        """
+        with self._lock:
+            if self._seq <= after_seq:
+                self._changed.wait_for(lambda: self._seq > after_seq, timeout)
+            return self._seq, [job for seq, job in self._changes if seq > after_seq]
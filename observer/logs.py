@@ -20,3 +20,11 @@ def find_frames(game_dir: str, game_name: str) -> List[str]:
 
 def find_unit_events(game_dir: str, game_name: str) -> List[str]:
     return glob.glob(f"{game_dir}/{game_name}/logs_*/unit_events.csv")
+
+
+def find_frames_parquet(game_dir: str, game_name: str) -> List[str]:
+    return glob.glob(f"{game_dir}/{game_name}/logs_*/frames.parquet")
+
+
+def find_unit_events_parquet(game_dir: str, game_name: str) -> List[str]:
+    return glob.glob(f"{game_dir}/{game_name}/logs_*/unit_events.parquet")
@@ -0,0 +1,141 @@
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from observer.replay import replay_hash
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.sqlite"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# the replay keeps failing, it is not played again
+STATUS_QUARANTINED = "quarantined"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    hash TEXT PRIMARY KEY,
+    replay_file TEXT NOT NULL,
+    game_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    bot_version TEXT,
+    bwapi_version TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class Manifest:
+    """
+    Record of the extraction jobs in a game dir, keyed by replay content hash.
+
+    A replay counts as extracted only if its job is done with the same
+    bot (e.g. Extractor) and BWAPI version. Quarantined replays are not
+    played again, whatever the versions. Content hashes are cached by
+    (path, size, mtime), so checking an unchanged replay only stats the file.
+    """
+
+    def __init__(self, game_dir: str, bot_version: str, bwapi_version: str) -> None:
+        self.game_dir = game_dir
+        self.bot_version = bot_version
+        self.bwapi_version = bwapi_version
+
+        os.makedirs(game_dir, exist_ok=True)
+        # jobs are recorded from the batch worker threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(f"{game_dir}/{MANIFEST_FILE}", check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def replay_hash(self, replay_file: str) -> str:
+        stat = os.stat(replay_file)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                (replay_file, stat.st_size, stat.st_mtime)
+            ).fetchone()
+        if row:
+            return row[0]
+
+        content_hash = replay_hash(replay_file)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                (replay_file, stat.st_size, stat.st_mtime, content_hash)
+            )
+        return content_hash
+
+    def status(self, replay_file: str) -> Optional[str]:
+        content_hash = self.replay_hash(replay_file)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, bot_version, bwapi_version FROM jobs WHERE hash = ?",
+                (content_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, bot_version, bwapi_version = row
+        if status == STATUS_DONE and (bot_version, bwapi_version) != (self.bot_version, self.bwapi_version):
+            return None  # extracted by another version, do it again
+        return status
+
+    def is_done(self, replay_file: str) -> bool:
+        return self.status(replay_file) == STATUS_DONE
+
+    def is_quarantined(self, replay_file: str) -> bool:
+        return self.status(replay_file) == STATUS_QUARANTINED
+
+    def attempts(self, replay_file: str) -> int:
+        """
+        Number of times the replay has been played, in all the batches.
+        """
+        content_hash = self.replay_hash(replay_file)
+        with self._lock:
+            row = self.conn.execute("SELECT attempts FROM jobs WHERE hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else 0
+
+    def _record(self, replay_file: str, game_name: str, status: str,
+                error: Optional[str] = None, is_attempt: bool = False) -> None:
+        content_hash = self.replay_hash(replay_file)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (hash, replay_file, game_name, status, output_dir,"
+                " bot_version, bwapi_version, attempts, error, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (hash) DO UPDATE SET"
+                " replay_file = excluded.replay_file, game_name = excluded.game_name,"
+                " status = excluded.status, output_dir = excluded.output_dir,"
+                " bot_version = excluded.bot_version, bwapi_version = excluded.bwapi_version,"
+                " attempts = attempts + excluded.attempts, error = excluded.error,"
+                " updated_at = excluded.updated_at",
+                (content_hash, replay_file, game_name, status, f"{self.game_dir}/{game_name}",
+                 self.bot_version, self.bwapi_version, int(is_attempt), error, time.time())
+            )
+
+    def job_started(self, replay_file: str, game_name: str) -> None:
+        self._record(replay_file, game_name, STATUS_RUNNING, is_attempt=True)
+
+    def job_finished(self, replay_file: str, game_name: str, error: Optional[str] = None) -> None:
+        self._record(replay_file, game_name,
+                     STATUS_FAILED if error is not None else STATUS_DONE, error)
+
+    def job_quarantined(self, replay_file: str, game_name: str, error: str) -> None:
+        self._record(replay_file, game_name, STATUS_QUARANTINED, error)
@@ -8,8 +8,6 @@ import logging
 import os.path
 import re
 
-from dateutil.parser import parse as parse_iso_date
-
 from observer.bwapi import supported_versions, versions_md5s
 from observer.error import PlayerException
 from observer.utils import md5_file
@@ -79,12 +77,29 @@ class BotPlayer(Player):
     def __init__(self, bot_dir: str) -> None:
         self.bot_dir = bot_dir
         self._check_structure()
-        self.meta = self._read_meta()
-        self.name = self.meta.name
-        self.race = self.meta.race
-        self.bot_type = self.meta.botType
-        self.bot_filename = self._find_bot_filename(self.meta.botType)
-        self.bwapi_version = self._find_bwapi_version()
+        meta = self._read_meta()
+        self._init(bot_dir, meta, self._find_bot_filename(meta.botType), self._find_bwapi_version())
+
+
+    @classmethod
+    def from_cache(cls, bot_dir: str, json_spec: Dict, bot_filename: str, bwapi_version: str) -> 'BotPlayer':
+        """
+        Bot whose structure has been checked before, e.g. by a BotRegistry,
+        without checking it again.
+        """
+        bot = cls.__new__(cls)
+        bot._init(bot_dir, cls.parse_meta(json_spec), bot_filename, bwapi_version)
+        return bot
+
+
+    def _init(self, bot_dir: str, meta: BotJsonMeta, bot_filename: str, bwapi_version: str) -> None:
+        self.bot_dir = bot_dir
+        self.meta = meta
+        self.name = meta.name
+        self.race = meta.race
+        self.bot_type = meta.botType
+        self.bot_filename = bot_filename
+        self.bwapi_version = bwapi_version
 
 
     def _read_meta(self) -> BotJsonMeta:
@@ -148,6 +163,9 @@ class BotPlayer(Player):
 
     @staticmethod
     def parse_meta(json_spec: Dict) -> BotJsonMeta:
+        # dateutil is slow to import, and rarely needed
+        from dateutil.parser import parse as parse_iso_date
+
         meta = BotJsonMeta()
         meta.name = json_spec['name']
         meta.race = PlayerRace[json_spec['race'].upper()]
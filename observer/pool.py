@@ -0,0 +1,367 @@
+import io
+import itertools
+import logging
+import os
+import os.path
+import queue
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pprint import pformat
+from typing import Any, Dict, List, Tuple
+
+import docker.errors
+import docker.models.containers
+
+from observer.docker_utils import (
+    docker_client, xoscmounts, check_exit_codes, container_owner, reap_containers, remove_containers,
+    APP_DIR, BOT_DIR, MAP_DIR, SC_DIR, REPLAY_DIR, DOCKER_STARCRAFT_NETWORK, EXIT_CODE_REALTIME_OUTED,
+    CONTAINER_GID, CONTAINER_UID, GAME_CONTAINER_LABEL, OWNER_LABEL
+)
+from observer.bot_image import find_bot_image
+from observer.error import ContainerException, DockerException, GameException
+from observer.player import BotPlayer
+from observer.utils import random_string
+
+logger = logging.getLogger(__name__)
+
+GAMES_DIR = f"{APP_DIR}/games"
+# logs of multi-replay sessions, relative to the game dir
+SESSIONS_DIR = ".sessions"
+POOL_READY_FILE = "/tmp/observer_pool_ready"
+# how long to wait for a fresh pool container to boot
+POOL_READY_TIMEOUT = 120
+# seconds a job may take beyond the timeouts of its games, before its container is killed
+JOB_TIMEOUT_MARGIN = 120
+# each pool container gets its own block of VNC ports
+VNC_PORTS_PER_CONTAINER = 8
+
+
+class PoolContainer:
+    def __init__(self, container: docker.models.containers.Container, slot: int) -> None:
+        self.container = container
+        self.slot = slot
+        self.jobs_done = 0
+
+    @property
+    def name(self) -> str:
+        return self.container.name
+
+
+class ContainerPool:
+    """
+    Keeps `size` booted game containers running and plays replays in them.
+
+    Each container prepares the bot, the X server and the wine registry once
+    (see play_pool.sh) and then plays one replay, or a session of several replays
+    in the same StarCraft process, per `docker exec` of play_pool_job.sh.
+    Containers are checked before every job and replaced when they are unhealthy,
+    when a job fails or after `max_jobs` jobs, so that leaks stay bounded.
+    """
+
+    def __init__(
+            self,
+            player: BotPlayer,
+            launch_params: Dict[str, Any],
+            size: int,
+            max_jobs: int
+    ) -> None:
+        if size < 1:
+            raise GameException(f"pool size must be positive, got {size}")
+        if max_jobs < 1:
+            raise GameException(f"number of jobs per pool container must be positive, got {max_jobs}")
+
+        self.player = player
+        self.launch_params = launch_params
+        self.size = size
+        self.max_jobs = max_jobs
+
+        self.pool_name = f"pool_{random_string(6)}"
+        self._generation = itertools.count(1)
+        self._idle = queue.Queue()
+        self._containers = {}
+
+    def _launch_container(self, slot: int) -> PoolContainer:
+        """
+        :raises docker.errors.APIError
+        :raises DockerException
+        """
+        params = self.launch_params
+        container_name = f"{self.pool_name}_{slot}_{next(self._generation)}"
+
+        volumes = {
+            xoscmounts(params["game_dir"]): {"bind": GAMES_DIR, "mode": "rw"},
+            xoscmounts(params["map_dir"]): {"bind": MAP_DIR, "mode": "rw"},
+        }
+        # the bot is laid out in its image already
+        docker_image = find_bot_image(docker_client(), params["docker_image"], self.player)
+        if docker_image is None:
+            docker_image = params["docker_image"]
+            volumes[xoscmounts(self.player.bot_dir)] = {"bind": BOT_DIR, "mode": "ro"}
+
+        ports = {}
+        if not params["headless"] and not params["lean"]:
+            ports.update({"5900/tcp": params["vnc_base_port"] + slot * VNC_PORTS_PER_CONTAINER})
+
+        env = dict(
+            PLAYER_NAME=self.player.name,
+            PLAYER_RACE=self.player.race.value,
+            NTH_PLAYER=0,
+            NUM_PLAYERS=1,
+            GAME_TYPE=params["game_type"].value,
+            SPEED_OVERRIDE=params["game_speed"],
+            SEED_OVERRIDE=params["seed_override"],
+            TM_SPEED_OVERRIDE=params["game_speed"],
+            TM_SEED_OVERRIDE=params["seed_override"],
+            TM_ALLOW_USER_INPUT="1" if params["allow_input"] else "0",
+            TM_TIME_OUT_AT_FRAME=params["timeout_at_frame"] or "-1",
+            BOT_FILE=self.player.bot_basefilename,
+            BOT_BWAPI=self.player.bwapi_version,
+
+            EXIT_CODE_REALTIME_OUTED=EXIT_CODE_REALTIME_OUTED,
+            CAPTURE_MOUSE_MOVEMENT="0",
+            HEADFUL_AUTO_LAUNCH="0",
+            POOL_READY_FILE=POOL_READY_FILE,
+
+            JAVA_DEBUG="0",
+            JAVA_DEBUG_PORT="",
+            JAVA_OPTS=self.player.meta.javaOpts or "",
+        )
+        if params["lean"]:
+            env["LEAN_PROFILE"] = "1"
+        network = dict(network_mode="none") if params["lean"] else dict(network=DOCKER_STARCRAFT_NETWORK)
+
+        logger.debug(
+            "\n"
+            f"docker_image={docker_image}\n"
+            f"name={container_name}\n"
+            f"environment={pformat(env, indent=4)}\n"
+            f"volumes={pformat(volumes, indent=4)}\n"
+            f"ports={ports}\n"
+        )
+
+        container = docker_client().containers.run(
+            docker_image,
+            command=["/app/play_pool.sh"],
+            name=container_name,
+            detach=True,
+            environment=env,
+            volumes=volumes,
+            labels={GAME_CONTAINER_LABEL: self.pool_name, OWNER_LABEL: container_owner()},
+            ports=ports,
+            nano_cpus=params["nano_cpus"],
+            mem_limit=params["mem_limit"] or None,
+            **network
+        )
+        if not container:
+            raise DockerException(f"could not launch pool container {container_name}")
+
+        pool_container = PoolContainer(container, slot)
+        self._containers[slot] = pool_container
+        self._wait_ready(pool_container)
+        logger.info(f"pool container {container_name} is ready")
+        return pool_container
+
+    def _is_ready(self, pool_container: PoolContainer) -> bool:
+        """
+        :raises docker.errors.APIError
+        """
+        pool_container.container.reload()
+        if pool_container.container.status != "running":
+            return False
+        result = pool_container.container.exec_run(["test", "-f", POOL_READY_FILE])
+        return result.exit_code == 0
+
+    def _wait_ready(self, pool_container: PoolContainer) -> None:
+        """
+        :raises DockerException
+        """
+        time_start = time.time()
+        while time.time() - time_start < POOL_READY_TIMEOUT:
+            if self._is_ready(pool_container):
+                return
+            if pool_container.container.status == "exited":
+                break
+            time.sleep(1)
+        raise DockerException(f"pool container {pool_container.name} did not become ready")
+
+    def _recycle(self, pool_container: PoolContainer) -> PoolContainer:
+        logger.debug(f"recycling pool container {pool_container.name} "
+                     f"after {pool_container.jobs_done} jobs")
+        # the new container has another name, the old one is removed in the background
+        reap_containers([pool_container.container])
+        return self._launch_container(pool_container.slot)
+
+    def start(self) -> None:
+        """
+        :raises docker.errors.APIError
+        :raises DockerException
+        """
+        logger.info(f"starting pool of {self.size} containers")
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            for pool_container in executor.map(self._launch_container, range(self.size)):
+                self._idle.put(pool_container)
+
+    def _copy_replays(self, pool_container: PoolContainer, replays: Dict[str, str]) -> None:
+        """
+        Copy replay files into REPLAY_DIR of the container,
+        `replays` maps paths relative to REPLAY_DIR to host replay files.
+        """
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            # owned by starcraft:users, so that the job can remove the replays afterwards
+            dirs = {"replay"} | {os.path.dirname(f"replay/{path}") for path in replays}
+            for dir_name in sorted(dirs):
+                dir_info = tarfile.TarInfo(dir_name)
+                dir_info.type, dir_info.mode = tarfile.DIRTYPE, 0o775
+                dir_info.uid, dir_info.gid = CONTAINER_UID, CONTAINER_GID
+                tar.addfile(dir_info)
+
+            for path, replay_file in replays.items():
+                info = tar.gettarinfo(replay_file, arcname=f"replay/{path}")
+                info.uid, info.gid = CONTAINER_UID, CONTAINER_GID
+                with open(replay_file, "rb") as f:
+                    tar.addfile(info, f)
+        pool_container.container.put_archive(SC_DIR, archive.getvalue())
+
+    def _make_game_dirs(self, game_name: str) -> None:
+        game_dir = self.launch_params["game_dir"]
+        os.makedirs(f"{game_dir}/{game_name}/logs_0", mode=0o777, exist_ok=True)  # todo: proper mode
+        os.makedirs(f"{game_dir}/{game_name}/crashes_0", mode=0o777, exist_ok=True)  # todo: proper mode
+
+    def _job_env(self, game_name: str, input_replay: str, log_dir: str, output_dir: str) -> Dict[str, Any]:
+        params = self.launch_params
+        # TM_LOG_* paths are relative to the StarCraft directory
+        rel_output_dir = os.path.relpath(output_dir, SC_DIR)
+        env = dict(
+            GAME_NAME=game_name,
+            INPUT_REPLAY=input_replay,
+            LOG_DIR=log_dir,
+            TM_LOG_RESULTS=f"{rel_output_dir}/scores.json",
+            TM_LOG_FRAMETIMES=f"{rel_output_dir}/frames.csv",
+            TM_LOG_UNIT_EVENTS=f"{rel_output_dir}/unit_events.csv",
+        )
+        if params["timeout"] is not None:
+            env["PLAY_TIMEOUT"] = params["timeout"]
+        return env
+
+    def _exec_job(self, env: Dict[str, Any], replays: Dict[str, str], num_games: int) -> int:
+        """
+        Run play_pool_job.sh in the next idle pool container and return its exit code.
+
+        :raises docker.errors.APIError
+        :raises DockerException
+        """
+        pool_container = self._idle.get()
+        is_healthy = False
+        try:
+            if not self._is_ready(pool_container):
+                logger.warning(f"pool container {pool_container.name} is not healthy")
+                pool_container = self._recycle(pool_container)
+
+            self._copy_replays(pool_container, replays)
+            logger.debug(f"playing job {env['GAME_NAME']} in {pool_container.name}")
+            exit_code = self._exec_play_job(pool_container, env, num_games)
+            pool_container.jobs_done += num_games
+            logger.debug(f"job {env['GAME_NAME']} exited with code {exit_code}")
+            is_healthy = exit_code == 0
+            return exit_code
+        finally:
+            try:
+                if not is_healthy or pool_container.jobs_done >= self.max_jobs:
+                    pool_container = self._recycle(pool_container)
+            finally:
+                self._idle.put(pool_container)
+
+    def _exec_play_job(self, pool_container: PoolContainer, env: Dict[str, Any], num_games: int) -> int:
+        """
+        Run play_pool_job.sh and return its exit code. The job times out each of its games,
+        if it does not return within their timeouts and JOB_TIMEOUT_MARGIN anyway,
+        the container is killed, which ends the exec.
+
+        :raises docker.errors.APIError
+        :raises ContainerException
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(
+            pool_container.container.exec_run,
+            ["/app/play_pool_job.sh"],
+            environment=env,
+            workdir=APP_DIR
+        )
+        executor.shutdown(wait=False)
+
+        timeout = self.launch_params["timeout"]
+        job_timeout = timeout * num_games + JOB_TIMEOUT_MARGIN if timeout is not None else None
+        try:
+            return future.result(job_timeout).exit_code
+        except FutureTimeoutError:
+            logger.error(f"job {env['GAME_NAME']} has not ended within {job_timeout} s, "
+                         f"killing pool container {pool_container.name}")
+            try:
+                pool_container.container.kill()
+            except docker.errors.APIError as e:
+                logger.warning(f"cannot kill pool container {pool_container.name}: {e}")
+            raise ContainerException(f"job {env['GAME_NAME']} has not ended within {job_timeout} s")
+
+    def run_replay(self, game_name: str, replay_file: str) -> None:
+        """
+        Play the replay in the next idle pool container,
+        outputs are stored in the same layout as for a regular game.
+
+        :raises docker.errors.APIError
+        :raises DockerException, ContainerException, RealtimeOutedException
+        """
+        self._make_game_dirs(game_name)
+        log_dir = f"{GAMES_DIR}/{game_name}/logs_0"
+        env = self._job_env(game_name, f"{REPLAY_DIR}/{game_name}.rep", log_dir, log_dir)
+        env["CRASHES_DIR"] = f"{GAMES_DIR}/{game_name}/crashes_0"
+
+        exit_code = self._exec_job(env, {f"{game_name}.rep": replay_file}, 1)
+        check_exit_codes([exit_code])
+
+    def run_session(self, games: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Play several replays one after another in a single StarCraft process
+        of the next idle pool container.
+
+        `games` is a list of (game_name, replay_file). The outputs of each replay
+        are written to its own game directory, in the same layout
+        as for a regular game. Logs of the whole session are stored
+        in the sessions directory. Returns whether each of the games has finished.
+
+        :raises docker.errors.APIError
+        :raises DockerException
+        """
+        game_dir = self.launch_params["game_dir"]
+        session_name = f"session_{random_string(8)}"
+        for game_name, _ in games:
+            self._make_game_dirs(game_name)
+        # the output link to the game which is played is made by play_pool_job.sh
+        os.makedirs(f"{game_dir}/{SESSIONS_DIR}/{session_name}/crashes", mode=0o777, exist_ok=True)
+
+        # the game of each replay is known from its file name
+        replays = {f"session/{index:05d}_{game_name}.rep": replay_file
+                   for index, (game_name, replay_file) in enumerate(games)}
+
+        session_dir = f"{GAMES_DIR}/{SESSIONS_DIR}/{session_name}"
+        env = self._job_env(session_name, f"{REPLAY_DIR}/session/*.rep",
+                            session_dir, f"{session_dir}/output")
+        env.update(dict(
+            CRASHES_DIR=f"{session_dir}/crashes",
+            GAMES_DIR=GAMES_DIR,
+            SESSION_GAMES=" ".join(game_name for game_name, _ in games),
+            SESSION_OUTPUT_DIR=f"{session_dir}/output",
+        ))
+
+        exit_code = self._exec_job(env, replays, len(games))
+        finished = [os.path.exists(f"{game_dir}/{game_name}/logs_0/scores.json")
+                    for game_name, _ in games]
+        logger.debug(f"session {session_name} exited with code {exit_code}, "
+                     f"{sum(finished)}/{len(games)} games finished")
+        return finished
+
+    def close(self) -> None:
+        logger.info("removing pool containers")
+        remove_containers([pool_container.container for pool_container in self._containers.values()])
+        self._containers.clear()
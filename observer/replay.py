@@ -0,0 +1,384 @@
+import enum
+import glob
+import hashlib
+import logging
+import os
+import os.path
+import struct
+import zlib
+from typing import BinaryIO, Dict, List, Optional
+
+from observer.error import ObserverException
+
+logger = logging.getLogger(__name__)
+
+# frames per second at the "fastest" game speed (42 ms per frame)
+FASTEST_FPS = 1000 / 42
+
+REPLAY_EXTENSIONS = (".rep", ".REP")
+
+REPLAY_ID_LEGACY = b"reRS"  # up to 1.18
+REPLAY_ID_MODERN = b"seRS"  # 1.18+, zlib compressed sections
+
+REPLAY_ID_SIZE = 4
+HEADER_SIZE = 0x279
+CHUNK_SIZE = 8192
+
+MAX_PLAYERS = 12
+PLAYER_STRUCT_SIZE = 36
+
+
+class ReplayException(ObserverException):
+    pass
+
+
+class ReplayRace(enum.Enum):
+    ZERG = 'Z'
+    TERRAN = 'T'
+    PROTOSS = 'P'
+    RANDOM = 'R'
+    UNKNOWN = '?'
+
+
+_races = {0: ReplayRace.ZERG, 1: ReplayRace.TERRAN, 2: ReplayRace.PROTOSS, 6: ReplayRace.RANDOM}
+
+# player types which are actually playing the game
+PLAYER_TYPE_COMPUTER = 1
+PLAYER_TYPE_HUMAN = 2
+
+
+class ReplayPlayer:
+    def __init__(self, slot: int, player_id: int, player_type: int, race: ReplayRace,
+                 team: int, name: str) -> None:
+        self.slot = slot
+        self.player_id = player_id
+        self.player_type = player_type
+        self.race = race
+        self.team = team
+        self.name = name
+
+    @property
+    def is_computer(self) -> bool:
+        return self.player_type == PLAYER_TYPE_COMPUTER
+
+    def to_dict(self) -> Dict:
+        return dict(slot=self.slot, id=self.player_id, type=self.player_type,
+                    race=self.race.value, team=self.team, name=self.name)
+
+    def __str__(self) -> str:
+        return f"{self.name}:{self.race.value}"
+
+
+class ReplayHeader:
+    def __init__(
+            self,
+            engine: int,
+            frames: int,
+            start_time: int,
+            title: str,
+            map_name: str,
+            map_width: int,
+            map_height: int,
+            host: str,
+            players: List[ReplayPlayer],
+            is_modern: bool
+    ) -> None:
+        self.engine = engine
+        self.frames = frames
+        self.start_time = start_time
+        self.title = title
+        self.map_name = map_name
+        self.map_width = map_width
+        self.map_height = map_height
+        self.host = host
+        self.players = players
+        self.is_modern = is_modern
+
+    @property
+    def engine_name(self) -> str:
+        return "BroodWar" if self.engine == 1 else "StarCraft"
+
+    @property
+    def duration(self) -> float:
+        """ Game duration in seconds at the fastest game speed. """
+        return self.frames / FASTEST_FPS
+
+    @property
+    def matchup(self) -> str:
+        return matchup(self.players)
+
+    def __str__(self) -> str:
+        return (f"{self.map_name} ({self.map_width}x{self.map_height}) "
+                f"{self.matchup} {' vs '.join(str(p) for p in self.players)}, "
+                f"{self.frames} frames")
+
+
+def matchup(players: List[ReplayPlayer]) -> str:
+    """
+    Canonical matchup of the players, e.g. "PvZ" or "PTvZZ".
+
+    Players are grouped by teams if there are several of them, otherwise
+    every player is on its own. Sides are sorted, so "ZvP" and "PvZ" are the same.
+    """
+    teams = {}
+    use_teams = len(set(player.team for player in players)) > 1
+    for index, player in enumerate(players):
+        teams.setdefault(player.team if use_teams else index, []).append(player.race.value)
+    return "v".join(sorted("".join(sorted(races)) for races in teams.values()))
+
+
+def canonical_matchup(matchup_spec: str) -> str:
+    return "v".join(sorted("".join(sorted(side.upper())) for side in matchup_spec.split("v")))
+
+
+# PKWare Data Compression Library "implode" decompression.
+# This is a port of blast.c by Mark Adler (zlib/contrib/blast).
+_LITLEN = [
+    11, 124, 8, 7, 28, 7, 188, 13, 76, 4, 10, 8, 12, 10, 12, 10, 8, 23, 8,
+    9, 7, 6, 7, 8, 7, 6, 55, 8, 23, 24, 12, 11, 7, 9, 11, 12, 6, 7, 22, 5,
+    7, 24, 6, 11, 9, 6, 7, 22, 7, 11, 38, 7, 9, 8, 25, 11, 8, 11, 9, 12,
+    8, 12, 5, 38, 5, 38, 5, 11, 7, 5, 6, 21, 6, 10, 53, 8, 7, 24, 10, 27,
+    44, 253, 253, 253, 252, 252, 252, 13, 12, 45, 12, 45, 12, 61, 12, 45,
+    44, 173]
+_LENLEN = [2, 35, 36, 53, 38, 23]
+_DISTLEN = [2, 20, 53, 230, 247, 151, 248]
+_LENGTH_BASE = [3, 2, 4, 5, 6, 7, 8, 9, 10, 12, 16, 24, 40, 72, 136, 264]
+_LENGTH_EXTRA = [0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8]
+_MAXBITS = 13
+
+
+class _Huffman:
+    def __init__(self, compact_lengths: List[int]) -> None:
+        lengths = []
+        for rep in compact_lengths:
+            lengths += [rep & 15] * ((rep >> 4) + 1)
+
+        self.count = [0] * (_MAXBITS + 1)
+        for length in lengths:
+            self.count[length] += 1
+
+        offsets = [0] * (_MAXBITS + 1)
+        for length in range(1, _MAXBITS):
+            offsets[length + 1] = offsets[length] + self.count[length]
+
+        self.symbol = [0] * len(lengths)
+        for symbol, length in enumerate(lengths):
+            if length != 0:
+                self.symbol[offsets[length]] = symbol
+                offsets[length] += 1
+
+
+class _BitReader:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+        self.bitbuf = 0
+        self.bitcnt = 0
+
+    def bits(self, need: int) -> int:
+        value = self.bitbuf
+        while self.bitcnt < need:
+            if self.pos >= len(self.data):
+                raise ReplayException("unexpected end of compressed data")
+            value |= self.data[self.pos] << self.bitcnt
+            self.pos += 1
+            self.bitcnt += 8
+        self.bitbuf = value >> need
+        self.bitcnt -= need
+        return value & ((1 << need) - 1)
+
+    def decode(self, huffman: _Huffman) -> int:
+        code = first = index = 0
+        for length in range(1, _MAXBITS + 1):
+            code |= self.bits(1) ^ 1  # codes are stored inverted
+            count = huffman.count[length]
+            if code < first + count:
+                return huffman.symbol[index + (code - first)]
+            index += count
+            first = (first + count) << 1
+            code <<= 1
+        raise ReplayException("invalid huffman code in compressed data")
+
+
+_litcode = _Huffman(_LITLEN)
+_lencode = _Huffman(_LENLEN)
+_distcode = _Huffman(_DISTLEN)
+
+
+def explode(data: bytes) -> bytes:
+    """
+    Decompress data compressed by PKWare DCL implode, as used in replay sections.
+
+    :raises ReplayException
+    """
+    reader = _BitReader(data)
+    coded_literals = reader.bits(8)
+    if coded_literals > 1:
+        raise ReplayException("invalid literal flag in compressed data")
+    dict_bits = reader.bits(8)
+    if dict_bits < 4 or dict_bits > 6:
+        raise ReplayException("invalid dictionary size in compressed data")
+
+    out = bytearray()
+    while True:
+        if reader.bits(1):
+            symbol = reader.decode(_lencode)
+            length = _LENGTH_BASE[symbol] + reader.bits(_LENGTH_EXTRA[symbol])
+            if length == 519:  # end code
+                break
+
+            shift = 2 if length == 2 else dict_bits
+            dist = (reader.decode(_distcode) << shift) + reader.bits(shift) + 1
+            if dist > len(out):
+                raise ReplayException("distance too far back in compressed data")
+            for _ in range(length):
+                out.append(out[-dist])
+        else:
+            out.append(reader.decode(_litcode) if coded_literals else reader.bits(8))
+    return bytes(out)
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ReplayException("unexpected end of replay file")
+    return data
+
+
+def _read_int32(f: BinaryIO) -> int:
+    return struct.unpack("<i", _read_exact(f, 4))[0]
+
+
+def read_section(f: BinaryIO, size: int) -> bytes:
+    """
+    Read one replay section of known decompressed `size` from the current position,
+    reading only the bytes of this section.
+
+    :raises ReplayException
+    """
+    _read_int32(f)  # checksum, ignored
+    num_chunks = _read_int32(f)
+
+    data = bytearray()
+    for _ in range(num_chunks):
+        chunk_length = _read_int32(f)
+        expected = min(CHUNK_SIZE, size - len(data))
+        if chunk_length < 0 or expected <= 0:
+            raise ReplayException("invalid replay section")
+        chunk = _read_exact(f, chunk_length)
+
+        if chunk_length == expected:
+            data += chunk  # stored
+        elif chunk[:1] == b"\x78":
+            data += zlib.decompress(chunk)[:expected]
+        else:
+            data += explode(chunk)[:expected]
+
+    if len(data) != size:
+        raise ReplayException(f"replay section has {len(data)} bytes, expected {size}")
+    return bytes(data)
+
+
+def _cstring(data: bytes) -> str:
+    # strip the terminator and the color codes which are used in map and player names
+    data = bytes(c for c in data.split(b"\0", 1)[0] if c >= 0x20)
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        # older replays use the windows code page of the player
+        return data.decode("cp949", errors="replace")
+
+
+def parse_header(data: bytes, is_modern: bool = False) -> ReplayHeader:
+    if len(data) != HEADER_SIZE:
+        raise ReplayException(f"replay header has {len(data)} bytes, expected {HEADER_SIZE}")
+
+    engine, frames = struct.unpack_from("<BI", data, 0x00)
+    start_time, = struct.unpack_from("<I", data, 0x08)
+    map_width, map_height = struct.unpack_from("<HH", data, 0x34)
+
+    players = []
+    for i in range(MAX_PLAYERS):
+        offset = 0xa1 + i * PLAYER_STRUCT_SIZE
+        slot, = struct.unpack_from("<H", data, offset)
+        player_id, player_type, race, team = struct.unpack_from("<BxxxBBB", data, offset + 4)
+        if player_type not in (PLAYER_TYPE_COMPUTER, PLAYER_TYPE_HUMAN):
+            continue
+        name = _cstring(data[offset + 11:offset + PLAYER_STRUCT_SIZE])
+        if not name:
+            continue
+        players.append(ReplayPlayer(slot, player_id, player_type,
+                                    _races.get(race, ReplayRace.UNKNOWN), team, name))
+
+    return ReplayHeader(
+        engine=engine,
+        frames=frames,
+        start_time=start_time,
+        title=_cstring(data[0x18:0x18 + 28]),
+        map_name=_cstring(data[0x61:0x61 + 26]),
+        map_width=map_width,
+        map_height=map_height,
+        host=_cstring(data[0x48:0x48 + 24]),
+        players=players,
+        is_modern=is_modern
+    )
+
+
+def read_header(replay_file: str) -> ReplayHeader:
+    """
+    Read the header of a replay file, without reading the rest of it.
+
+    :raises ReplayException
+    """
+    with open(replay_file, "rb") as f:
+        replay_id = read_section(f, REPLAY_ID_SIZE)
+        if replay_id not in (REPLAY_ID_LEGACY, REPLAY_ID_MODERN):
+            raise ReplayException(f"{replay_file} is not a StarCraft replay")
+
+        is_modern = replay_id == REPLAY_ID_MODERN
+        if is_modern:
+            _read_int32(f)  # offset of the compressed data, not needed
+
+        return parse_header(read_section(f, HEADER_SIZE), is_modern)
+
+
+def replay_hash(replay_file: str) -> str:
+    """
+    Content hash of a replay file, independent of its name or location.
+    """
+    hash_sha1 = hashlib.sha1()
+    with open(replay_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha1.update(chunk)
+    return hash_sha1.hexdigest()
+
+
+def safe_read_header(replay_file: str) -> Optional[ReplayHeader]:
+    try:
+        return read_header(replay_file)
+    except (ReplayException, OSError, zlib.error, struct.error) as e:
+        logger.debug(f"cannot read replay header of {replay_file}: {e}")
+        return None
+
+
+def find_replay_files(replays: str) -> List[str]:
+    """
+    Resolve the --replays specification into a sorted list of replay files.
+
+    It can be a directory (searched recursively), a glob pattern
+    or a text file with one replay path per line.
+    """
+    if os.path.isdir(replays):
+        replay_files = [
+            os.path.join(root, file)
+            for root, _, files in os.walk(replays)
+            for file in files if file.endswith(REPLAY_EXTENSIONS)
+        ]
+    elif os.path.isfile(replays) and not replays.endswith(REPLAY_EXTENSIONS):
+        with open(replays, "r") as f:
+            replay_files = [line.strip() for line in f if line.strip()]
+    else:
+        replay_files = [file for file in glob.glob(replays, recursive=True)
+                        if file.endswith(REPLAY_EXTENSIONS)]
+
+    return sorted(os.path.abspath(file) for file in replay_files)
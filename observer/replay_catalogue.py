@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import os.path
+import sqlite3
+from typing import Iterable, List, Optional
+
+from observer.replay import canonical_matchup, find_replay_files, replay_hash, safe_read_header
+
+logger = logging.getLogger(__name__)
+
+# commit the catalogue after this many newly indexed files
+COMMIT_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+
+CREATE TABLE IF NOT EXISTS replays (
+    hash TEXT PRIMARY KEY,
+    is_valid INTEGER NOT NULL,
+    engine INTEGER,
+    frames INTEGER,
+    start_time INTEGER,
+    title TEXT,
+    map_name TEXT,
+    map_width INTEGER,
+    map_height INTEGER,
+    host TEXT,
+    matchup TEXT,
+    players TEXT
+);
+CREATE INDEX IF NOT EXISTS replays_matchup ON replays (matchup);
+CREATE INDEX IF NOT EXISTS replays_map_name ON replays (map_name);
+CREATE INDEX IF NOT EXISTS replays_frames ON replays (frames);
+"""
+
+
+class ReplayCatalogue:
+    """
+    Persistent SQLite index of replay headers, keyed by replay content hash.
+
+    Files are re-hashed and re-parsed only when their size or mtime changes,
+    so updating the catalogue of an unchanged directory only stats the files.
+    """
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> 'ReplayCatalogue':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def file_hash(self, path: str) -> Optional[str]:
+        """
+        Content hash of an indexed file, if it has not changed since it was indexed.
+        """
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (path, stat.st_size, stat.st_mtime)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _index_file(self, path: str) -> str:
+        stat = os.stat(path)
+        content_hash = replay_hash(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, content_hash)
+        )
+
+        is_known = self.conn.execute(
+            "SELECT 1 FROM replays WHERE hash = ?", (content_hash,)
+        ).fetchone()
+        if is_known:
+            return content_hash
+
+        header = safe_read_header(path)
+        if header is None:
+            self.conn.execute("INSERT INTO replays (hash, is_valid) VALUES (?, 0)", (content_hash,))
+            return content_hash
+
+        self.conn.execute(
+            "INSERT INTO replays (hash, is_valid, engine, frames, start_time, title, map_name,"
+            " map_width, map_height, host, matchup, players)"
+            " VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_hash, header.engine, header.frames, header.start_time, header.title,
+             header.map_name, header.map_width, header.map_height, header.host,
+             header.matchup, json.dumps([player.to_dict() for player in header.players]))
+        )
+        return content_hash
+
+    def index_files(self, paths: Iterable[str]) -> int:
+        """
+        Add new or changed replay files to the catalogue.
+        Returns the number of (re-)indexed files.
+        """
+        num_indexed = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                if self.file_hash(path) is not None:
+                    continue
+                self._index_file(path)
+            except OSError as e:
+                logger.warning(f"cannot index {path}: {e}")
+                continue
+
+            num_indexed += 1
+            if num_indexed % COMMIT_EVERY == 0:
+                self.conn.commit()
+                logger.info(f"indexed {num_indexed} replays")
+        self.conn.commit()
+        return num_indexed
+
+    def index_dir(self, replay_dir: str) -> int:
+        """
+        Index all replays in the directory (recursively),
+        and forget the files which are no longer there.
+        """
+        replay_dir = os.path.abspath(replay_dir)
+        paths = find_replay_files(replay_dir)
+        num_indexed = self.index_files(paths)
+
+        present = set(paths)
+        prefix = replay_dir + os.sep
+        removed = [
+            (path,) for path, in self.conn.execute(
+                "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            ) if path not in present
+        ]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", removed)
+        self.conn.commit()
+        logger.info(f"indexed {num_indexed} new or changed replays, "
+                    f"{len(paths)} replays in {replay_dir}, {len(removed)} removed")
+        return num_indexed
+
+    def query(
+            self,
+            paths: Optional[Iterable[str]] = None,
+            matchup: Optional[str] = None,
+            map_name: Optional[str] = None,
+            min_frames: Optional[int] = None,
+            max_frames: Optional[int] = None
+    ) -> List[str]:
+        """
+        Paths of the indexed replays matching all the given filters.
+
+        :param paths: only consider these files (they must be indexed)
+        :param matchup: e.g. "PvZ", the order of the sides does not matter
+        :param map_name: case-insensitive substring of the map name
+        """
+        conditions, params = ["r.is_valid = 1"], []
+        if matchup is not None:
+            conditions.append("r.matchup = ?")
+            params.append(canonical_matchup(matchup))
+        if map_name is not None:
+            conditions.append("r.map_name LIKE ?")
+            params.append(f"%{map_name}%")
+        if min_frames is not None:
+            conditions.append("r.frames >= ?")
+            params.append(min_frames)
+        if max_frames is not None:
+            conditions.append("r.frames <= ?")
+            params.append(max_frames)
+
+        rows = self.conn.execute(
+            "SELECT f.path FROM files f JOIN replays r ON f.hash = r.hash"
+            f" WHERE {' AND '.join(conditions)} ORDER BY f.path",
+            params
+        )
+        matching = [path for path, in rows]
+        if paths is not None:
+            selected = set(os.path.abspath(path) for path in paths)
+            matching = [path for path in matching if path in selected]
+        return matching
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import docker.models.containers
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_FILE = "resources.csv"
+SERIES_COLUMNS = ("time", "cpu_percent", "mem_bytes", "blk_read_bytes", "blk_write_bytes",
+                  "net_rx_bytes", "net_tx_bytes")
+# seconds to wait for the stats streams to end once the containers have exited
+STOP_TIMEOUT = 2.0
+
+
+def _cpu_percent(stats: Dict[str, Any]) -> Optional[float]:
+    """
+    Share of one cpu used since the previous sample, as computed by `docker stats`.
+    """
+    cpu, precpu = stats.get("cpu_stats", {}), stats.get("precpu_stats", {})
+    try:
+        cpu_delta = cpu["cpu_usage"]["total_usage"] - precpu["cpu_usage"]["total_usage"]
+        system_delta = cpu["system_cpu_usage"] - precpu["system_cpu_usage"]
+    except (KeyError, TypeError):
+        return None
+    if system_delta <= 0:
+        return None
+    online_cpus = cpu.get("online_cpus") or len(cpu["cpu_usage"].get("percpu_usage") or [1])
+    return cpu_delta / system_delta * online_cpus * 100.0
+
+
+def _mem_bytes(stats: Dict[str, Any]) -> Optional[int]:
+    """
+    Memory used without the reclaimable page cache, as shown by `docker stats`
+    (cgroup v2 reports inactive_file, v1 total_inactive_file).
+    """
+    memory_stats = stats.get("memory_stats", {})
+    usage = memory_stats.get("usage")
+    if usage is None:
+        return None
+    detail = memory_stats.get("stats", {})
+    inactive = detail.get("inactive_file", detail.get("total_inactive_file", 0))
+    return max(0, usage - inactive)
+
+
+def _blk_bytes(stats: Dict[str, Any]) -> Tuple[int, int]:
+    read, write = 0, 0
+    for entry in (stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []):
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return read, write
+
+
+def _net_bytes(stats: Dict[str, Any]) -> Tuple[int, int]:
+    networks = (stats.get("networks") or {}).values()
+    return sum(net.get("rx_bytes", 0) for net in networks), sum(net.get("tx_bytes", 0) for net in networks)
+
+
+def parse_stats(stats: Dict[str, Any], since: float) -> Optional[List]:
+    """
+    One row of the time series from a sample of the docker stats stream,
+    None for the empty samples of stopped containers.
+    """
+    mem_bytes = _mem_bytes(stats)
+    if mem_bytes is None:
+        return None
+    cpu_percent = _cpu_percent(stats)
+    return [round(time.time() - since, 2), round(cpu_percent, 1) if cpu_percent is not None else None,
+            mem_bytes, *_blk_bytes(stats), *_net_bytes(stats)]
+
+
+class ResourceSampler:
+    """
+    Follows the docker stats stream of each container of a game while it runs
+    and keeps one sample every `interval` seconds (the daemon streams one per second).
+
+    The time series of each container is written to `resources.csv` in its log dir,
+    `summary` gives the peak and mean use of each container.
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.series = []  # type: List[List[List]]
+        self.peak_mem_bytes = []  # type: List[Optional[int]]
+        self._log_dirs = []  # type: List[str]
+        self._threads = []  # type: List[threading.Thread]
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._since = time.time()
+
+    def start(self, containers: List[docker.models.containers.Container], log_dirs: List[str]) -> None:
+        self._since = time.time()
+        self._log_dirs = log_dirs
+        self.series = [[] for _ in containers]
+        self.peak_mem_bytes = [None for _ in containers]
+        # daemon threads: a stream of a container on an unreachable host may never end
+        self._threads = [threading.Thread(target=self._follow, args=(index, container), daemon=True)
+                         for index, container in enumerate(containers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _follow(self, index: int, container: docker.models.containers.Container) -> None:
+        last_sample = None
+        try:
+            for stats in container.stats(stream=True, decode=True):
+                if self._stopped.is_set():
+                    break
+                row = parse_stats(stats, self._since)
+                if row is None:
+                    continue
+                with self._lock:
+                    # the peak of all the samples, cgroup v1 reports max_usage too, but with the page cache
+                    self.peak_mem_bytes[index] = max(row[2], self.peak_mem_bytes[index] or 0)
+                    if last_sample is None or row[0] - last_sample >= self.interval:
+                        self.series[index].append(row)
+                        last_sample = row[0]
+                    else:
+                        # totals of the i/o are kept up to date between samples
+                        self.series[index][-1][3:] = row[3:]
+        except Exception as e:
+            logger.debug(f"stats of container {container.name} are not available: {e}")
+
+    def stop(self) -> None:
+        """
+        Stop following the containers and write their time series.
+        """
+        self._stopped.set()
+        deadline = time.time() + STOP_TIMEOUT
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+
+        with self._lock:
+            for log_dir, series in zip(self._log_dirs, self.series):
+                try:
+                    with open(f"{log_dir}/{RESOURCES_FILE}", "w") as f:
+                        f.write(",".join(SERIES_COLUMNS) + "\n")
+                        for row in series:
+                            f.write(",".join("" if value is None else str(value) for value in row) + "\n")
+                except OSError as e:
+                    logger.warning(f"cannot write resource usage to {log_dir}: {e}")
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Peak and mean cpu and memory, and total i/o of each container, in the order of the players.
+        """
+        summaries = []
+        with self._lock:
+            for series, peak_mem_bytes in zip(self.series, self.peak_mem_bytes):
+                if not series:
+                    summaries.append(None)
+                    continue
+                cpu = [row[1] for row in series if row[1] is not None]
+                mem = [row[2] for row in series]
+                summaries.append(dict(
+                    samples=len(series),
+                    cpu_percent_peak=max(cpu, default=None),
+                    cpu_percent_mean=round(sum(cpu) / len(cpu), 1) if cpu else None,
+                    mem_bytes_peak=peak_mem_bytes,
+                    mem_bytes_mean=round(sum(mem) / len(mem)),
+                    blk_read_bytes=series[-1][3],
+                    blk_write_bytes=series[-1][4],
+                    net_rx_bytes=series[-1][5],
+                    net_tx_bytes=series[-1][6],
+                ))
+        return summaries
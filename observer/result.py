@@ -1,5 +1,7 @@
+import functools
 import json
 import logging
+import os
 from typing import List, Optional
 
 from observer.logs import find_frames, find_unit_events, find_logs, find_replays, find_scores
@@ -29,18 +31,24 @@ class ScoreResult:
 
     @staticmethod
     def load_score(score_file: str) -> 'ScoreResult':
-        with open(score_file, "r") as f:
-            v = json.load(f)
+        # score files do not change after the game, so each of them is parsed only once
+        return _load_score(score_file, os.path.getmtime(score_file))
 
-        return ScoreResult(
-            v['is_winner'],
-            v['is_crashed'],
-            v['timed_out'],
-            v['building_score'],
-            v['kill_score'],
-            v['razing_score'],
-            v['unit_score'],
-        )
+
+@functools.lru_cache(maxsize=4096)
+def _load_score(score_file: str, mtime: float) -> ScoreResult:
+    with open(score_file, "r") as f:
+        v = json.load(f)
+
+    return ScoreResult(
+        v['is_winner'],
+        v['is_crashed'],
+        v['timed_out'],
+        v['building_score'],
+        v['kill_score'],
+        v['razing_score'],
+        v['unit_score'],
+    )
 
 
 class GameResult:
@@ -158,6 +166,12 @@ class GameResult:
             self._unit_event_files = find_unit_events(self.game_dir, self.game_name)
         return self._unit_event_files
 
+    def data(self, nth_player: int = 0) -> 'GameData':
+        """
+        Frames and unit events of the game as numpy arrays.
+        """
+        from observer.dataset import GameData
+        return GameData(self.game_dir, self.game_name, nth_player)
 
     @property
     def score_files(self) -> List[str]:
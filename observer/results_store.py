@@ -0,0 +1,412 @@
+import atexit
+import enum
+import glob
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from observer.player import Player
+from observer.result import GameResult, ScoreResult
+
+logger = logging.getLogger(__name__)
+
+# outcomes of a player in a game
+OUTCOME_WIN = "win"
+OUTCOME_LOSS = "loss"
+OUTCOME_CRASH = "crash"
+OUTCOME_GAMETIME_OUT = "gametime_out"
+OUTCOME_REALTIME_OUT = "realtime_out"
+# the game ended without a winner being determined, e.g. replays
+OUTCOME_FINISHED = "finished"
+
+# games are written in one transaction per this many games, or after FLUSH_INTERVAL seconds
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    game_dir TEXT NOT NULL,
+    game_name TEXT NOT NULL,
+    map TEXT,
+    replay_file TEXT,
+    game_type TEXT,
+    game_time REAL,
+    is_crashed INTEGER NOT NULL,
+    is_gametime_outed INTEGER NOT NULL,
+    is_realtime_outed INTEGER NOT NULL,
+    winner TEXT,
+    loser TEXT,
+    finished_at REAL NOT NULL,
+    info TEXT NOT NULL,
+    UNIQUE (game_dir, game_name)
+);
+CREATE INDEX IF NOT EXISTS games_map ON games (map);
+CREATE INDEX IF NOT EXISTS games_finished_at ON games (finished_at);
+
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    nth_player INTEGER NOT NULL,
+    bot TEXT NOT NULL,
+    race TEXT,
+    outcome TEXT NOT NULL,
+    PRIMARY KEY (game_id, nth_player)
+);
+CREATE INDEX IF NOT EXISTS game_players_bot ON game_players (bot, outcome);
+CREATE INDEX IF NOT EXISTS game_players_race ON game_players (race, outcome);
+CREATE INDEX IF NOT EXISTS game_players_outcome ON game_players (outcome);
+"""
+
+# columns which statistics can be grouped by
+GROUP_COLUMNS = dict(
+    bot="p.bot",
+    race="p.race",
+    map="g.map",
+)
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    return str(obj)
+
+
+def player_outcomes(
+        players: Sequence[Player],
+        game_result: Optional[GameResult],
+        is_realtime_outed: bool,
+        game_dir: str,
+        game_name: str
+) -> List[str]:
+    """
+    Outcome of each of the players. Winners are known only for valid 1v1 games,
+    other games are judged by the score file of each player.
+    """
+    if is_realtime_outed:
+        return [OUTCOME_REALTIME_OUT] * len(players)
+
+    if game_result is not None:
+        if game_result.is_valid:
+            return [OUTCOME_WIN if nth_player == game_result.nth_winner_player else OUTCOME_LOSS
+                    for nth_player in range(len(players))]
+        outcome = OUTCOME_GAMETIME_OUT if game_result.is_gametime_outed else OUTCOME_CRASH
+        return [outcome] * len(players)
+
+    return score_outcomes(game_dir, game_name, len(players))
+
+
+def score_outcomes(game_dir: str, game_name: str, num_players: int) -> List[str]:
+    """
+    Outcome of each of the players judged by their score files.
+    """
+    outcomes = []
+    for nth_player in range(num_players):
+        score_file = f"{game_dir}/{game_name}/logs_{nth_player}/scores.json"
+        if not os.path.exists(score_file):
+            outcomes.append(OUTCOME_CRASH)
+            continue
+        score = ScoreResult.load_score(score_file)
+        if score.is_crashed:
+            outcomes.append(OUTCOME_CRASH)
+        elif score.timed_out:
+            outcomes.append(OUTCOME_GAMETIME_OUT)
+        else:
+            outcomes.append(OUTCOME_FINISHED)
+    return outcomes
+
+
+class ResultsStore:
+    """
+    SQLite store of game results, with one row per game and one per player.
+
+    Games are buffered and written in batched transactions, so it can be
+    used from many batch jobs at once. Buffered games are written at the latest
+    `flush_interval` seconds after they were added, call `flush` or `close`
+    to write them right away.
+    """
+
+    def __init__(
+            self,
+            db_file: str,
+            batch_size: int = BATCH_SIZE,
+            flush_interval: float = FLUSH_INTERVAL
+    ) -> None:
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._pending = []
+        self._last_flush = time.time()
+        self._timer = None  # type: Optional[threading.Timer]
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.flush()
+            self.conn.close()
+
+    def __enter__(self) -> 'ResultsStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def add(
+            self,
+            game_dir: str,
+            game_name: str,
+            info: Dict[str, Any],
+            players: List[Dict[str, Any]],
+            finished_at: Optional[float] = None
+    ) -> None:
+        """
+        Buffer the game. A game played again under the same name replaces the old one.
+
+        :param info: game info, as written to result.json
+        :param players: dicts with bot, race and outcome of each player
+        """
+        game = dict(
+            game_dir=os.path.abspath(game_dir),
+            game_name=game_name,
+            info=info,
+            players=players,
+            finished_at=time.time() if finished_at is None else finished_at
+        )
+        with self._lock:
+            self._pending.append(game)
+            if self._timer is None:
+                self._schedule_flush()
+            if len(self._pending) >= self.batch_size or \
+                    time.time() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def _schedule_flush(self) -> None:
+        # games are written also when no more games are added, e.g. by an idle server
+        self._timer = threading.Timer(self.flush_interval, self._flush_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_later(self) -> None:
+        with self._lock:
+            self._timer = None
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning(f"cannot store results of {len(self._pending)} games, trying again later: {e}")
+                self._schedule_flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._last_flush = time.time()
+            if not self._pending:
+                return
+
+            with self.conn:
+                for game in self._pending:
+                    self._insert(game)
+            logger.debug(f"stored results of {len(self._pending)} games")
+            self._pending = []
+
+    def _insert(self, game: Dict[str, Any]) -> None:
+        info = game["info"]
+        outcomes = [player["outcome"] for player in game["players"]]
+        is_crashed = info.get("is_crashed")
+        if is_crashed is None:
+            is_crashed = OUTCOME_CRASH in outcomes
+        is_gametime_outed = info.get("is_gametime_outed")
+        if is_gametime_outed is None:
+            is_gametime_outed = OUTCOME_GAMETIME_OUT in outcomes
+        self.conn.execute("DELETE FROM games WHERE game_dir = ? AND game_name = ?",
+                          (game["game_dir"], game["game_name"]))
+        cursor = self.conn.execute(
+            "INSERT INTO games (game_dir, game_name, map, replay_file, game_type, game_time,"
+            " is_crashed, is_gametime_outed, is_realtime_outed, winner, loser, finished_at, info)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (game["game_dir"], game["game_name"], info.get("map_name"), info.get("replay_file"),
+             _json_default(info["game_type"]) if info.get("game_type") is not None else None,
+             info.get("game_time"),
+             bool(is_crashed), bool(is_gametime_outed), bool(info.get("is_realtime_outed")),
+             info.get("winner"), info.get("loser"), game["finished_at"],
+             json.dumps(info, default=_json_default))
+        )
+        self.conn.executemany(
+            "INSERT INTO game_players (game_id, nth_player, bot, race, outcome) VALUES (?, ?, ?, ?, ?)",
+            [(cursor.lastrowid, nth_player, player["bot"], player.get("race"), player["outcome"])
+             for nth_player, player in enumerate(game["players"])]
+        )
+
+    def import_game_dir(self, game_dir: str) -> int:
+        """
+        Add games of the result.json files in the game dir which are not stored yet.
+        Returns the number of imported games.
+        """
+        game_dir = os.path.abspath(game_dir)
+        with self._lock:
+            self.flush()
+            known = set(name for name, in self.conn.execute(
+                "SELECT game_name FROM games WHERE game_dir = ?", (game_dir,)))
+
+        num_imported = 0
+        for result_file in sorted(glob.glob(f"{game_dir}/*/result.json")):
+            game_name = os.path.basename(os.path.dirname(result_file))
+            if game_name in known:
+                continue
+            try:
+                with open(result_file, "r") as f:
+                    info = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"cannot import {result_file}: {e}")
+                continue
+
+            races = {info.get("winner"): info.get("winner_race"),
+                     info.get("loser"): info.get("loser_race")}
+            if info.get("is_realtime_outed"):
+                outcome = OUTCOME_REALTIME_OUT
+            elif info.get("is_gametime_outed"):
+                outcome = OUTCOME_GAMETIME_OUT
+            elif info.get("is_crashed"):
+                outcome = OUTCOME_CRASH
+            else:
+                outcome = None
+            bots = info.get("bots", [])
+            if outcome is None and info.get("winner") is None:
+                # games without a winner (all but 1v1 games) are judged by the score file of each player
+                outcomes = score_outcomes(game_dir, game_name, len(bots))
+            else:
+                outcomes = [outcome or (OUTCOME_WIN if bot == info.get("winner") else OUTCOME_LOSS) for bot in bots]
+            players = [dict(bot=bot, race=races.get(bot), outcome=bot_outcome)
+                       for bot, bot_outcome in zip(bots, outcomes)]
+
+            self.add(game_dir, game_name, info, players, os.path.getmtime(result_file))
+            num_imported += 1
+
+        self.flush()
+        logger.info(f"imported {num_imported} games from {game_dir}")
+        return num_imported
+
+    @staticmethod
+    def _conditions(
+            bot: Optional[str] = None,
+            race: Optional[str] = None,
+            map_name: Optional[str] = None,
+            outcome: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None
+    ) -> tuple:
+        conditions, params = [], []
+        if bot is not None:
+            conditions.append("p.bot = ?")
+            params.append(bot)
+        if race is not None:
+            conditions.append("p.race = ?")
+            params.append(race)
+        if map_name is not None:
+            conditions.append("g.map LIKE ?")
+            params.append(f"%{map_name}%")
+        if outcome is not None:
+            conditions.append("p.outcome = ?")
+            params.append(outcome)
+        if since is not None:
+            conditions.append("g.finished_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("g.finished_at < ?")
+            params.append(until)
+        return f"WHERE {' AND '.join(conditions)}" if conditions else "", params
+
+    def query(self, limit: Optional[int] = None, **filters) -> List[Dict[str, Any]]:
+        """
+        Player results matching all the filters, newest first.
+
+        :param filters: bot, race, map_name (substring), outcome,
+                        since and until (unix timestamps of game end)
+        """
+        self.flush()
+        where, params = self._conditions(**filters)
+        sql = ("SELECT g.game_name, g.game_dir, g.map, g.replay_file, g.game_time, g.finished_at,"
+               " p.nth_player, p.bot, p.race, p.outcome"
+               " FROM game_players p JOIN games g ON g.id = p.game_id"
+               f" {where} ORDER BY g.finished_at DESC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            cursor = self.conn.execute(sql, params)
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor]
+
+    def stats(self, group_by: str = "bot", **filters) -> List[Dict[str, Any]]:
+        """
+        Number of games and win, crash and timeout rates per group,
+        groups with most games first.
+
+        :param group_by: one of GROUP_COLUMNS
+        :param filters: the same as for `query`
+        """
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"cannot group by {group_by}, use one of {', '.join(GROUP_COLUMNS)}")
+
+        self.flush()
+        where, params = self._conditions(**filters)
+        # the join is needed only for columns of games, players alone are counted much faster
+        uses_games = "g." in GROUP_COLUMNS[group_by] or "g." in where
+        sql = (f"SELECT {GROUP_COLUMNS[group_by]}, COUNT(*),"
+               f" SUM(p.outcome = '{OUTCOME_WIN}'), SUM(p.outcome = '{OUTCOME_LOSS}'),"
+               f" SUM(p.outcome = '{OUTCOME_CRASH}'),"
+               f" SUM(p.outcome IN ('{OUTCOME_GAMETIME_OUT}', '{OUTCOME_REALTIME_OUT}'))"
+               f" FROM game_players p{' JOIN games g ON g.id = p.game_id' if uses_games else ''}"
+               f" {where} GROUP BY 1 ORDER BY 2 DESC")
+
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(
+            key=key, games=games, wins=wins, losses=losses, crashes=crashes, timeouts=timeouts,
+            win_rate=wins / (wins + losses) if wins + losses else None,
+            crash_rate=crashes / games,
+        ) for key, games, wins, losses, crashes, timeouts in rows]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_results_store(db_file: str) -> ResultsStore:
+    """
+    Store shared by all the games of this process, it is closed at exit.
+    """
+    db_file = os.path.abspath(db_file)
+    with _stores_lock:
+        if db_file not in _stores:
+            _stores[db_file] = ResultsStore(db_file)
+        return _stores[db_file]
+
+
+def close_results_store(db_file: str) -> None:
+    """
+    Flush and close the shared store before its database is moved or removed.
+    """
+    with _stores_lock:
+        store = _stores.pop(os.path.abspath(db_file), None)
+    if store is not None:
+        store.close()
+
+
+@atexit.register
+def _close_results_stores() -> None:
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
@@ -0,0 +1,514 @@
+import copy
+import http.client
+import json
+import logging
+import os
+import os.path
+import queue
+import re
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import docker.errors
+
+from observer.batch import VNC_PORTS_PER_JOB, BatchRunner, replay_game_name, start_host_pool
+from observer.defaults import VERSION
+from observer.docker_hosts import HostPool
+from observer.docker_utils import dockermachine_ip, remove_game_containers
+from observer.error import ObserverException
+from observer.game import GameArgs, run_game
+from observer.job_queue import (
+    FINAL_STATUSES, JOB_EXTRACT, JOB_MATCH, JOB_RECORD, JobException, JobQueue
+)
+from observer.watch import DirectoryWatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERVER_ADDRESS = "127.0.0.1:8765"
+UNIX_ADDRESS_PREFIX = "unix:"
+
+# streaming clients get an empty line at least this often, to detect closed connections
+STREAM_HEARTBEAT = 15.0
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """
+    "unix:/path/to/socket" or "host:port".
+    """
+    if address.startswith(UNIX_ADDRESS_PREFIX):
+        return "unix", address[len(UNIX_ADDRESS_PREFIX):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ObserverException(f"server address {address} should be host:port or unix:/path")
+    return "tcp", (host, int(port))
+
+
+class JobServer:
+    """
+    Runs jobs of a persistent JobQueue in `jobs` worker threads.
+
+    Replays are extracted and recorded by BatchRunners, so extraction
+    can use a warm container pool, or jobs are dispatched across several docker hosts.
+    Every job gets a unique game name starting with its id, so jobs
+    of different clients never share containers or output directories.
+    """
+
+    def __init__(
+            self,
+            args: GameArgs,
+            job_queue: JobQueue,
+            jobs: int,
+            pool_recycle: Optional[int] = None,
+            hosts: Optional[HostPool] = None
+    ) -> None:
+        if args.vnc_host == "":
+            args.vnc_host = dockermachine_ip() or "localhost"
+
+        self.args = args
+        self.queue = job_queue
+        self.jobs = jobs
+        self.hosts = hosts
+
+        # each kind of jobs gets its own range of VNC ports
+        self.runners = {
+            JOB_EXTRACT: BatchRunner(self._kind_args(JOB_EXTRACT, 0), [], jobs, pool_recycle, hosts=hosts),
+            JOB_RECORD: BatchRunner(self._kind_args(JOB_RECORD, 1), [], jobs, hosts=hosts),
+        }
+        self._match_args = self._kind_args(JOB_MATCH, 2)
+        self._match_slots = queue.Queue()
+        for slot in range(jobs):
+            self._match_slots.put(slot)
+
+        self._running = {}  # job id -> game name
+        self._match_hosts = {}  # game name -> docker host
+        self._running_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._workers = []
+
+    def _kind_args(self, kind: str, nth_kind: int) -> GameArgs:
+        args = copy.copy(self.args)
+        args.extract = kind == JOB_EXTRACT
+        args.record = kind == JOB_RECORD
+        args.replay = None
+        args.show_all = False
+        args.vnc_base_port = self.args.vnc_base_port + nth_kind * self.jobs * VNC_PORTS_PER_JOB
+        # recordings are watched, matches need the network
+        args.lean = self.args.lean and kind == JOB_EXTRACT
+        if kind == JOB_EXTRACT:
+            args.bots = ['Extractor']
+        elif kind == JOB_RECORD:
+            args.bots = ['Recorder']
+            args.game_speed = -1
+        return args
+
+    @staticmethod
+    def job_game_name(job: Dict[str, Any]) -> str:
+        if job["kind"] == JOB_MATCH:
+            return f"job{job['id']:08d}_match"
+        return f"job{job['id']:08d}_{replay_game_name(job['params']['replay'])}"
+
+    def _run_match(self, job: Dict[str, Any], game_name: str) -> Dict[str, Any]:
+        params = job["params"]
+        slot = self._match_slots.get()
+        docker_host = self.hosts.acquire() if self.hosts is not None else None
+        try:
+            match_args = copy.copy(self._match_args)
+            match_args.game_name = game_name
+            match_args.bots = params["bots"]
+            match_args.map = params.get("map", self._match_args.map)
+            match_args.vnc_base_port += slot * VNC_PORTS_PER_JOB
+            if docker_host is not None:
+                self._match_hosts[game_name] = docker_host
+                game_result = run_game(match_args, lambda: self.hosts.ensure_alive(docker_host),
+                                       launch_viewers=False, docker_host=docker_host)
+            else:
+                game_result = run_game(match_args, launch_viewers=False)
+        finally:
+            self._match_slots.put(slot)
+            if docker_host is not None:
+                self._match_hosts.pop(game_name, None)
+                self.hosts.release(docker_host)
+
+        result = dict(game_name=game_name, game_dir=match_args.game_dir)
+        if game_result is not None:
+            result.update(
+                game_time=game_result.game_time,
+                is_crashed=game_result.is_crashed,
+                is_gametime_outed=game_result.is_gametime_outed,
+                is_realtime_outed=game_result.is_realtime_outed,
+                winner=game_result.winner_player.name if game_result.is_valid else None,
+            )
+        return result
+
+    def _run(self, job: Dict[str, Any], game_name: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        if job["kind"] == JOB_MATCH:
+            return None, self._run_match(job, game_name)
+
+        runner = self.runners[job["kind"]]
+        batch_result = runner.run_job(job["params"]["replay"], game_name)
+        return batch_result.failure, dict(
+            game_name=game_name,
+            game_dir=runner.args.game_dir,
+            job_time=batch_result.job_time,
+        )
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        game_name = self.job_game_name(job)
+        self.queue.set_game_name(job["id"], game_name)
+        with self._running_lock:
+            self._running[job["id"]] = game_name
+
+        result = None
+        try:
+            error, result = self._run(job, game_name)
+        except (ObserverException, docker.errors.APIError) as e:
+            error = str(e) or e.__class__.__name__
+        except Exception as e:
+            logger.exception(e)
+            error = f"unexpected error: {e}"
+        finally:
+            with self._running_lock:
+                self._running.pop(job["id"], None)
+
+        if self._stop_event.is_set():
+            # the job was interrupted by the shutdown, it stays queued
+            return
+        self.queue.finish(job["id"], error, result)
+        logger.info(f"job {job['id']} {'failed: ' + error if error else 'finished'}")
+
+    def _work(self) -> None:
+        while not self._stop_event.is_set():
+            job = self.queue.wait_for_job(timeout=1.0)
+            if job is not None:
+                if self._stop_event.is_set():
+                    self.queue.requeue(job["id"])
+                    return
+                self._execute(job)
+
+    def start(self) -> None:
+        for runner in self.runners.values():
+            runner.start()
+        for nth_worker in range(self.jobs):
+            worker = threading.Thread(target=self._work, name=f"observer-worker-{nth_worker}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self) -> None:
+        """
+        Stop the workers. Running jobs are queued again
+        and their containers removed.
+        """
+        self._stop_event.set()
+        with self._running_lock:
+            running = dict(self._running)
+        for job_id, game_name in running.items():
+            self.queue.requeue(job_id)
+            self._remove_containers(game_name)
+        for worker in self._workers:
+            worker.join(timeout=10)
+        for runner in self.runners.values():
+            runner.close()
+
+    def _remove_containers(self, game_name: str) -> None:
+        for runner in self.runners.values():
+            if game_name in runner.running_games:
+                runner.remove_containers(game_name)
+                return
+        remove_game_containers(game_name + "_", self._match_hosts.get(game_name))
+
+    def status(self) -> Dict[str, Any]:
+        with self._running_lock:
+            running = dict(self._running)
+        status = dict(version=VERSION, jobs=self.jobs, counts=self.queue.counts(),
+                      running={str(job_id): game_name for job_id, game_name in running.items()},
+                      seq=self.queue.seq)
+        if self.hosts is not None:
+            status["docker_hosts"] = [
+                dict(name=host.name, capacity=host.capacity, in_use=host.in_use,
+                     is_alive=host.is_alive, error=host.error)
+                for host in self.hosts.hosts
+            ]
+        return status
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = f"observer/{VERSION}"
+    job_server = None  # type: JobServer
+
+    def log_message(self, format: str, *args) -> None:
+        # the client address of unix sockets is empty
+        logger.debug(f"{self.command} {self.path}: " + format % args)
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, dict(error=message))
+
+    def _read_json(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _stream(self, job_id: Optional[int], after_seq: int) -> None:
+        """
+        Job changes as JSON lines, until the job ends or the client disconnects.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        queue_ = self.job_server.queue
+        if job_id is not None:
+            job = queue_.job(job_id)
+            self.wfile.write((json.dumps(job) + "\n").encode())
+            self.wfile.flush()
+            if job["status"] in FINAL_STATUSES:
+                return
+
+        try:
+            while True:
+                after_seq, jobs = queue_.wait_changes(after_seq, STREAM_HEARTBEAT)
+                if job_id is not None:
+                    jobs = [job for job in jobs if job["id"] == job_id]
+                lines = [json.dumps(job) + "\n" for job in jobs] or ["\n"]
+                self.wfile.write("".join(lines).encode())
+                self.wfile.flush()
+                if job_id is not None and any(job["status"] in FINAL_STATUSES for job in jobs):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _job_id(self, match: re.Match) -> Optional[int]:
+        job_id = int(match.group(1))
+        if self.job_server.queue.job(job_id) is None:
+            self._send_error(404, f"job {job_id} does not exist")
+            return None
+        return job_id
+
+    def _int_param(self, query: Dict[str, str], name: str, default: int) -> Optional[int]:
+        try:
+            value = int(query.get(name, default))
+        except ValueError:
+            value = -1
+        if value < 0:
+            self._send_error(400, f"{name} should be a non-negative integer")
+            return None
+        return value
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/status":
+            self._send_json(200, self.job_server.status())
+        elif url.path == "/jobs":
+            limit = self._int_param(query, "limit", 100)
+            if limit is not None:
+                self._send_json(200, self.job_server.queue.jobs(query.get("status"), limit))
+        elif url.path == "/events":
+            after_seq = self._int_param(query, "after", self.job_server.queue.seq)
+            if after_seq is not None:
+                self._stream(None, after_seq)
+        elif re.fullmatch(r"/jobs/(\d+)", url.path):
+            job_id = self._job_id(re.fullmatch(r"/jobs/(\d+)", url.path))
+            if job_id is not None:
+                self._send_json(200, self.job_server.queue.job(job_id))
+        elif re.fullmatch(r"/jobs/(\d+)/events", url.path):
+            seq = self.job_server.queue.seq
+            job_id = self._job_id(re.fullmatch(r"/jobs/(\d+)/events", url.path))
+            if job_id is not None:
+                self._stream(job_id, seq)
+        else:
+            self._send_error(404, f"{url.path} not found")
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != "/jobs":
+            self._send_error(404, f"{self.path} not found")
+            return
+        try:
+            params = self._read_json()
+            if not isinstance(params, dict):
+                raise JobException("job should be a JSON object")
+            kind = params.pop("kind", JOB_EXTRACT)
+            job = self.job_server.queue.submit(kind, params)
+        except ValueError as e:
+            self._send_error(400, f"invalid JSON: {e}")
+            return
+        except JobException as e:
+            self._send_error(400, str(e))
+            return
+        self._send_json(201, job)
+
+    def do_DELETE(self) -> None:
+        match = re.fullmatch(r"/jobs/(\d+)", urlparse(self.path).path)
+        if match is None:
+            self._send_error(404, f"{self.path} not found")
+            return
+        job_id = self._job_id(match)
+        if job_id is None:
+            return
+        try:
+            self._send_json(200, self.job_server.queue.cancel(job_id))
+        except JobException as e:
+            self._send_error(409, str(e))
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        socketserver.UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler expects these
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_http_server(address: str, job_server: JobServer) -> socketserver.BaseServer:
+    handler = type("RequestHandler", (_RequestHandler,), dict(job_server=job_server))
+    kind, bind_address = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(bind_address):
+            os.remove(bind_address)
+        return _UnixHTTPServer(bind_address, handler)
+
+    http_server = ThreadingHTTPServer(bind_address, handler)
+    http_server.daemon_threads = True
+    return http_server
+
+
+def serve(
+        args: GameArgs,
+        address: str,
+        db_file: str,
+        jobs: int,
+        pool_recycle: Optional[int] = None,
+        watch_dir: Optional[str] = None,
+        docker_hosts: Optional[str] = None
+) -> None:
+    """
+    Run the job server until interrupted.
+
+    :param watch_dir: replays written to this directory are queued,
+                      as extract or record jobs according to args
+    :param docker_hosts: docker hosts with their capacity, see parse_docker_hosts.
+                         The number of jobs is their total capacity.
+    """
+    hosts = None
+    if docker_hosts is not None:
+        hosts = start_host_pool(args, docker_hosts)
+        jobs = hosts.capacity
+
+    job_queue = JobQueue(db_file)
+    job_server = JobServer(args, job_queue, jobs, pool_recycle, hosts)
+    http_server = make_http_server(address, job_server)
+
+    watcher = None
+    if watch_dir is not None:
+        watch_kind = JOB_RECORD if args.record else JOB_EXTRACT
+        watcher = DirectoryWatcher(watch_dir, lambda path: job_queue.submit_watched(watch_kind, path))
+
+    try:
+        job_server.start()
+        if watcher is not None:
+            watcher.start()
+        logger.info(f"serving on {address} with {jobs} workers, "
+                    f"{job_queue.counts().get('queued', 0)} jobs queued")
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        logger.warning("Caught interrupt, stopping the server")
+        logger.warning("Running jobs are going to be queued again. This can take a moment, please wait.")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        http_server.server_close()
+        job_server.stop()
+        job_queue.close()
+        if hosts is not None:
+            hosts.close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ServerClient:
+    """
+    Client of the job server API.
+    """
+
+    def __init__(self, address: str = DEFAULT_SERVER_ADDRESS, timeout: Optional[float] = 60) -> None:
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        kind, address = parse_address(self.address)
+        if kind == "unix":
+            return _UnixHTTPConnection(address, timeout=timeout)
+        return http.client.HTTPConnection(*address, timeout=timeout)
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None) -> Any:
+        connection = self._connection(self.timeout)
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                               headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"null")
+        except OSError as e:
+            raise ObserverException(f"cannot connect to the server at {self.address}: {e}") from e
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise JobException(data.get("error") if isinstance(data, dict) else data)
+        return data
+
+    def submit(self, kind: str, **params) -> Dict[str, Any]:
+        return self._request("POST", "/jobs", dict(params, kind=kind))
+
+    def job(self, job_id: int) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self._request("GET", "/jobs" + (f"?status={status}" if status else ""))
+
+    def cancel(self, job_id: int) -> Dict[str, Any]:
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def status(self) -> Dict[str, Any]:
+        return self._request("GET", "/status")
+
+    def follow(self, job_id: int) -> Iterator[Dict[str, Any]]:
+        """
+        States of the job as it changes, until it ends.
+        """
+        # the server sends heartbeats, no need for a read timeout
+        connection = self._connection(timeout=None)
+        try:
+            connection.request("GET", f"/jobs/{job_id}/events")
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise JobException(json.loads(response.read()).get("error"))
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        except OSError as e:
+            raise ObserverException(f"cannot connect to the server at {self.address}: {e}") from e
+        finally:
+            connection.close()
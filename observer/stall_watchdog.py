@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# bytes read from the end of a progress file to find its last line
+TAIL_BYTES = 4096
+
+
+def last_frame(tail: bytes) -> Optional[int]:
+    """
+    Frame of the last complete line of a frames.csv, whose first column is the frame.
+    """
+    lines = tail.split(b"\n")
+    # the last line is still being written, unless the file ends with a newline
+    for line in reversed(lines[:-1]):
+        first_column = line.split(b",", 1)[0].strip()
+        if first_column.isdigit():
+            return int(first_column)
+    return None
+
+
+def read_tail(file: str) -> Optional[bytes]:
+    try:
+        with open(file, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_BYTES))
+            return f.read()
+    except OSError:
+        return None
+
+
+class StallWatchdog:
+    """
+    Notices a game whose frames do not advance, e.g. when Wine deadlocks or a bot hangs,
+    long before the whole game times out.
+
+    `read_progress` gives the last frame of each container of the game (None when there is none yet).
+    The game has stalled when none of them has advanced for `stall_timeout` seconds,
+    counted from the start of the game. Call `check` while the game runs.
+    """
+
+    def __init__(self, read_progress: List[Callable[[], Optional[int]]], stall_timeout: float) -> None:
+        self.read_progress = read_progress
+        self.stall_timeout = stall_timeout
+        self.last_progress = [None] * len(read_progress)  # type: List[Optional[int]]
+        self.last_advanced = time.time()
+        self.is_stalled = False
+
+    def check(self) -> bool:
+        """
+        :returns: whether the game has stalled
+        """
+        if self.is_stalled:
+            return True
+
+        now = time.time()
+        for index, read_progress in enumerate(self.read_progress):
+            try:
+                progress = read_progress()
+            except Exception as e:
+                logger.debug(f"cannot read progress of container {index}: {e}")
+                continue
+            if progress is not None and progress != self.last_progress[index]:
+                self.last_progress[index] = progress
+                self.last_advanced = now
+
+        if now - self.last_advanced >= self.stall_timeout:
+            logger.warning(f"game has not advanced for {now - self.last_advanced:.0f} s, "
+                           f"last frames {self.last_progress}")
+            self.is_stalled = True
+        return self.is_stalled
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from observer.docker_utils import (
+    ready_marker, READY_GUI, READY_REGISTRY, READY_GAME, READY_BOT, READY_REPLAY, READY_FINISHED
+)
+
+logger = logging.getLogger(__name__)
+
+# phases of a game in the order they happen
+PHASE_CREATE = "create"
+PHASE_CONTAINERS_STARTED = "containers_started"
+PHASE_CONTAINERS_EXITED = "containers_exited"
+PHASE_TEARDOWN = "teardown"
+PHASES = (
+    PHASE_CREATE,
+    PHASE_CONTAINERS_STARTED,
+    "x_started",
+    "registry_updated",
+    "sc_launched",
+    "first_frame",
+    "replay_saved",
+    "game_end",
+    PHASE_CONTAINERS_EXITED,
+    PHASE_TEARDOWN,
+)
+# phases signalled by play_common.sh in the containers
+MARKER_PHASES = {
+    READY_GUI: "x_started",
+    READY_REGISTRY: "registry_updated",
+    READY_GAME: "sc_launched",
+    READY_BOT: "first_frame",
+    READY_REPLAY: "replay_saved",
+    READY_FINISHED: "game_end",
+}
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class PhaseTimer:
+    """
+    Times of the phases of one game, from the observer and from the markers of the containers.
+    """
+
+    def __init__(self) -> None:
+        self.times = {}  # type: Dict[str, float]
+
+    def mark(self, phase: str, at: Optional[float] = None) -> None:
+        self.times[phase] = time.time() if at is None else at
+
+    def read_markers(self, log_dirs: Sequence[str]) -> None:
+        """
+        The phase is reached once all the containers have reached it.
+        """
+        for stage, phase in MARKER_PHASES.items():
+            for log_dir in log_dirs:
+                try:
+                    with open(ready_marker(log_dir, stage), "r") as f:
+                        at = float(f.read().strip())
+                except (OSError, ValueError):
+                    continue
+                self.times[phase] = max(at, self.times.get(phase, at))
+
+    def timings(self) -> Dict[str, float]:
+        """
+        Seconds since the containers were created, in the order of the phases.
+        """
+        start = self.times.get(PHASE_CREATE, min(self.times.values(), default=0.0))
+        return {phase: round(self.times[phase] - start, 3) for phase in PHASES if phase in self.times}
+
+
+def phase_durations(timings: Dict[str, float]) -> Dict[str, float]:
+    """
+    Seconds spent until each phase since the previous one, and in total.
+    """
+    durations, previous = {}, None
+    for phase in PHASES:
+        if phase not in timings:
+            continue
+        if previous is not None:
+            durations[phase] = round(max(0.0, timings[phase] - timings[previous]), 3)
+        previous = phase
+    if durations:
+        durations["total"] = round(max(timings.values()) - min(timings.values()), 3)
+    return durations
+
+
+def quantile(values: List[float], q: float) -> float:
+    """
+    Linear interpolation between the closest ranks of the sorted values.
+    """
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class PhaseStats:
+    """
+    Durations of the phases of all the games played by this process.
+    """
+
+    def __init__(self) -> None:
+        self._durations = {}  # type: Dict[str, List[float]]
+        self._lock = threading.Lock()
+
+    def add(self, durations: Dict[str, float]) -> None:
+        with self._lock:
+            for phase, seconds in durations.items():
+                self._durations.setdefault(phase, []).append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            durations = {phase: sorted(values) for phase, values in self._durations.items()}
+        summary = {}
+        for phase, values in durations.items():
+            summary[phase] = dict(count=len(values), sum=round(sum(values), 3),
+                                  mean=round(sum(values) / len(values), 3))
+            summary[phase].update({f"p{round(q * 100)}": round(quantile(values, q), 3) for q in QUANTILES})
+        return summary
+
+    def prometheus(self) -> str:
+        with self._lock:
+            durations = {phase: sorted(values) for phase, values in self._durations.items()}
+        lines = ["# HELP observer_game_phase_seconds Seconds spent in the phases of games.",
+                 "# TYPE observer_game_phase_seconds summary"]
+        for phase, values in durations.items():
+            for q in QUANTILES:
+                lines.append(f'observer_game_phase_seconds{{phase="{phase}",quantile="{q}"}} '
+                             f'{quantile(values, q):.3f}')
+            lines.append(f'observer_game_phase_seconds_sum{{phase="{phase}"}} {sum(values):.3f}')
+            lines.append(f'observer_game_phase_seconds_count{{phase="{phase}"}} {len(values)}')
+        return "\n".join(lines) + "\n"
+
+
+_phase_stats = PhaseStats()
+_metrics_lock = threading.Lock()
+
+
+def _write_atomic(file: str, content: str) -> None:
+    tmp_file = f"{file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write(content)
+    os.replace(tmp_file, file)
+
+
+def record_timings(game_name: str, timings: Dict[str, float], metrics_file: Optional[str] = None) -> None:
+    """
+    Add the game to the statistics of this process and export them to the metrics file:
+    a Prometheus textfile if it ends with .prom (rewritten after each game),
+    JSON lines otherwise (one line per game).
+    """
+    durations = phase_durations(timings)
+    _phase_stats.add(durations)
+    if metrics_file is None:
+        return
+
+    try:
+        with _metrics_lock:
+            if metrics_file.endswith(".prom"):
+                _write_atomic(metrics_file, _phase_stats.prometheus())
+            else:
+                with open(metrics_file, "a") as f:
+                    f.write(json.dumps(dict(game_name=game_name, finished_at=time.time(),
+                                            timings=timings, durations=durations)) + "\n")
+    except OSError as e:
+        logger.warning(f"cannot write metrics to {metrics_file}: {e}")
+
+
+def timing_summary() -> Dict[str, Dict[str, float]]:
+    return _phase_stats.summary()
+
+
+def write_timing_summary(summary_file: str) -> None:
+    _write_atomic(summary_file, json.dumps(timing_summary(), indent=2))
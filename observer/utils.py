@@ -6,9 +6,6 @@ import sys
 import tempfile
 import zipfile
 
-import requests
-import tqdm
-
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +15,10 @@ def random_string(len: int = 8) -> str:
 
 
 def download_file(url: str, as_file: str) -> None:
+    # imported only when needed, they slow down the startup of observer
+    import requests
+    import tqdm
+
     headers = {
         # python is sending some python User-Agent that Cloudflare doesn't like
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64; rv:55.0) Gecko/20100101 Firefox/55.0'
@@ -46,6 +47,6 @@ def create_data_dirs(*dir_paths) -> None:
 def md5_file(fname: str) -> str:
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(1 << 20), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
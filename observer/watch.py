@@ -0,0 +1,142 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import os.path
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Dict, Tuple
+
+from observer.replay import REPLAY_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# files are picked up when they are closed after writing, or moved into the directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+# without inotify, the directory is scanned this often
+POLL_INTERVAL = 2.0
+
+
+def _is_replay(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in REPLAY_EXTENSIONS
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    return libc
+
+
+class DirectoryWatcher(threading.Thread):
+    """
+    Calls `on_replay` with the path of every replay file written
+    or moved into the directory (not recursively).
+
+    Uses inotify on Linux, elsewhere the directory is polled and a file
+    is picked up once its size and mtime did not change between two scans.
+    Replays which were in the directory before the watcher started
+    are picked up too.
+    """
+
+    def __init__(self, watch_dir: str, on_replay: Callable[[str], None]) -> None:
+        super().__init__(name="observer-watch", daemon=True)
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.on_replay = on_replay
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _emit(self, path: str) -> None:
+        try:
+            self.on_replay(path)
+        except Exception as e:
+            logger.error(f"cannot queue {path}: {e}")
+
+    def _scan(self) -> Dict[str, Tuple[int, float]]:
+        files = {}
+        for entry in os.scandir(self.watch_dir):
+            if entry.is_file() and _is_replay(entry.name):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def run(self) -> None:
+        libc = _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK)
+            if fd >= 0 and libc.inotify_add_watch(fd, self.watch_dir.encode(),
+                                                  IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                logger.info(f"watching {self.watch_dir} for new replays (inotify)")
+                try:
+                    self._run_inotify(fd)
+                finally:
+                    os.close(fd)
+                return
+            if fd >= 0:
+                os.close(fd)
+            logger.debug(f"inotify failed with errno {ctypes.get_errno()}, polling instead")
+
+        logger.info(f"watching {self.watch_dir} for new replays (polling)")
+        self._run_polling()
+
+    def _run_inotify(self, fd: int) -> None:
+        # watch first, then scan, so that no file is missed in between
+        for path in sorted(self._scan()):
+            self._emit(path)
+
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if not readable:
+                continue
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                if _is_replay(name):
+                    self._emit(f"{self.watch_dir}/{name}")
+
+    def _run_polling(self) -> None:
+        seen = {}
+        pending = {}
+        while not self._stop_event.is_set():
+            try:
+                files = self._scan()
+            except OSError as e:
+                logger.warning(f"cannot scan {self.watch_dir}: {e}")
+                files = {}
+
+            for path, stat in files.items():
+                if seen.get(path) == stat:
+                    continue
+                if pending.get(path) == stat:
+                    # not changed since the last scan, the file is complete
+                    seen[path] = stat
+                    del pending[path]
+                    self._emit(path)
+                else:
+                    pending[path] = stat
+
+            self._stop_event.wait(POLL_INTERVAL)
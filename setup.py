@@ -21,7 +21,7 @@ setup(
         'Topic :: Software Development :: Build Tools',
         # Pick your license as you wish
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.8',
     ],
     install_requires=['requests',
                       'coloredlogs',
@@ -31,12 +31,16 @@ setup(
                       'python-dateutil',
                       'pandas',
                       'docker'],
+    extras_require={
+        # columnar conversion of game outputs (--convert)
+        'parquet': ['pyarrow>=7'],
+    },
     packages=['observer'],
     entry_points={  # Optional
         'console_scripts': [
             'observer=observer.cli:main',
         ],
     },
-    python_requires='>=3.4',
+    python_requires='>=3.8',
     include_package_data=True
 )
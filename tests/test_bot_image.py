@@ -0,0 +1,67 @@
+import pytest
+
+from observer import bot_image
+from observer.bot_image import LABEL_FINGERPRINT, bot_fingerprint, bot_image_name, build_bot_image, find_bot_image
+from observer.error import DockerException
+from observer.fake_docker import FakeDockerClient
+from observer.player import BotPlayer
+
+GAME_IMAGE = "starcraft:game"
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_image, "_found_images", {})
+    bot_dir = tmp_path / "Extractor"
+    (bot_dir / "AI").mkdir(parents=True)
+    (bot_dir / "AI" / "Extractor.dll").write_bytes(b"bot")
+    (bot_dir / "BWAPI.dll").write_bytes(b"bwapi")
+    json_spec = dict(name="Extractor", race="Protoss", botType="AI_MODULE")
+    return BotPlayer.from_cache(str(bot_dir), json_spec, str(bot_dir / "AI" / "Extractor.dll"), "4.4.0")
+
+
+def test_bot_image_name():
+    assert bot_image_name("starcraft:game", "Extractor") == "starcraft:game-bot-extractor"
+    assert bot_image_name("localhost:5000/starcraft", "My Bot!") == "localhost:5000/starcraft:latest-bot-my_bot_"
+    assert len(bot_image_name("starcraft:game", "x" * 200).split(":")[1]) == 128
+
+
+def test_fingerprint_changes_with_bot_and_base_image(bot):
+    fingerprint = bot_fingerprint(bot, "sha256:1")
+    assert bot_fingerprint(bot, "sha256:1") == fingerprint
+    assert bot_fingerprint(bot, "sha256:2") != fingerprint
+
+    with open(f"{bot.ai_dir}/Extractor.dll", "ab") as f:
+        f.write(b" changed")
+    assert bot_fingerprint(bot, "sha256:1") != fingerprint
+
+
+def test_build_and_find(bot):
+    client = FakeDockerClient(images=[GAME_IMAGE])
+    assert find_bot_image(client, GAME_IMAGE, bot) is None
+
+    assert build_bot_image(client, GAME_IMAGE, bot) == "starcraft:game-bot-extractor"
+    # images which were not found before are looked up again after a build
+    assert find_bot_image(client, GAME_IMAGE, bot) == "starcraft:game-bot-extractor"
+    # and then only once per process
+    calls = client.calls.total
+    find_bot_image(client, GAME_IMAGE, bot)
+    assert client.calls.total == calls
+
+
+def test_out_of_date_image_is_not_used(bot):
+    client = FakeDockerClient(images=[GAME_IMAGE])
+    image_name = bot_image_name(GAME_IMAGE, bot.name)
+    base_image_id = client.images.get(GAME_IMAGE).id
+    client.images.build(tag=image_name, labels={LABEL_FINGERPRINT: bot_fingerprint(bot, base_image_id)})
+    assert find_bot_image(client, GAME_IMAGE, bot) == image_name
+
+    bot_image._found_images.clear()
+    with open(f"{bot.bot_dir}/BWAPI.dll", "ab") as f:
+        f.write(b" changed")
+    assert find_bot_image(client, GAME_IMAGE, bot) is None
+
+
+def test_build_without_game_image(bot):
+    with pytest.raises(DockerException):
+        build_bot_image(FakeDockerClient(images=[]), GAME_IMAGE, bot)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import shutil
+
+import pytest
+
+from observer import player
+from observer.bot_registry import BotRegistry
+from observer.error import PlayerException
+from observer.player import BotPlayer, BotType, PlayerRace
+
+BWAPI_DLL = b"BWAPI 4.4.0"
+
+
+@pytest.fixture
+def bot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(player, "versions_md5s", {"4.4.0": hashlib.md5(BWAPI_DLL).hexdigest()})
+    bot_dir = tmp_path / "bots"
+    bot_dir.mkdir()
+    return bot_dir
+
+
+@pytest.fixture
+def validations(monkeypatch):
+    validated = []
+    validate = BotRegistry._validate
+
+    def counting_validate(bot_path):
+        validated.append(bot_path.rsplit("/", 1)[-1])
+        return validate(bot_path)
+
+    monkeypatch.setattr(BotRegistry, "_validate", staticmethod(counting_validate))
+    return validated
+
+
+def _write_bot(bot_dir, name, race="Protoss"):
+    bot_path = bot_dir / name
+    (bot_path / "AI").mkdir(parents=True)
+    (bot_path / "read").mkdir()
+    (bot_path / "BWAPI.dll").write_bytes(BWAPI_DLL)
+    (bot_path / "AI" / f"{name}.dll").write_bytes(b"bot")
+    (bot_path / "bot.json").write_text(json.dumps(dict(name=name, race=race, botType="AI_MODULE")))
+    return bot_path
+
+
+def test_find_bot(tmp_path, bot_dir):
+    bot_path = _write_bot(bot_dir, "Extractor")
+    registry = BotRegistry(str(bot_dir), str(tmp_path / "registry.json"))
+
+    bot = registry.find_bot("Extractor")
+    expected = BotPlayer(str(bot_path))
+    assert bot.name == expected.name == "Extractor"
+    assert bot.race == PlayerRace.PROTOSS
+    assert bot.bot_type == BotType.AI_MODULE
+    assert bot.bot_filename == expected.bot_filename
+    assert bot.bwapi_version == "4.4.0"
+
+    assert registry.find_bot("Missing") is None
+
+
+def test_invalid_bots_are_cached(tmp_path, bot_dir, validations):
+    _write_bot(bot_dir, "Good")
+    (bot_dir / "Broken").mkdir()
+    cache_file = str(tmp_path / "registry.json")
+
+    entries = BotRegistry(str(bot_dir), cache_file).scan()
+    assert sorted(entries) == ["Broken", "Good"]
+    assert "bot.json" in entries["Broken"]["error"]
+    assert sorted(validations) == ["Broken", "Good"]
+
+    registry = BotRegistry(str(bot_dir), cache_file)
+    with pytest.raises(PlayerException):
+        registry.find_bot("Broken")
+    assert registry.find_bot("Good").name == "Good"
+    # nothing has changed, the cached results are used
+    assert len(validations) == 2
+
+
+def test_changed_bot_is_validated_again(tmp_path, bot_dir, validations):
+    bot_path = _write_bot(bot_dir, "Bot")
+    _write_bot(bot_dir, "Other")
+    cache_file = str(tmp_path / "registry.json")
+    BotRegistry(str(bot_dir), cache_file).scan()
+
+    (bot_path / "bot.json").write_text(json.dumps(dict(name="Bot", race="Zerg", botType="AI_MODULE")))
+    registry = BotRegistry(str(bot_dir), cache_file)
+    assert registry.find_bot("Bot").race == PlayerRace.ZERG
+    assert sorted(validations) == ["Bot", "Bot", "Other"]
+
+
+def test_removed_bots_are_forgotten(tmp_path, bot_dir):
+    _write_bot(bot_dir, "Bot")
+    removed = _write_bot(bot_dir, "Removed")
+    cache_file = tmp_path / "registry.json"
+    registry = BotRegistry(str(bot_dir), str(cache_file))
+    registry.scan()
+
+    shutil.rmtree(removed)
+    assert sorted(registry.scan()) == ["Bot"]
+    assert sorted(json.loads(cache_file.read_text())[str(bot_dir)]) == ["Bot"]
+
+
+def test_found_bots_are_copies(tmp_path, bot_dir):
+    _write_bot(bot_dir, "Bot")
+    registry = BotRegistry(str(bot_dir), str(tmp_path / "registry.json"))
+
+    bot = registry.find_bot("Bot")
+    bot.race = PlayerRace.RANDOM
+    assert registry.find_bot("Bot").race == PlayerRace.PROTOSS
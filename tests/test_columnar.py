@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet  # noqa: E402
+
+from observer.columnar import convert_csv, convert_game, convert_game_dir, parquet_file_of  # noqa: E402
+
+FRAMES_CSV = (
+    "frame,ID,player,name,x,y,HP,order\n"
+    "0,1,0,Protoss_Probe,100,200,20,Move\n"
+    "0,2,1,Zerg_Drone,300,400,40,\n"
+    "8,1,0,Protoss_Probe,104,204,20,Move\n"
+    "8,2\n"
+)
+
+
+def _write_game(game_dir, game_name, frames=FRAMES_CSV, nth_player=0):
+    logs_dir = game_dir / game_name / f"logs_{nth_player}"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / "frames.csv").write_text(frames)
+    (logs_dir / "unit_events.csv").write_text("frame,unit,event,target_id\n4,1,Created,\n")
+    return logs_dir
+
+
+def test_convert_csv_types(tmp_path):
+    csv_file = _write_game(tmp_path, "game") / "frames.csv"
+    parquet_file = convert_csv(str(csv_file), block_size=64)
+    assert parquet_file == str(tmp_path / "game" / "logs_0" / "frames.parquet")
+
+    table = pyarrow.parquet.read_table(parquet_file)
+    schema = table.schema
+    assert schema.field("frame").type == pyarrow.int32()
+    assert schema.field("x").type == pyarrow.int16()
+    assert schema.field("player").type == pyarrow.int8()
+    assert pyarrow.types.is_dictionary(schema.field("name").type)
+    # columns without a fixed type are kept as strings
+    assert schema.field("order").type == pyarrow.string()
+    # the truncated last row is skipped
+    assert table.column("frame").to_pylist() == [0, 0, 8]
+    assert table.column("order").to_pylist() == ["Move", "", "Move"]
+    # no temporary file is left behind
+    assert sorted(os.listdir(tmp_path / "game" / "logs_0")) == ["frames.csv", "frames.parquet", "unit_events.csv"]
+
+
+def test_convert_empty_csv(tmp_path):
+    csv_file = tmp_path / "frames.csv"
+    csv_file.write_text("")
+    assert convert_csv(str(csv_file)) is None
+    assert not os.path.exists(parquet_file_of(str(csv_file)))
+
+
+def test_convert_game_skips_converted(tmp_path):
+    logs_dir = _write_game(tmp_path, "game")
+    parquet_files = convert_game(str(tmp_path), "game")
+    assert sorted(os.path.basename(file) for file in parquet_files) == ["frames.parquet", "unit_events.parquet"]
+
+    mtime = os.path.getmtime(logs_dir / "frames.parquet")
+    convert_game(str(tmp_path), "game", remove_csv=True)
+    assert os.path.getmtime(logs_dir / "frames.parquet") == mtime
+    assert sorted(os.listdir(logs_dir)) == ["frames.parquet", "unit_events.parquet"]
+
+
+def test_convert_game_dir_counts_failures(tmp_path):
+    _write_game(tmp_path, "good")
+    bad_dir = _write_game(tmp_path, "bad")
+    # a value which does not fit the int16 column
+    (bad_dir / "frames.csv").write_text("frame,x\n0,100000\n")
+    (tmp_path / ".sessions").mkdir()
+
+    assert convert_game_dir(str(tmp_path), jobs=2) == 1
+    assert (tmp_path / "good" / "logs_0" / "frames.parquet").exists()
+    assert not (bad_dir / "frames.parquet").exists()
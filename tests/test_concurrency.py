@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+
+import pytest
+
+from observer.concurrency import OUTCOME_OK, OUTCOME_OOM, ConcurrencyController, HostSample, HostSampler
+from observer.error import ObserverException
+
+GB = 1 << 30
+
+
+def _controller(limit, max_jobs=8, min_jobs=1):
+    return ConcurrencyController(max_jobs, min_jobs=min_jobs, start_jobs=limit, sample_containers=False)
+
+
+def _adjust(controller, cpu_busy=0.5, mem_available=8 * GB, saturated=True):
+    sample = HostSample(cpu_busy, 16 * GB, mem_available, time.time())
+    controller._samples = [sample, sample]
+    controller._saturated_samples = 2 if saturated else 0
+    controller._adjust()
+    return controller.limit
+
+
+def test_limits_are_checked():
+    with pytest.raises(ObserverException):
+        ConcurrencyController(2, min_jobs=3)
+    assert _controller(20).limit == 8
+    assert _controller(1, min_jobs=2).limit == 2
+
+
+def test_acquire_waits_for_release():
+    controller = _controller(2)
+    controller.acquire()
+    controller.acquire()
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (controller.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.2)
+
+    controller.release(OUTCOME_OK)
+    assert acquired.wait(5)
+    thread.join()
+    assert controller.summary()["max_running"] == 2
+
+
+def test_grows_while_saturated_with_cpu_to_spare():
+    controller = _controller(4)
+    assert _adjust(controller) == 5
+    # not all the allowed games are running
+    assert _adjust(controller, saturated=False) == 5
+    assert _adjust(controller, cpu_busy=0.9) == 5
+
+
+def test_shrinks_under_host_pressure():
+    controller = _controller(4)
+    assert _adjust(controller, cpu_busy=0.99) == 3
+    assert _adjust(controller, mem_available=GB) == 2
+    assert _adjust(controller, mem_available=GB) == 1
+    assert _adjust(controller, mem_available=GB) == 1
+    assert [entry["concurrency"] for entry in controller.history] == [4, 3, 2, 1]
+
+
+def test_oom_lowers_ceiling():
+    controller = _controller(8)
+    for _ in range(8):
+        controller.acquire()
+    controller.release(OUTCOME_OOM)
+    assert _adjust(controller) == 6
+    # the limit does not grow back over the ceiling
+    assert _adjust(controller) == 6
+
+
+def test_throughput_drop_lowers_limit():
+    controller = _controller(4)
+    controller._games_at = {3: 30, 4: 8}
+    controller._time_at = {3: 3600.0, 4: 3600.0}
+    controller._limit_since = time.time()
+    assert controller.games_per_hour(3) == 30.0
+    assert controller.games_per_hour(4) == pytest.approx(8.0, rel=0.01)
+
+    assert _adjust(controller) == 3
+    assert _adjust(controller) == 3
+    # too few games have finished to compare
+    assert controller.games_per_hour(2) is None
+
+
+def test_host_sampler():
+    sample = HostSampler().sample()
+    assert 0.0 <= sample.cpu_busy <= 1.0
+    assert sample.mem_available_ratio is None or 0.0 <= sample.mem_available_ratio <= 1.0
+
+
+def test_write_summary(tmp_path):
+    controller = _controller(2)
+    controller.acquire()
+    controller.release(OUTCOME_OK, num_games=3)
+    controller.close()
+
+    summary_file = tmp_path / "concurrency.json"
+    controller.write_summary(str(summary_file))
+    summary = json.loads(summary_file.read_text())
+    assert summary["concurrency"] == 2
+    assert list(summary["games_per_hour"]) == ["2"]
+    assert [entry["reason"] for entry in summary["history"]] == ["start", "stop"]
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pytest
+
+from observer.dataset import COLUMN_CACHE_DIR, NULL_VALUE, Dataset, DatasetException, GameTable
+
+FRAMES_CSV = (
+    "frame,ID,player,name,x,y\n"
+    "0,1,0,Protoss_Probe,100,200\n"
+    "0,2,1,Zerg_Drone,300,400\n"
+    "8,1,0,Protoss_Probe,104,204\n"
+    "8,2,1,Zerg_Drone,,404\n"
+    "16,1,0,Protoss_Nexus,108,208\n"
+)
+
+
+def _write_game(game_dir, game_name, frames=FRAMES_CSV):
+    logs_dir = game_dir / game_name / "logs_0"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / "frames.csv").write_text(frames)
+    return logs_dir
+
+
+def test_select_from_csv(tmp_path):
+    logs_dir = _write_game(tmp_path, "game")
+    table = GameTable(str(logs_dir), "frames")
+
+    assert len(table) == 5
+    assert table.columns == ["frame", "ID", "player", "name", "x", "y"]
+    assert table.column("x").dtype == np.int16
+
+    selected = table.select(frame_range=(8, None), players=[1], columns=["frame", "name", "x"])
+    assert selected["frame"].tolist() == [8]
+    assert selected["name"].tolist() == ["Zerg_Drone"]
+    assert selected["x"].tolist() == [NULL_VALUE]
+
+
+def test_select_frame_range(tmp_path):
+    table = GameTable(str(_write_game(tmp_path, "game")), "frames")
+    assert table.select(frame_range=(None, 8))["ID"].tolist() == [1, 2]
+    assert table.select(frame_range=(8, 16))["ID"].tolist() == [1, 2]
+    assert table.select(frame_range=(4, 5))["ID"].tolist() == []
+    assert table.select(frame_range=(16, 8))["ID"].tolist() == []
+
+
+def test_select_unsorted_frames(tmp_path):
+    frames = "frame,ID\n8,1\n0,2\n16,3\n0,4\n"
+    table = GameTable(str(_write_game(tmp_path, "game", frames)), "frames")
+    assert table.meta["is_frame_sorted"] is False
+    assert table.select(frame_range=(0, 8))["ID"].tolist() == [2, 4]
+
+
+def test_select_codes(tmp_path):
+    table = GameTable(str(_write_game(tmp_path, "game")), "frames")
+    codes = table.select(columns=["name"], decode=False)["name"]
+    assert codes.dtype == np.int32
+    assert table.decode("name", codes).tolist() == table.select(columns=["name"])["name"].tolist()
+    assert table.categories("name").tolist() == ["Protoss_Probe", "Zerg_Drone", "Protoss_Nexus"]
+    with pytest.raises(DatasetException):
+        table.column("missing")
+
+
+def test_column_cache_is_reused_and_rebuilt(tmp_path):
+    logs_dir = _write_game(tmp_path, "game")
+    GameTable(str(logs_dir), "frames").meta
+    meta_file = logs_dir / COLUMN_CACHE_DIR / "frames" / "meta.json"
+    mtime = os.path.getmtime(meta_file)
+
+    assert len(GameTable(str(logs_dir), "frames")) == 5
+    assert os.path.getmtime(meta_file) == mtime
+
+    # the cache is out of date once the source changes
+    (logs_dir / "frames.csv").write_text("frame,ID\n0,1\n")
+    assert len(GameTable(str(logs_dir), "frames")) == 1
+
+
+def test_select_from_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    from observer.columnar import convert_game
+
+    logs_dir = _write_game(tmp_path, "game")
+    csv_selected = GameTable(str(logs_dir), "frames").select(players=[0])
+    convert_game(str(tmp_path), "game", remove_csv=True)
+
+    table = GameTable(str(logs_dir), "frames")
+    assert table.source_file.endswith("frames.parquet")
+    selected = table.select(players=[0])
+    assert selected.keys() == csv_selected.keys()
+    for name, values in selected.items():
+        assert values.tolist() == csv_selected[name].tolist()
+
+
+def test_empty_table(tmp_path):
+    table = GameTable(str(_write_game(tmp_path, "game", "frame,ID\n")), "frames")
+    assert len(table) == 0
+    assert table.select(frame_range=(0, 10))["ID"].tolist() == []
+
+
+def test_dataset_iterates_games(tmp_path):
+    _write_game(tmp_path, "b")
+    _write_game(tmp_path, "a", "frame,ID,player\n0,7,0\n")
+    (tmp_path / "no_data" / "logs_0").mkdir(parents=True)
+    (tmp_path / ".sessions" / "logs_0").mkdir(parents=True)
+
+    dataset = Dataset(str(tmp_path))
+    assert dataset.game_names == ["a", "b", "no_data"]
+    assert len(dataset) == 3
+    # games without data are skipped
+    assert [(name, frames["ID"].tolist()) for name, frames in dataset.iter_frames(frame_range=(0, 1))] == [
+        ("a", [7]), ("b", [1, 2])
+    ]
+    assert list(dataset.iter_unit_events()) == []
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import docker.errors
+import pytest
+
+from observer import docker_hosts
+from observer.docker_hosts import DockerHost, HostPool, parse_docker_hosts
+from observer.error import DockerException, HostDroppedException
+from observer.fake_docker import FakeDockerClient
+
+
+class FakeDaemon(FakeDockerClient):
+    """
+    Daemon which stops responding while it is down.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.is_down = False
+
+    def ping(self):
+        if self.is_down:
+            raise docker.errors.APIError("connection refused")
+        return super().ping()
+
+
+def _host(name, capacity=1):
+    host = DockerHost(name, f"tcp://{name}:2375", capacity)
+    host._client = FakeDaemon()
+    return host
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def fast_health_checks(monkeypatch):
+    monkeypatch.setattr(docker_hosts, "HEALTH_CHECK_INTERVAL", 0.05)
+
+
+def test_parse_docker_hosts(tmp_path):
+    hosts = parse_docker_hosts("local=4, tcp://10.0.0.2:2375=8,unix:///var/run/docker.sock")
+    assert [(host.name, host.base_url, host.capacity) for host in hosts] == [
+        ("local", None, 4), ("tcp://10.0.0.2:2375", "tcp://10.0.0.2:2375", 8),
+        ("unix:///var/run/docker.sock", "unix:///var/run/docker.sock", 1),
+    ]
+    assert [host.is_local for host in hosts] == [True, False, True]
+
+    hosts_file = tmp_path / "hosts"
+    hosts_file.write_text("# rack 1\nssh://me@box3=8\n\nlocal\n")
+    assert [(host.name, host.capacity) for host in parse_docker_hosts(str(hosts_file))] == [
+        ("ssh://me@box3", 8), ("local", 1)
+    ]
+
+
+@pytest.mark.parametrize("spec", ["", "local,local=2", "local=0"])
+def test_parse_invalid_docker_hosts(spec):
+    with pytest.raises(DockerException):
+        parse_docker_hosts(spec)
+
+
+def test_dispatch_to_least_loaded():
+    small, large = _host("small", 1), _host("large", 2)
+    hosts = HostPool([small, large])
+    hosts.start()
+    try:
+        acquired = [hosts.acquire() for _ in range(3)]
+        assert sorted(host.name for host in acquired) == ["large", "large", "small"]
+        assert hosts.capacity == 3
+
+        released = threading.Event()
+        thread = threading.Thread(target=lambda: (hosts.acquire(), released.set()))
+        thread.start()
+        assert not released.wait(0.2)
+        hosts.release(small)
+        assert released.wait(5)
+        thread.join()
+        assert small.in_use == 1
+    finally:
+        hosts.close()
+
+
+def test_hosts_which_cannot_join():
+    down, failing, up = _host("down"), _host("failing"), _host("up")
+    down.client.is_down = True
+
+    def on_join(host):
+        if host is failing:
+            raise DockerException("no game image")
+
+    hosts = HostPool([down, failing, up], on_join)
+    hosts.start()
+    hosts.close()
+    assert [host.is_alive for host in hosts.hosts] == [False, False, True]
+    assert failing.error == "no game image"
+
+    up.client.is_down = True
+    with pytest.raises(DockerException):
+        HostPool([down, up]).start()
+
+
+def test_dropped_host_rejoins(fast_health_checks):
+    first, second = _host("first"), _host("second")
+    hosts = HostPool([first, second])
+    hosts.start()
+    try:
+        first.client.is_down = True
+        assert not hosts.check(first)
+        with pytest.raises(HostDroppedException):
+            hosts.ensure_alive(first)
+        # games are dispatched to the other host meanwhile
+        assert hosts.acquire() is second
+
+        first.client.is_down = False
+        assert _wait_until(lambda: first.is_alive)
+        assert hosts.acquire() is first
+    finally:
+        hosts.close()
+
+
+def test_all_hosts_dropped(fast_health_checks):
+    host = _host("only")
+    hosts = HostPool([host])
+    hosts.start()
+    host.client.is_down = True
+    assert _wait_until(lambda: not host.is_alive)
+
+    hosts.close()
+    hosts._health_thread.join(5)
+    with pytest.raises(DockerException):
+        hosts.acquire()
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from observer import env_cache
+from observer.env_cache import cached_check, clear_env_cache, invalidate_check
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    cache_file = tmp_path / "env_cache.json"
+    monkeypatch.setattr(env_cache, "SC_ENV_CACHE", str(cache_file))
+    return cache_file
+
+
+class Check:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_check_is_cached(cache_file):
+    check = Check("192.168.99.100")
+    assert cached_check("machine_ip", check) == "192.168.99.100"
+    assert cached_check("machine_ip", check) == "192.168.99.100"
+    assert check.calls == 1
+    assert json.loads(cache_file.read_text())["machine_ip"]["value"] == "192.168.99.100"
+
+
+def test_check_expires(cache_file):
+    check = Check(True)
+    cached_check("image", check, ttl=-1)
+    cached_check("image", check, ttl=-1)
+    assert check.calls == 2
+
+
+def test_rejected_result_is_not_cached(cache_file):
+    check = Check(False)
+    assert cached_check("image", check, should_cache=bool) is False
+    assert cached_check("image", check, should_cache=bool) is False
+    assert check.calls == 2
+    assert not cache_file.exists()
+
+
+def test_invalidate_check(cache_file):
+    network, image = Check(True), Check(True)
+    cached_check("network", network)
+    cached_check("image", image)
+
+    invalidate_check("network")
+    invalidate_check("missing")
+    cached_check("network", network)
+    cached_check("image", image)
+    assert network.calls == 2
+    assert image.calls == 1
+
+
+def test_unreadable_cache(cache_file):
+    cache_file.write_text("{not json")
+    check = Check(1)
+    assert cached_check("key", check) == 1
+    assert json.loads(cache_file.read_text())["key"]["value"] == 1
+
+    clear_env_cache()
+    assert not cache_file.exists()
+
+
+def test_cache_dir_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(env_cache, "SC_ENV_CACHE", str(tmp_path / "missing" / "env_cache.json"))
+    check = Check(1)
+    assert cached_check("key", check) == 1
+    assert cached_check("key", check) == 1
+    assert check.calls == 2
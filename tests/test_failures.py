@@ -0,0 +1,52 @@
+from observer.error import RealtimeOutedException, StalledException
+from observer.failures import (
+    CAUSE_BOT_SETUP, CAUSE_CORRUPT_REPLAY, CAUSE_GAME_CRASH, CAUSE_REALTIME_OUT, CAUSE_STALLED,
+    CAUSE_WINE_START, classify_failure
+)
+
+
+def _write_log(tmp_path, path: str, text: str) -> None:
+    log_file = tmp_path / "game" / path
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    log_file.write_text(text)
+
+
+def test_classify_nothing(tmp_path):
+    _write_log(tmp_path, "logs_0/game.log", "Game finished.\n")
+    assert classify_failure(str(tmp_path), "game") is None
+
+
+def test_classify_deterministic_wins(tmp_path):
+    _write_log(tmp_path, "logs_0/game.log", "StarCraft has not started yet\nGame realtime outed!\n")
+    _write_log(tmp_path, "logs_0/bot.log", "Bot not found in /bot\n")
+    failure = classify_failure(str(tmp_path), "game")
+    assert failure.cause == CAUSE_BOT_SETUP
+    assert not failure.is_transient
+
+
+def test_classify_priority_in_line(tmp_path):
+    _write_log(tmp_path, "logs_0/game.log", "wine client error: unable to open replay\n")
+    assert classify_failure(str(tmp_path), "game").cause == CAUSE_CORRUPT_REPLAY
+
+
+def test_classify_transient_priority(tmp_path):
+    _write_log(tmp_path, "logs_0/game.log", "X server is not running yet\nGame realtime outed!\n")
+    failure = classify_failure(str(tmp_path), "game")
+    assert failure.cause == CAUSE_REALTIME_OUT
+    assert failure.is_transient
+
+
+def test_classify_wine_start(tmp_path):
+    _write_log(tmp_path, "logs_1/game.log", "X server is not running yet\n")
+    assert classify_failure(str(tmp_path), "game").cause == CAUSE_WINE_START
+
+
+def test_classify_exception(tmp_path):
+    _write_log(tmp_path, "logs_0/bot.log", "Bot not found in /bot\n")
+    assert classify_failure(str(tmp_path), "game", StalledException("stalled")).cause == CAUSE_STALLED
+    assert classify_failure(str(tmp_path), "game", RealtimeOutedException()).cause == CAUSE_REALTIME_OUT
+
+
+def test_classify_crash_reports(tmp_path):
+    _write_log(tmp_path, "crashes_0/crash.txt", "access violation\n")
+    assert classify_failure(str(tmp_path), "game").cause == CAUSE_GAME_CRASH
@@ -0,0 +1,114 @@
+import os
+import threading
+
+import pytest
+
+from observer.job_queue import (
+    JOB_EXTRACT, JOB_MATCH, STATUS_CANCELLED, STATUS_DONE, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING,
+    JobException, JobQueue
+)
+
+
+@pytest.fixture
+def replay(tmp_path):
+    replay_file = tmp_path / "game.rep"
+    replay_file.write_bytes(b"replay")
+    return str(replay_file)
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "server.sqlite"))
+    yield job_queue
+    job_queue.close()
+
+
+def test_invalid_jobs(tmp_path, job_queue):
+    with pytest.raises(JobException):
+        job_queue.submit("play", {})
+    with pytest.raises(JobException):
+        job_queue.submit(JOB_EXTRACT, dict(replay=str(tmp_path / "missing.rep")))
+    with pytest.raises(JobException):
+        job_queue.submit(JOB_MATCH, dict(bots="Extractor"))
+    assert job_queue.jobs() == []
+
+
+def test_jobs_are_taken_in_order(replay, job_queue):
+    first = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    second = job_queue.submit(JOB_MATCH, dict(bots=["a", "b"], map="Benzene"))
+    assert first["status"] == STATUS_QUEUED
+    assert second["params"] == dict(bots=["a", "b"], map="Benzene")
+
+    job = job_queue.take()
+    assert (job["id"], job["status"]) == (first["id"], STATUS_RUNNING)
+    job_queue.finish(job["id"], result=dict(job_time=1.5))
+    job = job_queue.take()
+    assert job["id"] == second["id"]
+    job_queue.finish(job["id"], error="cannot start the game")
+    assert job_queue.take() is None
+
+    assert job_queue.job(first["id"])["result"] == dict(job_time=1.5)
+    assert job_queue.job(second["id"])["error"] == "cannot start the game"
+    assert job_queue.counts() == {STATUS_DONE: 1, STATUS_FAILED: 1}
+    assert [job["id"] for job in job_queue.jobs(STATUS_FAILED)] == [second["id"]]
+
+
+def test_only_queued_jobs_are_cancelled(replay, job_queue):
+    first = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    second = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    job_queue.take()
+
+    with pytest.raises(JobException):
+        job_queue.cancel(first["id"])
+    assert job_queue.cancel(second["id"])["status"] == STATUS_CANCELLED
+    with pytest.raises(JobException):
+        job_queue.cancel(1000)
+    assert job_queue.take() is None
+
+
+def test_running_jobs_are_queued_again_on_restart(tmp_path, replay):
+    db_file = str(tmp_path / "server.sqlite")
+    job_queue = JobQueue(db_file)
+    job = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    job_queue.take()
+    job_queue.close()
+
+    job_queue = JobQueue(db_file)
+    assert job_queue.job(job["id"])["status"] == STATUS_QUEUED
+    assert job_queue.take()["id"] == job["id"]
+    job_queue.close()
+
+
+def test_watched_files_are_queued_once(replay, job_queue):
+    assert job_queue.submit_watched(JOB_EXTRACT, replay)["source"] == "watch"
+    assert job_queue.submit_watched(JOB_EXTRACT, replay) is None
+
+    # a new version of the file is queued again
+    stat = os.stat(replay)
+    os.utime(replay, (stat.st_atime, stat.st_mtime + 10))
+    assert job_queue.submit_watched(JOB_EXTRACT, replay) is not None
+    assert len(job_queue.jobs()) == 2
+
+
+def test_wait_for_job(replay, job_queue):
+    assert job_queue.wait_for_job(timeout=0.1) is None
+
+    taken = []
+    thread = threading.Thread(target=lambda: taken.append(job_queue.wait_for_job(timeout=10)))
+    thread.start()
+    job = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    thread.join(10)
+    assert [job["id"] for job in taken] == [job["id"]]
+
+
+def test_wait_changes(replay, job_queue):
+    seq = job_queue.seq
+    assert job_queue.wait_changes(seq, timeout=0.1) == (seq, [])
+
+    job = job_queue.submit(JOB_EXTRACT, dict(replay=replay))
+    job_queue.take()
+    job_queue.set_game_name(job["id"], "job00000001_game")
+    seq, changes = job_queue.wait_changes(seq, timeout=1)
+    assert seq == job_queue.seq
+    assert [change["status"] for change in changes] == [STATUS_QUEUED, STATUS_RUNNING, STATUS_RUNNING]
+    assert changes[-1]["game_name"] == "job00000001_game"
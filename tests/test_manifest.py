@@ -0,0 +1,54 @@
+import pytest
+
+from observer.manifest import STATUS_DONE, STATUS_FAILED, STATUS_QUARANTINED, Manifest
+
+
+@pytest.fixture
+def replay_file(tmp_path):
+    replay_file = tmp_path / "game.rep"
+    replay_file.write_bytes(b"replay")
+    return str(replay_file)
+
+
+def test_manifest(tmp_path, replay_file):
+    manifest = Manifest(str(tmp_path / "games"), "1.0", "4.4.0")
+    assert manifest.status(replay_file) is None
+
+    manifest.job_started(replay_file, "game")
+    manifest.job_finished(replay_file, "game", "crashed")
+    assert manifest.status(replay_file) == STATUS_FAILED
+
+    manifest.job_started(replay_file, "game")
+    manifest.job_finished(replay_file, "game")
+    assert manifest.is_done(replay_file)
+    assert manifest.attempts(replay_file) == 2
+    manifest.close()
+
+    # extracted by another version of the bot
+    manifest = Manifest(str(tmp_path / "games"), "2.0", "4.4.0")
+    assert not manifest.is_done(replay_file)
+    manifest.close()
+
+
+def test_manifest_quarantine(tmp_path, replay_file):
+    manifest = Manifest(str(tmp_path / "games"), "1.0", "4.4.0")
+    manifest.job_started(replay_file, "game")
+    manifest.job_quarantined(replay_file, "game", "corrupt_replay")
+    assert manifest.status(replay_file) == STATUS_QUARANTINED
+    manifest.close()
+
+    # whatever the versions
+    manifest = Manifest(str(tmp_path / "games"), "2.0", "4.4.0")
+    assert manifest.is_quarantined(replay_file)
+    manifest.close()
+
+
+def test_manifest_same_content(tmp_path, replay_file):
+    manifest = Manifest(str(tmp_path / "games"), "1.0", "4.4.0")
+    manifest.job_started(replay_file, "game")
+    manifest.job_finished(replay_file, "game")
+
+    copy = tmp_path / "copy.rep"
+    copy.write_bytes(b"replay")
+    assert manifest.status(str(copy)) == STATUS_DONE
+    manifest.close()
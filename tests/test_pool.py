@@ -0,0 +1,177 @@
+import io
+import tarfile
+
+import pytest
+
+from observer import bot_image, docker_utils, pool
+from observer.error import ContainerException, RealtimeOutedException
+from observer.fake_docker import ExecResult, FakeContainer, FakeDockerClient
+from observer.game_type import GameType
+from observer.player import BotPlayer
+from observer.pool import ContainerPool
+
+
+class Jobs:
+    """
+    Outcome of play_pool_job.sh in the fake containers.
+    """
+
+    def __init__(self):
+        self.exit_code = 0
+        self.hang = False
+        self.played = []  # (container name, job environment)
+        self.archives = []
+
+    def exec_run(self, container, cmd, environment=None, **kwargs):
+        if cmd != ["/app/play_pool_job.sh"]:
+            return ExecResult(0 if container.status == "running" else 1, b"")
+        self.played.append((container.name, environment))
+        if self.hang:
+            # until the container is killed
+            container._exited.wait(10)
+            return ExecResult(137, b"")
+        return ExecResult(self.exit_code, b"")
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    jobs = Jobs()
+    monkeypatch.setattr(FakeContainer, "exec_run", lambda container, cmd, **kwargs:
+                        jobs.exec_run(container, cmd, **kwargs))
+    monkeypatch.setattr(FakeContainer, "put_archive", lambda container, path, data:
+                        jobs.archives.append(data) or True)
+    return jobs
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeDockerClient(duration=lambda name: 1000)
+    monkeypatch.setattr(bot_image, "_found_images", {})
+    docker_utils.set_docker_client(client)
+    yield client
+    docker_utils.set_docker_client(None)
+
+
+@pytest.fixture
+def make_pool(tmp_path, client, jobs):
+    bot_dir = tmp_path / "Extractor"
+    (bot_dir / "AI").mkdir(parents=True)
+    player = BotPlayer.from_cache(str(bot_dir), dict(name="Extractor", race="Protoss", botType="AI_MODULE"),
+                                  str(bot_dir / "AI" / "Extractor.dll"), "4.4.0")
+    launch_params = dict(
+        game_dir=str(tmp_path / "games"), map_dir=str(tmp_path / "maps"), docker_image="starcraft:game",
+        headless=False, lean=False, vnc_base_port=5900, game_type=GameType.FREE_FOR_ALL, game_speed=0,
+        seed_override=-1, allow_input=False, timeout_at_frame=None, timeout=None, nano_cpus=None, mem_limit=None,
+    )
+    (tmp_path / "replay.rep").write_bytes(b"replay")
+    pools = []
+
+    def make_pool(size=1, max_jobs=10, **params):
+        container_pool = ContainerPool(player, dict(launch_params, **params), size=size, max_jobs=max_jobs)
+        container_pool.start()
+        pools.append(container_pool)
+        return container_pool
+
+    yield make_pool
+    for container_pool in pools:
+        container_pool.close()
+
+
+def _names(client, container_pool):
+    docker_utils._reaper.wait(container_pool.pool_name, timeout=5)
+    return sorted(container.name for container in client.all_containers())
+
+
+def test_start(client, make_pool):
+    container_pool = make_pool(size=3)
+    names = _names(client, container_pool)
+    assert len(names) == 3
+    assert all(container.labels[docker_utils.GAME_CONTAINER_LABEL] == container_pool.pool_name
+               for container in client.all_containers())
+    container_pool.close()
+    assert _names(client, container_pool) == []
+
+
+def test_run_replay(tmp_path, client, make_pool, jobs):
+    container_pool = make_pool()
+    container_pool.run_replay("game", str(tmp_path / "replay.rep"))
+
+    assert (tmp_path / "games" / "game" / "logs_0").is_dir()
+    (_, env), = jobs.played
+    assert env["INPUT_REPLAY"] == "/app/sc/replay/game.rep"
+    assert env["TM_LOG_RESULTS"] == "../games/game/logs_0/scores.json"
+    with tarfile.open(fileobj=io.BytesIO(jobs.archives[0])) as tar:
+        assert tar.getnames() == ["replay", "replay/game.rep"]
+
+
+def test_recycle_after_max_jobs(tmp_path, client, make_pool, jobs):
+    container_pool = make_pool(max_jobs=2)
+    first = _names(client, container_pool)
+    for game_name in ("a", "b", "c"):
+        container_pool.run_replay(game_name, str(tmp_path / "replay.rep"))
+
+    second = _names(client, container_pool)
+    assert second != first
+    assert [name for name, _ in jobs.played] == first * 2 + second
+
+
+def test_failed_job_recycles(tmp_path, client, make_pool, jobs):
+    container_pool = make_pool()
+    first = _names(client, container_pool)
+
+    jobs.exit_code = 1
+    with pytest.raises(ContainerException):
+        container_pool.run_replay("a", str(tmp_path / "replay.rep"))
+    second = _names(client, container_pool)
+    assert second != first
+
+    jobs.exit_code = docker_utils.EXIT_CODE_REALTIME_OUTED
+    with pytest.raises(RealtimeOutedException):
+        container_pool.run_replay("b", str(tmp_path / "replay.rep"))
+    assert _names(client, container_pool) != second
+
+
+def test_unhealthy_container_is_replaced(tmp_path, client, make_pool, jobs):
+    container_pool = make_pool()
+    container, = client.all_containers()
+    container.kill()
+
+    container_pool.run_replay("a", str(tmp_path / "replay.rep"))
+    (name, _), = jobs.played
+    assert name != container.name
+    assert _names(client, container_pool) == [name]
+
+
+def test_hanging_job_is_killed(tmp_path, client, make_pool, jobs, monkeypatch):
+    monkeypatch.setattr(pool, "JOB_TIMEOUT_MARGIN", 0.2)
+    container_pool = make_pool(timeout=0.1)
+    container, = client.all_containers()
+
+    jobs.hang = True
+    with pytest.raises(ContainerException):
+        container_pool.run_replay("a", str(tmp_path / "replay.rep"))
+    assert container.status == "exited"
+    assert container.name not in _names(client, container_pool)
+
+    jobs.hang = False
+    container_pool.run_replay("b", str(tmp_path / "replay.rep"))
+
+
+def test_run_session(tmp_path, client, make_pool, jobs):
+    container_pool = make_pool()
+    # the job has written the results of the first game only
+    scores_dir = tmp_path / "games" / "a" / "logs_0"
+    scores_dir.mkdir(parents=True)
+    (scores_dir / "scores.json").write_text("{}")
+
+    finished = container_pool.run_session([("a", str(tmp_path / "replay.rep")), ("b", str(tmp_path / "replay.rep"))])
+    assert finished == [True, False]
+
+    (_, env), = jobs.played
+    assert env["SESSION_GAMES"] == "a b"
+    assert env["INPUT_REPLAY"] == "/app/sc/replay/session/*.rep"
+    assert env["SESSION_OUTPUT_DIR"].endswith("/output")
+    with tarfile.open(fileobj=io.BytesIO(jobs.archives[0])) as tar:
+        assert sorted(tar.getnames()) == [
+            "replay", "replay/session", "replay/session/00000_a.rep", "replay/session/00001_b.rep"
+        ]
@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+from observer.replay import (
+    HEADER_SIZE, PLAYER_STRUCT_SIZE, PLAYER_TYPE_COMPUTER, PLAYER_TYPE_HUMAN, REPLAY_ID_LEGACY,
+    ReplayException, ReplayRace, explode, read_header
+)
+
+
+def test_explode():
+    # test vector of blast.c, the reference implementation of PKWare DCL explode
+    assert explode(bytes([0x00, 0x04, 0x82, 0x24, 0x25, 0x8f, 0x80, 0x7f])) == b"AIAIAIAIAIAIA"
+
+
+def test_explode_truncated():
+    with pytest.raises(ReplayException):
+        explode(bytes([0x00, 0x04, 0x82, 0x24]))
+
+
+def _section(data: bytes) -> bytes:
+    # checksum, one chunk, stored as is
+    return struct.pack("<iii", 0, 1, len(data)) + data
+
+
+def _player(slot: int, player_type: int, race: int, team: int, name: bytes) -> bytes:
+    player = struct.pack("<HxxBxxxBBB", slot, slot, player_type, race, team) + name
+    return player.ljust(PLAYER_STRUCT_SIZE, b"\0")
+
+
+def _header() -> bytes:
+    header = bytearray(HEADER_SIZE)
+    struct.pack_into("<BI", header, 0x00, 1, 24000)
+    struct.pack_into("<I", header, 0x08, 1262304000)
+    header[0x18:0x18 + 5] = b"title"
+    struct.pack_into("<HH", header, 0x34, 128, 96)
+    header[0x48:0x48 + 4] = b"host"
+    header[0x61:0x61 + 9] = b"\x03Fighting"
+    players = [_player(0, PLAYER_TYPE_HUMAN, 1, 1, b"Terran"),
+               _player(1, PLAYER_TYPE_COMPUTER, 0, 2, b"Zerg"),
+               _player(2, 0, 2, 0, b"Closed")]
+    for i, player in enumerate(players):
+        offset = 0xa1 + i * PLAYER_STRUCT_SIZE
+        header[offset:offset + PLAYER_STRUCT_SIZE] = player
+    return bytes(header)
+
+
+def test_read_header(tmp_path):
+    replay_file = tmp_path / "game.rep"
+    replay_file.write_bytes(_section(REPLAY_ID_LEGACY) + _section(_header()) + b"rest of the replay")
+
+    header = read_header(str(replay_file))
+    assert header.engine_name == "BroodWar"
+    assert header.frames == 24000
+    assert header.title == "title"
+    assert header.host == "host"
+    # the color code is stripped
+    assert header.map_name == "Fighting"
+    assert (header.map_width, header.map_height) == (128, 96)
+    assert [(p.name, p.race) for p in header.players] == [("Terran", ReplayRace.TERRAN), ("Zerg", ReplayRace.ZERG)]
+    assert header.players[1].is_computer
+    assert header.matchup == "TvZ"
+    assert not header.is_modern
+
+
+def test_read_header_not_a_replay(tmp_path):
+    replay_file = tmp_path / "game.rep"
+    replay_file.write_bytes(_section(b"xxxx") + _section(_header()))
+    with pytest.raises(ReplayException):
+        read_header(str(replay_file))
@@ -0,0 +1,83 @@
+from observer.resource_sampler import RESOURCES_FILE, SERIES_COLUMNS, ResourceSampler, parse_stats
+
+
+def _stats(total_usage, system_usage, mem_usage, inactive_file=0, blk_read=0, net_rx=0):
+    return {
+        "cpu_stats": {"cpu_usage": {"total_usage": total_usage}, "system_cpu_usage": system_usage,
+                      "online_cpus": 4},
+        "precpu_stats": {"cpu_usage": {"total_usage": 0}, "system_cpu_usage": 0},
+        "memory_stats": {"usage": mem_usage, "stats": {"inactive_file": inactive_file}},
+        "blkio_stats": {"io_service_bytes_recursive": [
+            {"op": "Read", "value": blk_read}, {"op": "Write", "value": 10},
+        ]},
+        "networks": {"eth0": {"rx_bytes": net_rx, "tx_bytes": 5}, "eth1": {"rx_bytes": 1, "tx_bytes": 1}},
+    }
+
+
+class StatsContainer:
+    name = "game_0"
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def stats(self, stream=False, decode=False):
+        return iter(self.samples)
+
+
+def test_parse_stats():
+    row = parse_stats(_stats(50, 400, 1000, inactive_file=200, blk_read=30, net_rx=7), since=0.0)
+    assert row[1:] == [50.0, 800, 30, 10, 8, 6]
+
+
+def test_parse_stats_cgroup_v1_and_stopped():
+    stats = _stats(50, 400, 1000)
+    stats["memory_stats"]["stats"] = {"total_inactive_file": 600}
+    assert parse_stats(stats, since=0.0)[2] == 400
+    # the first sample has no previous cpu usage
+    stats["precpu_stats"] = {}
+    assert parse_stats(stats, since=0.0)[1] is None
+    # stopped containers send empty samples
+    assert parse_stats({"memory_stats": {}}, since=0.0) is None
+
+
+def test_sampler_series_and_summary(tmp_path):
+    samples = [_stats(40, 400, 1000), {"memory_stats": {}}, _stats(80, 400, 3000, blk_read=20)]
+    log_dirs = [tmp_path / "logs_0", tmp_path / "logs_1"]
+    for log_dir in log_dirs:
+        log_dir.mkdir()
+
+    sampler = ResourceSampler(interval=0)
+    sampler.start([StatsContainer(samples), StatsContainer([])], [str(log_dir) for log_dir in log_dirs])
+    for thread in sampler._threads:
+        thread.join(5)
+    sampler.stop()
+
+    summary, empty = sampler.summary()
+    assert empty is None
+    assert summary["samples"] == 2
+    assert summary["cpu_percent_peak"] == 80.0
+    assert summary["cpu_percent_mean"] == 60.0
+    assert summary["mem_bytes_peak"] == 3000
+    assert summary["mem_bytes_mean"] == 2000
+    assert summary["blk_read_bytes"] == 20
+
+    lines = (log_dirs[0] / RESOURCES_FILE).read_text().splitlines()
+    assert lines[0] == ",".join(SERIES_COLUMNS)
+    assert len(lines) == 3
+    assert (log_dirs[1] / RESOURCES_FILE).read_text().splitlines() == [",".join(SERIES_COLUMNS)]
+
+
+def test_sampler_keeps_peak_between_samples(tmp_path):
+    samples = [_stats(40, 400, 1000), _stats(40, 400, 5000, blk_read=50), _stats(40, 400, 2000, blk_read=60)]
+    sampler = ResourceSampler(interval=3600)
+    sampler.start([StatsContainer(samples)], [str(tmp_path)])
+    for thread in sampler._threads:
+        thread.join(5)
+    sampler.stop()
+
+    summary, = sampler.summary()
+    assert summary["samples"] == 1
+    assert summary["mem_bytes_peak"] == 5000
+    assert summary["mem_bytes_mean"] == 1000
+    # i/o totals are those of the last sample
+    assert summary["blk_read_bytes"] == 60
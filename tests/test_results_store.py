@@ -0,0 +1,140 @@
+import json
+import time
+
+import pytest
+
+from observer.results_store import (
+    OUTCOME_CRASH, OUTCOME_FINISHED, OUTCOME_GAMETIME_OUT, OUTCOME_LOSS, OUTCOME_REALTIME_OUT, OUTCOME_WIN,
+    ResultsStore, player_outcomes, score_outcomes
+)
+
+
+def _players(*outcomes):
+    return [dict(bot=f"bot{nth}", race="P", outcome=outcome) for nth, outcome in enumerate(outcomes)]
+
+
+def _write_scores(game_dir, game_name, nth_player, is_crashed=False, timed_out=False):
+    log_dir = game_dir / game_name / f"logs_{nth_player}"
+    log_dir.mkdir(parents=True)
+    (log_dir / "scores.json").write_text(json.dumps(dict(
+        is_winner=False, is_crashed=is_crashed, timed_out=timed_out,
+        building_score=0, kill_score=0, razing_score=0, unit_score=0,
+    )))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"), batch_size=100, flush_interval=3600)
+    yield store
+    store.close()
+
+
+def test_games_are_buffered_until_flush(tmp_path, store):
+    store.add(str(tmp_path), "game", dict(map_name="Benzene"), _players(OUTCOME_WIN, OUTCOME_LOSS))
+    assert store.conn.execute("SELECT COUNT(*) FROM games").fetchone() == (0,)
+
+    store.flush()
+    assert store.conn.execute("SELECT COUNT(*) FROM games").fetchone() == (1,)
+    assert store.conn.execute("SELECT COUNT(*) FROM game_players").fetchone() == (2,)
+
+
+def test_batch_is_written_when_full(tmp_path):
+    with ResultsStore(str(tmp_path / "results.sqlite"), batch_size=2, flush_interval=3600) as store:
+        store.add(str(tmp_path), "a", {}, _players(OUTCOME_FINISHED))
+        store.add(str(tmp_path), "b", {}, _players(OUTCOME_FINISHED))
+        assert store.conn.execute("SELECT COUNT(*) FROM games").fetchone() == (2,)
+
+
+def test_idle_store_is_flushed_by_timer(tmp_path):
+    with ResultsStore(str(tmp_path / "results.sqlite"), flush_interval=0.1) as store:
+        store._last_flush = time.time()
+        store.add(str(tmp_path), "a", {}, _players(OUTCOME_FINISHED))
+        deadline = time.time() + 5
+        while store._pending and time.time() < deadline:
+            time.sleep(0.05)
+        assert not store._pending
+        assert store.conn.execute("SELECT COUNT(*) FROM games").fetchone() == (1,)
+
+
+def test_close_writes_pending_games(tmp_path):
+    db_file = str(tmp_path / "results.sqlite")
+    store = ResultsStore(db_file, flush_interval=3600)
+    store.add(str(tmp_path), "a", {}, _players(OUTCOME_FINISHED))
+    store.close()
+
+    with ResultsStore(db_file) as store:
+        assert [row["game_name"] for row in store.query()] == ["a"]
+
+
+def test_game_played_again_replaces_old(tmp_path, store):
+    store.add(str(tmp_path), "game", {}, _players(OUTCOME_CRASH, OUTCOME_CRASH))
+    store.add(str(tmp_path), "game", {}, _players(OUTCOME_WIN, OUTCOME_LOSS))
+    assert sorted(row["outcome"] for row in store.query()) == [OUTCOME_LOSS, OUTCOME_WIN]
+    assert store.conn.execute("SELECT is_crashed FROM games").fetchall() == [(0,)]
+
+
+def test_score_outcomes(tmp_path):
+    _write_scores(tmp_path, "game", 0)
+    _write_scores(tmp_path, "game", 1, timed_out=True)
+    _write_scores(tmp_path, "game", 2, is_crashed=True)
+    assert score_outcomes(str(tmp_path), "game", 4) == [
+        OUTCOME_FINISHED, OUTCOME_GAMETIME_OUT, OUTCOME_CRASH, OUTCOME_CRASH
+    ]
+
+
+def test_player_outcomes_realtime_out(tmp_path):
+    players = [object(), object()]
+    assert player_outcomes(players, None, True, str(tmp_path), "game") == [OUTCOME_REALTIME_OUT] * 2
+
+
+def test_import_game_dir(tmp_path, store):
+    game_dir = tmp_path / "games"
+    (game_dir / "won").mkdir(parents=True)
+    (game_dir / "won" / "result.json").write_text(json.dumps(dict(
+        bots=["a", "b"], winner="b", loser="a", winner_race="Z", loser_race="T", map_name="Benzene",
+    )))
+    (game_dir / "replay").mkdir()
+    (game_dir / "replay" / "result.json").write_text(json.dumps(dict(bots=["Extractor"])))
+    _write_scores(game_dir, "replay", 0)
+    (game_dir / "broken").mkdir()
+    (game_dir / "broken" / "result.json").write_text("{")
+
+    assert store.import_game_dir(str(game_dir)) == 2
+    outcomes = {(row["game_name"], row["bot"]): (row["race"], row["outcome"]) for row in store.query()}
+    assert outcomes == {
+        ("won", "a"): ("T", OUTCOME_LOSS),
+        ("won", "b"): ("Z", OUTCOME_WIN),
+        ("replay", "Extractor"): (None, OUTCOME_FINISHED),
+    }
+    # games stored before are not imported again
+    assert store.import_game_dir(str(game_dir)) == 0
+
+
+def test_query_filters(tmp_path, store):
+    store.add(str(tmp_path), "old", dict(map_name="(2)Benzene"), _players(OUTCOME_WIN, OUTCOME_LOSS), finished_at=100)
+    store.add(str(tmp_path), "new", dict(map_name="(4)Python"), _players(OUTCOME_LOSS, OUTCOME_WIN), finished_at=200)
+
+    assert [row["game_name"] for row in store.query(bot="bot0")] == ["new", "old"]
+    assert [row["game_name"] for row in store.query(bot="bot0", limit=1)] == ["new"]
+    assert [row["bot"] for row in store.query(map_name="Benzene", outcome=OUTCOME_WIN)] == ["bot0"]
+    assert [row["game_name"] for row in store.query(bot="bot1", since=150)] == ["new"]
+    assert [row["game_name"] for row in store.query(bot="bot1", until=150)] == ["old"]
+
+
+def test_stats(tmp_path, store):
+    store.add(str(tmp_path), "a", dict(map_name="Benzene"), _players(OUTCOME_WIN, OUTCOME_LOSS))
+    store.add(str(tmp_path), "b", dict(map_name="Benzene"), _players(OUTCOME_WIN, OUTCOME_CRASH))
+    store.add(str(tmp_path), "c", dict(map_name="Python"), _players(OUTCOME_REALTIME_OUT, OUTCOME_REALTIME_OUT))
+
+    stats = {row["key"]: row for row in store.stats("bot")}
+    assert stats["bot0"]["games"] == 3
+    assert stats["bot0"]["win_rate"] == 1.0
+    assert stats["bot0"]["timeouts"] == 1
+    assert stats["bot1"]["crash_rate"] == pytest.approx(1 / 3)
+
+    by_map = store.stats("map", bot="bot0")
+    assert [(row["key"], row["games"]) for row in by_map] == [("Benzene", 2), ("Python", 1)]
+    assert by_map[1]["win_rate"] is None
+
+    with pytest.raises(ValueError):
+        store.stats("game_time")
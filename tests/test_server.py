@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+from observer import bot_image, bot_registry, docker_utils, env_cache, player
+from observer.benchmark import _bench_args
+from observer.bot_registry import BotRegistry
+from observer.error import ObserverException
+from observer.fake_docker import FakeDockerClient
+from observer.job_queue import JOB_EXTRACT, STATUS_CANCELLED, STATUS_DONE, JobException, JobQueue
+from observer.results_store import close_results_store
+from observer.server import JobServer, ServerClient, make_http_server, parse_address
+
+BWAPI_DLL = b"BWAPI 4.4.0"
+
+
+@pytest.fixture
+def args(tmp_path, monkeypatch):
+    """
+    Arguments of a server which plays on the fake docker, with an Extractor bot.
+    """
+    monkeypatch.setattr(player, "versions_md5s", {"4.4.0": hashlib.md5(BWAPI_DLL).hexdigest()})
+    monkeypatch.setattr(env_cache, "SC_ENV_CACHE", str(tmp_path / "env_cache.json"))
+    monkeypatch.setattr(bot_image, "_found_images", {})
+
+    bot_dir = tmp_path / "bots"
+    (bot_dir / "Extractor" / "AI").mkdir(parents=True)
+    (bot_dir / "Extractor" / "read").mkdir()
+    (bot_dir / "Extractor" / "BWAPI.dll").write_bytes(BWAPI_DLL)
+    (bot_dir / "Extractor" / "AI" / "Extractor.dll").write_bytes(b"bot")
+    (bot_dir / "Extractor" / "bot.json").write_text(json.dumps(dict(
+        name="Extractor", race="Protoss", botType="AI_MODULE")))
+    monkeypatch.setitem(bot_registry._registries, str(bot_dir),
+                        BotRegistry(str(bot_dir), str(tmp_path / "bot_registry.json")))
+
+    docker_utils.set_docker_client(FakeDockerClient(duration=lambda name: 0.0))
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    yield _bench_args(str(work_dir), str(bot_dir))
+    docker_utils.set_docker_client(None)
+    close_results_store(str(work_dir / "results.sqlite"))
+
+
+@pytest.fixture
+def job_server(tmp_path, args):
+    """
+    Job server whose workers are not started yet.
+    """
+    job_queue = JobQueue(str(tmp_path / "server.sqlite"))
+    job_server = JobServer(args, job_queue, jobs=2)
+    yield job_server
+    job_server.stop()
+    job_queue.close()
+
+
+@pytest.fixture
+def client(tmp_path, job_server):
+    socket_file = str(tmp_path / "observer.sock")
+    http_server = make_http_server(f"unix:{socket_file}", job_server)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    yield ServerClient(f"unix:{socket_file}", timeout=10)
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def replay(tmp_path):
+    replay_file = tmp_path / "game.rep"
+    replay_file.write_bytes(b"replay")
+    return str(replay_file)
+
+
+def test_parse_address():
+    assert parse_address("unix:/tmp/observer.sock") == ("unix", "/tmp/observer.sock")
+    assert parse_address("127.0.0.1:8765") == ("tcp", ("127.0.0.1", 8765))
+    with pytest.raises(ObserverException):
+        parse_address("localhost")
+
+
+def test_jobs_are_played(args, job_server, client, replay):
+    job = client.submit(JOB_EXTRACT, replay=replay)
+    job_server.start()
+
+    states = list(client.follow(job["id"]))
+    assert states[-1]["status"] == STATUS_DONE
+    game_name = states[-1]["result"]["game_name"]
+    assert game_name.startswith(f"job{job['id']:08d}_game_")
+    assert os.path.exists(f"{args.game_dir}/{game_name}/logs_0/scores.json")
+
+    assert client.job(job["id"]) == states[-1]
+    assert [job["id"] for job in client.jobs(STATUS_DONE)] == [job["id"]]
+    assert client.status()["counts"] == {STATUS_DONE: 1}
+
+
+def test_cancel_queued_job(client, replay):
+    job = client.submit(JOB_EXTRACT, replay=replay)
+    assert client.cancel(job["id"])["status"] == STATUS_CANCELLED
+    # the job has ended, following it returns at once
+    assert [state["status"] for state in client.follow(job["id"])] == [STATUS_CANCELLED]
+    with pytest.raises(JobException):
+        client.cancel(job["id"])
+
+
+def test_api_errors(tmp_path, client):
+    with pytest.raises(JobException, match="could not be found"):
+        client.submit(JOB_EXTRACT, replay=str(tmp_path / "missing.rep"))
+    with pytest.raises(JobException, match="does not exist"):
+        client.job(1000)
+    with pytest.raises(JobException, match="not found"):
+        client._request("GET", "/replays")
+    with pytest.raises(ObserverException):
+        ServerClient(f"unix:{tmp_path}/missing.sock").status()
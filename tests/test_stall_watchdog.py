@@ -0,0 +1,64 @@
+import pytest
+
+import observer.stall_watchdog
+from observer.stall_watchdog import StallWatchdog, last_frame
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(observer.stall_watchdog, "time", clock)
+    return clock
+
+
+def test_last_frame():
+    assert last_frame(b"frame,time\n10,1.0\n11,1.1\n12,1.") == 11
+    assert last_frame(b"frame,time\n") is None
+    assert last_frame(b"") is None
+
+
+def test_watchdog_stall(clock):
+    frames = [10]
+    watchdog = StallWatchdog([lambda: frames[0], lambda: None], stall_timeout=60)
+    assert not watchdog.check()
+
+    clock.now += 59
+    assert not watchdog.check()
+    clock.now += 1
+    assert watchdog.check()
+    assert watchdog.is_stalled
+    assert watchdog.last_progress == [10, None]
+
+
+def test_watchdog_no_stall(clock):
+    frames = [0]
+
+    def read_progress():
+        frames[0] += 1
+        return frames[0]
+
+    def read_fails():
+        raise OSError("container is gone")
+
+    watchdog = StallWatchdog([read_progress, read_fails], stall_timeout=60)
+    for _ in range(10):
+        clock.now += 30
+        assert not watchdog.check()
+    assert watchdog.last_progress == [10, None]
+
+
+def test_watchdog_not_started(clock):
+    # no container has written a frame yet, counted from the start of the game
+    watchdog = StallWatchdog([lambda: None], stall_timeout=60)
+    clock.now += 59
+    assert not watchdog.check()
+    clock.now += 1
+    assert watchdog.check()
@@ -0,0 +1,74 @@
+import json
+
+from observer.timing import (
+    PHASE_CONTAINERS_STARTED, PHASE_CREATE, PhaseStats, PhaseTimer, phase_durations, quantile, record_timings
+)
+
+
+def test_timer_reads_latest_marker(tmp_path):
+    log_dirs = [tmp_path / "logs_0", tmp_path / "logs_1"]
+    for log_dir, at in zip(log_dirs, (103.0, 105.5)):
+        log_dir.mkdir()
+        (log_dir / ".ready_gui").write_text(f"{at}\n")
+    # a marker which is not written yet is skipped
+    (log_dirs[0] / ".ready_game").write_text("")
+
+    timer = PhaseTimer()
+    timer.mark(PHASE_CREATE, at=100.0)
+    timer.mark(PHASE_CONTAINERS_STARTED, at=101.25)
+    timer.read_markers([str(log_dir) for log_dir in log_dirs])
+
+    assert timer.timings() == {"create": 0.0, "containers_started": 1.25, "x_started": 5.5}
+
+
+def test_phase_durations_in_phase_order():
+    timings = {"game_end": 60.0, "create": 0.0, "containers_started": 2.0, "x_started": 5.0}
+    assert phase_durations(timings) == {
+        "containers_started": 2.0, "x_started": 3.0, "game_end": 55.0, "total": 60.0
+    }
+    assert phase_durations({"create": 0.0}) == {}
+
+
+def test_quantile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert quantile(values, 0.5) == 3.0
+    assert quantile(values, 0.9) == 4.6
+    assert quantile(values, 1.0) == 5.0
+    assert quantile([7.0], 0.99) == 7.0
+
+
+def test_phase_stats_summary_and_prometheus():
+    stats = PhaseStats()
+    for seconds in (1.0, 2.0, 3.0):
+        stats.add({"x_started": seconds})
+
+    summary = stats.summary()["x_started"]
+    assert summary["count"] == 3
+    assert summary["sum"] == 6.0
+    assert summary["mean"] == 2.0
+    assert summary["p50"] == 2.0
+
+    prometheus = stats.prometheus()
+    assert 'observer_game_phase_seconds{phase="x_started",quantile="0.5"} 2.000' in prometheus
+    assert 'observer_game_phase_seconds_count{phase="x_started"} 3' in prometheus
+
+
+def test_record_timings_json_lines(tmp_path):
+    metrics_file = tmp_path / "metrics.jsonl"
+    for game_name in ("a", "b"):
+        record_timings(game_name, {"create": 0.0, "game_end": 10.0}, str(metrics_file))
+
+    lines = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert [line["game_name"] for line in lines] == ["a", "b"]
+    assert lines[0]["durations"] == {"game_end": 10.0, "total": 10.0}
+
+
+def test_record_timings_prometheus_textfile(tmp_path):
+    metrics_file = tmp_path / "observer.prom"
+    record_timings("a", {"create": 0.0, "game_end": 10.0}, str(metrics_file))
+
+    content = metrics_file.read_text()
+    assert content.startswith("# HELP observer_game_phase_seconds")
+    assert 'observer_game_phase_seconds_count{phase="game_end"}' in content
+    # written atomically, no temporary file is left behind
+    assert [file.name for file in tmp_path.iterdir()] == ["observer.prom"]
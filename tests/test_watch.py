@@ -0,0 +1,66 @@
+import os
+import queue
+
+import pytest
+
+from observer import watch
+from observer.watch import DirectoryWatcher
+
+
+def _watch(tmp_path):
+    replays = queue.Queue()
+    watcher = DirectoryWatcher(str(tmp_path), replays.put)
+    return watcher, replays
+
+
+def _next(replays):
+    return os.path.basename(replays.get(timeout=10))
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def mode(request, monkeypatch):
+    if request.param == "polling":
+        monkeypatch.setattr(watch, "_load_inotify", lambda: None)
+        monkeypatch.setattr(watch, "POLL_INTERVAL", 0.05)
+    elif watch._load_inotify() is None:
+        pytest.skip("inotify is not available")
+    return request.param
+
+
+def test_replays_are_picked_up(tmp_path, mode):
+    (tmp_path / "before.rep").write_bytes(b"replay")
+    watcher, replays = _watch(tmp_path)
+    watcher.start()
+    try:
+        assert _next(replays) == "before.rep"
+
+        (tmp_path / "notes.txt").write_text("not a replay")
+        (tmp_path / "written.REP").write_bytes(b"replay")
+        assert _next(replays) == "written.REP"
+
+        (tmp_path / "moved.tmp").write_bytes(b"replay")
+        os.rename(tmp_path / "moved.tmp", tmp_path / "moved.rep")
+        assert _next(replays) == "moved.rep"
+        assert replays.empty()
+    finally:
+        watcher.stop()
+        watcher.join(10)
+    assert not watcher.is_alive()
+
+
+def test_errors_of_callback_are_logged(tmp_path, mode):
+    picked = queue.Queue()
+
+    def on_replay(path):
+        picked.put(path)
+        raise ValueError("cannot queue")
+
+    (tmp_path / "a.rep").write_bytes(b"replay")
+    (tmp_path / "b.rep").write_bytes(b"replay")
+    watcher = DirectoryWatcher(str(tmp_path), on_replay)
+    watcher.start()
+    try:
+        assert sorted(os.path.basename(picked.get(timeout=10)) for _ in range(2)) == ["a.rep", "b.rep"]
+    finally:
+        watcher.stop()
+        watcher.join(10)